@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Synthetic apt root: dpkg status, apt lists and sources for N packages
+
+The layout mirrors / so it can be used with VAPT_APT_ROOT, and apt itself
+reads it with -o Dir::State=... -o Dir::Etc=... (see apt_dir_options).
+
+With --repo N, ROOT/repo is also a file:// repository of N more packages,
+listed in sources.list.d but not fetched yet (for single source updates).
+
+Usage: bench/apt_fixture.py ROOT [--packages N] [--seed S] [--repo N]
+"""
+import os
+import sys
+import random
+import hashlib
+import argparse
+import subprocess
+
+HOST = "bench.invalid_debian"
+SUITE = "bench"
+WORDS = ("core", "data", "util", "net", "gtk", "qt", "perl", "python3", "ruby", "font",
+		 "doc", "dev", "tools", "common", "server", "client", "audio", "video", "image",
+		 "crypto", "xml", "json", "http", "sql", "shell", "kernel", "firmware", "theme")
+SECTIONS = ("admin", "devel", "doc", "libs", "net", "python", "sound", "utils", "web", "x11")
+PRIORITIES = ("required", "important", "standard", "optional")
+
+
+def native_arch() -> str:
+	try:
+		return subprocess.run(["dpkg", "--print-architecture"], capture_output=True,
+							  text=True).stdout.strip() or "amd64"
+	except OSError:
+		return "amd64"
+
+
+def package_names(count: int, rng: random.Random) -> list:
+	names = set()
+	while len(names) < count:
+		parts = rng.sample(WORDS, rng.randint(1, 3))
+		prefix = "lib" if rng.random() < 0.4 else ""
+		names.add(prefix + "-".join(parts) + str(rng.randint(0, count)))
+	return sorted(names)
+
+
+def stanza(name: str, version: str, arch: str, rng: random.Random, names: list) -> str:
+	words = rng.sample(WORDS, 4)
+	short = "%s %s for %s" % (words[0], words[1], words[2])
+	long_desc = " This package provides the %s %s.\n .\n It is part of the %s suite." % (
+		words[2], words[3], words[0])
+	fields = [
+		("Package", name),
+		("Version", version),
+		("Architecture", arch),
+		("Maintainer", "Bench Maintainer %d <bench%d@example.org>" % (len(name), len(name) % 7)),
+		("Installed-Size", str(rng.randint(8, 50000))),
+	]
+	if names and rng.random() < 0.7:
+		deps = rng.sample(names, min(len(names), rng.randint(1, 4)))
+		fields.append(("Depends", ", ".join("%s (>= 0.1)" % d for d in deps)))
+	fields += [
+		("Section", rng.choice(SECTIONS)),
+		("Priority", rng.choice(PRIORITIES)),
+		("Homepage", "https://example.org/%s" % name),
+		# From the words already drawn, the other fields stay the same per seed
+		("Tag", "role::program, implemented-in::%s" % words[3]),
+		("Description", short + "\n" + long_desc),
+		("Description-md5", hashlib.md5((short + "\n" + long_desc).encode()).hexdigest()),
+	]
+	return "".join("%s: %s\n" % (k, v) for k, v in fields)
+
+
+def make_apt_root(root: str, packages: int, seed: int = 0, installed_ratio: float = 0.3,
+				  upgradable_ratio: float = 0.1, arch: str = None) -> dict:
+	"""Write the fixture under root, returns what was generated"""
+	rng = random.Random(seed)
+	arch = arch or native_arch()
+	names = package_names(packages, rng)
+
+	lists_dir = os.path.join(root, "var/lib/apt/lists")
+	for d in (lists_dir + "/partial", os.path.join(root, "var/lib/dpkg"),
+			  os.path.join(root, "var/cache/apt/archives/partial"),
+			  os.path.join(root, "etc/apt/sources.list.d"),
+			  os.path.join(root, "etc/apt/preferences.d"),
+			  os.path.join(root, "etc/apt/apt.conf.d")):
+		os.makedirs(d, exist_ok=True)
+
+	with open(os.path.join(root, "etc/apt/sources.list"), "w") as f:
+		f.write("deb [trusted=yes] http://bench.invalid/debian %s main\n" % SUITE)
+	with open(os.path.join(lists_dir, "%s_dists_%s_Release" % (HOST, SUITE)), "w") as f:
+		f.write("Origin: Bench\nLabel: Bench\nSuite: %s\nCodename: %s\n"
+				"Architectures: %s\nComponents: main\nDescription: vapt benchmark fixture\n"
+				% (SUITE, SUITE, arch))
+
+	installed = []
+	upgradable = []
+	with open(os.path.join(lists_dir, "%s_dists_%s_main_binary-%s_Packages" % (HOST, SUITE, arch)), "w") as lists, \
+			open(os.path.join(root, "var/lib/dpkg/status"), "w") as status:
+		for i, name in enumerate(names):
+			version = "%d.%d-%d" % (rng.randint(0, 9), rng.randint(0, 20), rng.randint(1, 3))
+			text = stanza(name, version, arch, rng, names[max(0, i - 50):i])
+			lists.write(text + "\n")
+			if rng.random() < installed_ratio:
+				# Same record as the list, or apt sees two different versions
+				if rng.random() < upgradable_ratio:
+					text = text.replace("Version: " + version, "Version: " + version + "~old", 1)
+					upgradable.append(name)
+				installed.append(name)
+				text = text.replace("\n", "\nStatus: install ok installed\n", 1)
+				status.write(text + "\n")
+
+	return {"root": root, "arch": arch, "packages": len(names),
+			"installed": len(installed), "upgradable": len(upgradable), "names": names}
+
+
+def make_file_repo(root: str, packages: int, seed: int = 0, arch: str = None) -> dict:
+	"""A file:// repository under root/repo, and its deb822 source"""
+	rng = random.Random(seed + 1)
+	arch = arch or native_arch()
+	names = ["repo-" + name for name in package_names(packages, rng)]
+	repo = os.path.join(os.path.abspath(root), "repo")
+	binary_dir = os.path.join(repo, "dists/local/main/binary-%s" % arch)
+	os.makedirs(binary_dir, exist_ok=True)
+	with open(os.path.join(binary_dir, "Packages"), "w") as f:
+		for name in names:
+			f.write(stanza(name, "1.0-1", arch, rng, []) + "\n")
+	with open(os.path.join(repo, "dists/local/Release"), "w") as f:
+		f.write("Origin: Local\nLabel: Local\nSuite: local\nCodename: local\n"
+				"Architectures: %s\nComponents: main\n" % arch)
+	with open(os.path.join(root, "etc/apt/sources.list.d/local.sources"), "w") as f:
+		f.write("Types: deb\nURIs: file:%s\nSuites: local\nComponents: main\nTrusted: yes\n" % repo)
+	return {"repo": repo, "repo_packages": len(names)}
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("root")
+	parser.add_argument("--packages", type=int, default=10000)
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--repo", type=int, default=0, metavar="N",
+		help="also make a file:// repository of N packages")
+	args = parser.parse_args()
+	res = make_apt_root(args.root, args.packages, args.seed)
+	print("%(packages)d packages, %(installed)d installed, %(upgradable)d upgradable in %(root)s" % res)
+	if args.repo:
+		res = make_file_repo(args.root, args.repo, args.seed, res["arch"])
+		print("%(repo_packages)d packages in the file:// repository %(repo)s" % res)
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Per-query latency of the apt helper co-process vs spawning apt-cache
+
+Usage: bench/bench_apt_helper.py [--repeat N] [--json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+								"..", "vapt", "usr", "bin"))
+os.environ.setdefault("VAPT_CONFIG_PATH", "/tmp/vapt-bench/vapt.yml")
+import vapt  # noqa: E402
+
+
+def timed(fn, repeat: int) -> list:
+	samples = []
+	for _ in range(repeat):
+		t_start = time.perf_counter()
+		fn()
+		samples.append((time.perf_counter() - t_start) * 1000)
+	return samples
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--repeat", type=int, default=20)
+	parser.add_argument("--json", action="store_true", help="machine-readable output")
+	args = parser.parse_args()
+
+	# Start the helper once, outside of the per-query measurements
+	t_start = time.perf_counter()
+	vapt.apt_helper.request("ping")
+	startup_ms = (time.perf_counter() - t_start) * 1000
+
+	names = vapt.apt_pkgnames("lib")[:5] or ["bash"]
+	queries = {
+		"pkgnames": (
+			lambda: vapt.run_command(["apt-cache", "pkgnames", "lib"], env=vapt.APT_ENV_C),
+			lambda: vapt.apt_helper.request("pkgnames", prefix="lib")),
+		"policy": (
+			lambda: vapt.run_command(["apt-cache", "policy", *names], env=vapt.APT_ENV_C),
+			lambda: vapt.apt_helper.request("policy", names=names)),
+		"show": (
+			lambda: vapt.run_command(["apt-cache", "show", names[0]], env=vapt.APT_ENV_C),
+			lambda: vapt.apt_helper.request("show", name=names[0])),
+		"search": (
+			lambda: vapt.run_command(["apt-cache", "search", "python"], env=vapt.APT_ENV_C),
+			lambda: vapt.apt_helper.request("search", terms=["python"])),
+	}
+
+	results = {"helper_startup_ms": startup_ms, "repeat": args.repeat, "queries": {}}
+	for name, (spawn, helper) in queries.items():
+		spawn_ms = timed(spawn, args.repeat)
+		helper_ms = timed(helper, args.repeat)
+		results["queries"][name] = {
+			"apt_cache_median_ms": statistics.median(spawn_ms),
+			"helper_median_ms": statistics.median(helper_ms),
+		}
+	vapt.apt_helper.close()
+
+	if args.json:
+		json.dump(results, sys.stdout, indent=2)
+		print()
+		return 0
+
+	print("helper startup: %.1f ms" % startup_ms)
+	print("%-10s %16s %16s %8s" % ("query", "apt-cache (ms)", "helper (ms)", "speedup"))
+	for name, r in results["queries"].items():
+		speedup = r["apt_cache_median_ms"] / max(r["helper_median_ms"], 1e-6)
+		print("%-10s %16.2f %16.2f %7.1fx" % (name, r["apt_cache_median_ms"],
+											   r["helper_median_ms"], speedup))
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""Run the LocalPackageWindow inspection pipeline headlessly on .deb files
+
+Same steps and order as a package tab: metadata, contents tree (into a
+sorted Gtk.TreeStore, no window), then the icon. Each file runs in its
+own process so peak RSS is per file.
+
+Usage:
+  bench/bench_deb.py FILE.deb... [--output results.json] [--baseline old.json]
+  bench/bench_deb.py --corpus DIR [--files 10,1000,100000] [--compressors gzip,xz,zstd]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+VAPT_DIR = os.path.join(BENCH_DIR, "..", "vapt", "usr", "bin")
+
+
+def run_worker(deb_file: str) -> dict:
+	sys.path.insert(0, VAPT_DIR)
+	import vapt
+	from gi.repository import Gtk
+
+	t_start = time.perf_counter()
+	metadata, _ = vapt.deb_read_info(deb_file)
+	t_metadata = time.perf_counter()
+
+	files = vapt.deb_list_files(deb_file)
+	tree_store = Gtk.TreeStore(str, str)
+	tree_store.set_sort_column_id(0, Gtk.SortType.ASCENDING)
+	for path, size in files:
+		vapt.file_tree_insert(tree_store, path, size)
+	t_tree = time.perf_counter()
+
+	icon = vapt.deb_find_icon(deb_file, [path for path, _ in files])
+	pixbuf = vapt.deb_load_icon(deb_file, icon, 64) if icon else None
+	t_icon = time.perf_counter()
+
+	def ms(t: float) -> dict:
+		return {"value": (t - t_start) * 1000, "unit": "ms", "better": "lower"}
+	# ru_maxrss is in KiB on Linux
+	rss_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+	rss_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+	return {
+		"package": metadata["Package"] if metadata else None,
+		"files": len(files),
+		"deb_bytes": os.path.getsize(deb_file),
+		"icon": icon if pixbuf is not None else None,
+		"time_to_metadata": ms(t_metadata),
+		"time_to_full_tree": ms(t_tree),
+		"time_to_icon": ms(t_icon),
+		"peak_rss": {"value": rss_self, "unit": "bytes", "better": "lower"},
+		"peak_rss_children": {"value": rss_children, "unit": "bytes", "better": "lower"},
+	}
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("debs", nargs="*")
+	parser.add_argument("--corpus", metavar="DIR", help="generate a corpus in DIR and run it")
+	parser.add_argument("--files", default="10,1000,10000,100000")
+	parser.add_argument("--compressors", default="gzip,xz,zstd")
+	parser.add_argument("--output", metavar="FILE", help="write the results as JSON")
+	parser.add_argument("--baseline", metavar="FILE",
+		help="previous --output to compare with, exit 1 on regressions")
+	parser.add_argument("--tolerance", type=float, default=0.2,
+		help="allowed slowdown against the baseline (default: 0.2 = 20%%)")
+	parser.add_argument("--worker", metavar="DEB", help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.worker:
+		json.dump(run_worker(args.worker), sys.stdout)
+		return 0
+
+	debs = list(args.debs)
+	if args.corpus:
+		sys.path.insert(0, BENCH_DIR)
+		from deb_corpus import make_corpus
+		debs += make_corpus(args.corpus, [int(n) for n in args.files.split(",")],
+							args.compressors.split(","))
+
+	results = {"debs": {}}
+	print("%-28s %8s %10s %10s %10s %10s" % ("package", "files", "meta ms", "tree ms",
+		"icon ms", "peak RSS"), file=sys.stderr)
+	for deb in debs:
+		proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", deb],
+							  stdout=subprocess.PIPE, text=True)
+		if proc.returncode != 0:
+			print("%s: inspection failed" % deb, file=sys.stderr)
+			continue
+		res = json.loads(proc.stdout)
+		results["debs"][os.path.basename(deb)] = res
+		print("%-28s %8d %10.1f %10.1f %10.1f %8.1f MB" % (os.path.basename(deb)[:28], res["files"],
+			res["time_to_metadata"]["value"], res["time_to_full_tree"]["value"],
+			res["time_to_icon"]["value"], res["peak_rss"]["value"] / 1e6), file=sys.stderr)
+
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump(results, f, indent=2)
+	else:
+		json.dump(results, sys.stdout, indent=2)
+		print()
+
+	if args.baseline:
+		sys.path.insert(0, BENCH_DIR)
+		from bench_vapt import compare
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+		regressions = compare(results["debs"], baseline.get("debs", {}), args.tolerance)
+		for deb, name, old, new in regressions:
+			print("REGRESSION %s, %s: %.2f -> %.2f" % (deb, name, old, new), file=sys.stderr)
+		return 1 if regressions else 0
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
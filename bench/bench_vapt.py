@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""Benchmark vapt's hot paths against a synthetic apt root
+
+Every size runs in its own process with VAPT_APT_ROOT pointing at a
+fixture from apt_fixture.py, so both backends query the fixture instead
+of the system databases.
+
+Usage:
+  bench/bench_vapt.py [--sizes 1000,10000] [--backend cli|apt_pkg]
+                      [--output results.json] [--baseline old.json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+VAPT_DIR = os.path.join(BENCH_DIR, "..", "vapt", "usr", "bin")
+
+# Regressions smaller than this are noise, whatever the ratio
+NOISE_FLOOR_MS = 1.0
+
+
+def timed(fn, repeat: int) -> list:
+	samples = []
+	for _ in range(repeat):
+		t_start = time.perf_counter()
+		fn()
+		samples.append((time.perf_counter() - t_start) * 1000)
+	return samples
+
+
+def metric(samples: list) -> dict:
+	return {"value": statistics.median(samples), "first": samples[0],
+			"unit": "ms", "better": "lower"}
+
+
+def run_worker(args) -> dict:
+	"""Runs inside the per-size process, VAPT_APT_ROOT already set"""
+	sys.path.insert(0, VAPT_DIR)
+	import vapt
+
+	with open(os.path.join(args.worker, "names.json")) as f:
+		names = json.load(f)
+	vapt.user_config.set("apt_query/backend", args.backend)
+	backend = vapt.get_apt_backend()
+	results = {"backend": backend.name}
+	repeat = args.repeat
+
+	# Autocompletion: prefix lookup plus the extra terms filter
+	prefixes = ["lib", "core", "python3-d", "x"]
+	results["autocompletion"] = metric(timed(
+		lambda: [vapt.apt_lookup_packages(p, ["a"]) for p in prefixes], repeat))
+	results["search"] = metric(timed(lambda: backend.search("audio crypto"), repeat))
+	# What the Search tab waits for before its first rows show up
+	results["search_first_row"] = metric(timed(lambda: next(backend.iter_search("lib"), None), repeat))
+
+	results["installed_population"] = metric(timed(backend.installed, repeat))
+	results["upgradable_population"] = metric(timed(backend.upgradable, repeat))
+
+	# Filter refilter: visibility of every installed row for a few terms
+	rows = [[False, name, version, arch] for name, version, arch in backend.installed()]
+	results["filter_refilter"] = metric(timed(
+		lambda: [[vapt.filter_matches(r, term, [1, 2]) for r in rows]
+				 for term in ("lib", "9.1", "zzz")], repeat))
+
+	sample = names[::max(1, len(names) // 20)]
+	results["package_info_open"] = metric(timed(
+		lambda: [vapt.parse_package_info(backend.show(n)) for n in sample], repeat))
+
+	# Transaction log: a child printing apt-like lines, batched per frame
+	lines = 20000
+	dispatch = vapt.UIDispatcher()
+	dispatch._schedule = lambda: None
+	received = []
+	def log_run():
+		cmd = vapt.Command([sys.executable, "-c",
+			"import sys\nfor i in range(%d): sys.stdout.write('Unpacking pkg%%d (1.0-1) ...\\n' %% i)" % lines],
+			bufsize=1)
+		for i, line in enumerate(cmd.lines()):
+			dispatch.post_batch("log", received.extend, line)
+			if i % 500 == 0:
+				dispatch._drain()
+		dispatch._drain()
+	samples = timed(log_run, max(1, repeat // 2))
+	results["transaction_log"] = {"value": lines / (statistics.median(samples) / 1000),
+								  "unit": "lines/s", "better": "higher"}
+	vapt.apt_helper.close()
+	return results
+
+
+def run_size(size: int, args) -> dict:
+	sys.path.insert(0, BENCH_DIR)
+	from apt_fixture import make_apt_root
+	with tempfile.TemporaryDirectory(prefix="vapt-bench-") as root:
+		t_start = time.perf_counter()
+		fixture = make_apt_root(root, size, seed=args.seed)
+		gen_seconds = time.perf_counter() - t_start
+		with open(os.path.join(root, "names.json"), "w") as f:
+			json.dump(fixture.pop("names"), f)
+
+		env = dict(os.environ, VAPT_APT_ROOT=root,
+				   VAPT_CONFIG_PATH=os.path.join(root, "vapt.yml"),
+				   VAPT_CACHE_DIR=os.path.join(root, "cache"))
+		proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", root,
+							   "--backend", args.backend, "--repeat", str(args.repeat)],
+							  env=env, stdout=subprocess.PIPE, text=True)
+		if proc.returncode != 0:
+			raise SystemExit("benchmark worker failed for %d packages" % size)
+		res = json.loads(proc.stdout)
+		res["fixture"] = dict(fixture, root=None, generate_seconds=gen_seconds)
+		return res
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+	"""[(key, metric, old, new)] of the metrics that got worse than tolerance
+
+	results and baseline map a key (size, file...) to its metrics."""
+	regressions = []
+	for key, metrics in results.items():
+		for name, m in metrics.items():
+			old = baseline.get(key, {}).get(name)
+			if not isinstance(m, dict) or "better" not in m or not isinstance(old, dict):
+				continue
+			if m["better"] == "lower":
+				worse = m["value"] > old["value"] * (1 + tolerance) and \
+					m["value"] - old["value"] > NOISE_FLOOR_MS
+			else:
+				worse = m["value"] < old["value"] / (1 + tolerance)
+			if worse:
+				regressions.append((key, name, old["value"], m["value"]))
+	return regressions
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--sizes", default="1000,10000",
+		help="comma separated package counts (default: 1000,10000)")
+	parser.add_argument("--backend", default="cli", choices=("cli", "apt_pkg", "auto"))
+	parser.add_argument("--repeat", type=int, default=5)
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--output", metavar="FILE", help="write the results as JSON")
+	parser.add_argument("--baseline", metavar="FILE",
+		help="previous --output to compare with, exit 1 on regressions")
+	parser.add_argument("--tolerance", type=float, default=0.2,
+		help="allowed slowdown against the baseline (default: 0.2 = 20%%)")
+	parser.add_argument("--worker", metavar="ROOT", help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.worker:
+		json.dump(run_worker(args), sys.stdout)
+		return 0
+
+	results = {"python": sys.version.split()[0], "backend": args.backend, "sizes": {}}
+	for size in (int(s) for s in args.sizes.split(",")):
+		res = run_size(size, args)
+		results["sizes"][str(size)] = res
+		print("%d packages (%s backend)" % (size, res["backend"]), file=sys.stderr)
+		for name, m in res.items():
+			if isinstance(m, dict) and "unit" in m:
+				print("  %-24s %12.2f %s" % (name, m["value"], m["unit"]), file=sys.stderr)
+
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump(results, f, indent=2)
+	else:
+		json.dump(results, sys.stdout, indent=2)
+		print()
+
+	if args.baseline:
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+		regressions = compare(results["sizes"], baseline.get("sizes", {}), args.tolerance)
+		for size, name, old, new in regressions:
+			print("REGRESSION %s packages, %s: %.2f -> %.2f" % (size, name, old, new), file=sys.stderr)
+		return 1 if regressions else 0
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Synthetic .deb corpus for the local package inspection pipeline
+
+Packages vary in compressor and file count, and ship nested icon themes
+and several .desktop files, like the big desktop applications do.
+
+Usage: bench/deb_corpus.py OUT_DIR [--files 10,1000,100000] [--compressors gzip,xz,zstd]
+"""
+import os
+import sys
+import zlib
+import shutil
+import struct
+import argparse
+import tempfile
+import subprocess
+
+ICON_THEMES = ("hicolor", "Adwaita", "breeze")
+ICON_SIZES = (16, 32, 48, 128, 256)
+FILES_PER_DIR = 100
+
+
+def png(size: int, rgb: tuple = (0xd7, 0x07, 0x51)) -> bytes:
+	"""Solid size x size RGB PNG"""
+	def chunk(kind: bytes, data: bytes) -> bytes:
+		return struct.pack(">I", len(data)) + kind + data + \
+			struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+	row = b"\x00" + bytes(rgb) * size
+	return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)) + \
+		chunk(b"IDAT", zlib.compress(row * size)) + chunk(b"IEND", b"")
+
+
+def write(path: str, data: bytes):
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path, "wb") as f:
+		f.write(data)
+
+
+def make_deb(out_dir: str, files: int, compressor: str, desktop_files: int = 3) -> str:
+	"""Build one package, returns the .deb path"""
+	name = "bench-%s-%d" % (compressor, files)
+	staging = tempfile.mkdtemp(prefix="vapt-deb-")
+	try:
+		write(os.path.join(staging, "DEBIAN/control"), (
+			"Package: %s\nVersion: 1.0-1\nArchitecture: all\n"
+			"Maintainer: Bench Maintainer <bench@example.org>\nInstalled-Size: %d\n"
+			"Depends: libc6 (>= 2.17), libgtk-3-0 | libgtk-4-1\nHomepage: https://example.org/%s\n"
+			"Description: vapt benchmark package\n %d files compressed with %s.\n"
+			% (name, max(1, files // 4), name, files, compressor)).encode())
+
+		# Payload spread over nested folders, with varied sizes
+		for i in range(files):
+			d = "usr/share/%s/data/%03d/%03d" % (name, i // (FILES_PER_DIR * 100),
+												 (i // FILES_PER_DIR) % 100)
+			write(os.path.join(staging, d, "file%06d.txt" % i), b"x" * (i % 4096))
+
+		for theme in ICON_THEMES:
+			for size in ICON_SIZES:
+				write(os.path.join(staging, "usr/share/icons/%s/%dx%d/apps/%s.png" % (theme, size, size, name)),
+					  png(size))
+			write(os.path.join(staging, "usr/share/icons/%s/scalable/apps/%s.svg" % (theme, name)),
+				  b'<svg xmlns="http://www.w3.org/2000/svg" width="64" height="64">'
+				  b'<rect width="64" height="64" fill="#d70751"/></svg>')
+
+		for i in range(desktop_files):
+			write(os.path.join(staging, "usr/share/applications/%s-%d.desktop" % (name, i)), (
+				"[Desktop Entry]\nType=Application\nName=Bench %d\nExec=/usr/bin/%s\nIcon=%s\n"
+				% (i, name, name)).encode())
+
+		deb = os.path.join(out_dir, name + ".deb")
+		subprocess.run(["dpkg-deb", "--root-owner-group", "-Z" + compressor, "--build", staging, deb],
+					   check=True, stdout=subprocess.DEVNULL)
+		return deb
+	finally:
+		shutil.rmtree(staging, ignore_errors=True)
+
+
+def make_corpus(out_dir: str, file_counts: list, compressors: list) -> list:
+	os.makedirs(out_dir, exist_ok=True)
+	return [make_deb(out_dir, files, compressor)
+			for files in file_counts for compressor in compressors]
+
+
+def main() -> int:
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("out_dir")
+	parser.add_argument("--files", default="10,1000,10000,100000",
+		help="comma separated file counts (default: 10,1000,10000,100000)")
+	parser.add_argument("--compressors", default="gzip,xz,zstd",
+		help="comma separated dpkg-deb -Z types (default: gzip,xz,zstd)")
+	args = parser.parse_args()
+	for deb in make_corpus(args.out_dir, [int(n) for n in args.files.split(",")],
+						   args.compressors.split(",")):
+		print(deb)
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
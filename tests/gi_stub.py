@@ -0,0 +1,53 @@
+"""Stand-in for PyGObject where it is not installed
+
+vapt.py imports gi at module level for its windows. The tests only
+run headless code, so any name under gi.repository is enough: a class
+that can be subclassed, called and asked for any attribute.
+"""
+import sys
+import types
+
+
+class _AnythingType(type):
+	# Class attributes too, e.g. GLib.IOCondition.IN
+	def __getattr__(cls, name):
+		if name.startswith("__"):
+			raise AttributeError(name)
+		return _Anything()
+
+
+class _Anything(metaclass=_AnythingType):
+	def __init__(self, *args, **kwargs):
+		pass
+
+	def __getattr__(self, name):
+		return _Anything()
+
+	def __call__(self, *args, **kwargs):
+		return _Anything()
+
+
+class _Namespace(types.ModuleType):
+	def __getattr__(self, name):
+		if name.startswith("__"):
+			raise AttributeError(name)
+		cls = type(name, (_Anything,), {})
+		setattr(self, name, cls)
+		return cls
+
+
+def install():
+	"""Put the stub in sys.modules, unless the real gi is importable"""
+	try:
+		import gi  # noqa: F401
+		return
+	except ImportError:
+		pass
+	gi = types.ModuleType("gi")
+	gi.require_version = lambda *args: None
+	repository = types.ModuleType("gi.repository")
+	for name in ("GLib", "GObject", "Gtk", "Gdk", "Gio", "GdkPixbuf", "Pango"):
+		setattr(repository, name, _Namespace("gi.repository." + name))
+	gi.repository = repository
+	sys.modules["gi"] = gi
+	sys.modules["gi.repository"] = repository
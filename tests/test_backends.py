@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Same package queries against every backend, on a fixture apt root
+
+The fixture comes from bench/apt_fixture.py and VAPT_APT_ROOT points
+both backends at it (-o Dir::State/Dir::Etc/Dir::Cache for apt-cache,
+the same settings in apt_pkg's config). Expected values are read from
+the fixture files, not from any backend.
+
+Usage: python3 -m unittest discover tests
+"""
+import os
+import re
+import sys
+import shutil
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_DIR, "..", "bench"))
+sys.path.insert(0, os.path.join(TESTS_DIR, "..", "vapt", "usr", "bin"))
+
+import apt_fixture
+import gi_stub
+
+FIXTURE_PACKAGES = 300
+vapt = None
+fixture = None
+
+
+def setUpModule():
+	global vapt, fixture
+	root = tempfile.mkdtemp(prefix="vapt-test-")
+	fixture = apt_fixture.make_apt_root(root, FIXTURE_PACKAGES, seed=1)
+	# Read when vapt is imported, and by the helper process it starts
+	os.environ["VAPT_APT_ROOT"] = root
+	os.environ["VAPT_CONFIG_PATH"] = os.path.join(root, "vapt.yml")
+	os.environ["VAPT_STATE_DIR"] = os.path.join(root, "state")
+	# Only headless code is tested, PyGObject is not needed
+	gi_stub.install()
+	import vapt as module
+	vapt = module
+	fixture.update(read_fixture(root))
+
+
+def tearDownModule():
+	vapt.apt_helper.close()
+	shutil.rmtree(fixture["root"], ignore_errors=True)
+
+
+def read_fixture(root: str) -> dict:
+	"""{name: fields} of the Packages list and of the dpkg status"""
+	lists_dir = os.path.join(root, "var/lib/apt/lists")
+	list_file = next(os.path.join(lists_dir, f) for f in os.listdir(lists_dir)
+					 if f.endswith("_Packages"))
+	def stanzas(path):
+		with open(path) as f:
+			return {fields["Package"]: fields for fields in vapt.iter_deb822(f)}
+	return {"available": stanzas(list_file),
+			"status": stanzas(os.path.join(root, "var/lib/dpkg/status"))}
+
+
+class BackendTests:
+	"""Mixed into one TestCase per backend"""
+	backend_name = None
+
+	def setUp(self):
+		vapt.apt_helper.disabled = True
+		vapt.user_config.set("apt_query/backend", self.backend_name)
+		vapt.reset_apt_backend()
+		self.backend = vapt.get_apt_backend()
+		self.assertEqual(self.backend.name, self.backend_name)
+
+	def pick(self, installed: bool, upgradable: bool = False) -> str:
+		for name in sorted(fixture["available"]):
+			status = fixture["status"].get(name)
+			if (status is not None) == installed and \
+					(status is not None and status["Version"].endswith("~old")) == upgradable:
+				return name
+		self.skipTest("no such package in the fixture")
+
+	def test_pkgnames(self):
+		for prefix in ("lib", "core", "zzz"):
+			self.assertEqual(sorted(self.backend.pkgnames(prefix)),
+							 sorted(n for n in fixture["available"] if n.startswith(prefix)))
+
+	def test_policy(self):
+		name = self.pick(installed=False)
+		installed, candidate, archs = self.backend.policy(name)
+		self.assertEqual(installed, "(none)")
+		self.assertEqual(candidate, fixture["available"][name]["Version"])
+		self.assertEqual(archs, [fixture["arch"]])
+
+		name = self.pick(installed=True, upgradable=True)
+		installed, candidate, _ = self.backend.policy(name)
+		self.assertEqual(installed, fixture["status"][name]["Version"])
+		self.assertEqual(candidate, fixture["available"][name]["Version"])
+
+	def test_show(self):
+		name = self.pick(installed=False)
+		records = list(vapt.iter_deb822(self.backend.show(name).splitlines()))
+		self.assertEqual([r["Package"] for r in records], [name])
+		self.assertEqual(records[0]["Version"], fixture["available"][name]["Version"])
+		self.assertEqual(self.backend.show("no-such-package"), "")
+
+	def test_search(self):
+		for terms in (["audio"], ["audio", "crypto"], ["zzz-nothing"]):
+			expected = sorted(name for name, fields in fixture["available"].items()
+							  if all(re.search(t, name + "\n" + fields["Description"], re.I)
+									 for t in terms))
+			rows = self.backend.search(" ".join(terms))
+			self.assertEqual(sorted(name for name, _ in rows), expected)
+			self.assertEqual(sorted(name for name, _ in self.backend.iter_search(" ".join(terms))),
+							 expected)
+		name, description = self.backend.search("audio")[0]
+		self.assertEqual(description, fixture["available"][name]["Description"].split("\n")[0])
+
+	def test_depends(self):
+		name = next(n for n, fields in sorted(fixture["available"].items()) if "Depends" in fields)
+		self.assertEqual(self.backend.depends(name).get("Depends"),
+						 vapt.apt_parse_relations(fixture["available"][name]["Depends"]))
+
+	def test_upgradable(self):
+		rows = self.backend.upgradable()
+		expected = sorted(name for name, fields in fixture["status"].items()
+						  if fields["Version"].endswith("~old"))
+		self.assertEqual(sorted(row[0] for row in rows), expected)
+		for name, candidate, installed, arch in rows:
+			self.assertEqual(candidate, fixture["available"][name]["Version"])
+			self.assertEqual(installed, fixture["status"][name]["Version"])
+			self.assertEqual(arch, fixture["arch"])
+
+	def test_installed(self):
+		self.assertEqual(sorted((name, version) for name, version, _ in self.backend.installed()),
+						 sorted((name, fields["Version"]) for name, fields in fixture["status"].items()))
+
+
+class CliBackendTest(BackendTests, unittest.TestCase):
+	backend_name = "cli"
+
+
+class CliHelperBackendTest(CliBackendTest):
+	"""The CLI backend answered by the query helper instead of apt-cache"""
+	def setUp(self):
+		super().setUp()
+		vapt.apt_helper.disabled = False
+
+
+class AptPkgBackendTest(BackendTests, unittest.TestCase):
+	backend_name = "apt_pkg"
+
+	def setUp(self):
+		try:
+			import apt_pkg  # noqa: F401
+		except ImportError:
+			self.skipTest("python3-apt is not installed")
+		super().setUp()
+
+
+if __name__ == "__main__":
+	unittest.main()
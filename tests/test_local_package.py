@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Local package window and the instance socket, without a display
+
+The handlers are called on a stand-in window that borrows them from
+LocalPackageWindow, LocalInstallerWindow is replaced by a recorder.
+
+Usage: python3 -m unittest discover tests
+"""
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_DIR, "..", "vapt", "usr", "bin"))
+
+import gi_stub
+
+vapt = None
+state_root = None
+
+
+def setUpModule():
+	global vapt, state_root
+	state_root = tempfile.mkdtemp(prefix="vapt-test-")
+	os.environ.setdefault("VAPT_CONFIG_PATH", os.path.join(state_root, "vapt.yml"))
+	os.environ.setdefault("VAPT_STATE_DIR", os.path.join(state_root, "state"))
+	gi_stub.install()
+	import vapt as module
+	vapt = module
+
+
+def tearDownModule():
+	shutil.rmtree(state_root, ignore_errors=True)
+
+
+class Button:
+	def __init__(self):
+		self.label = None
+		self.sensitive = True
+
+	def get_sensitive(self):
+		return self.sensitive
+
+	def set_sensitive(self, sensitive):
+		self.sensitive = sensitive
+
+	def set_label(self, label):
+		self.label = label
+
+
+class Window:
+	"""Just the state on_install touches"""
+	def __init__(self, installs, reinstalls):
+		self.list_installs = list(installs)
+		self.list_reinstalls = list(reinstalls)
+		self.big_btn_install = Button()
+
+
+class InstallButtonTest(unittest.TestCase):
+	def setUp(self):
+		# Borrowed once vapt is imported
+		Window.on_install = vapt.LocalPackageWindow.on_install
+		Window.update_install_count = vapt.LocalPackageWindow.update_install_count
+		patcher = mock.patch.object(vapt, "LocalInstallerWindow")
+		self.installer = patcher.start()
+		self.addCleanup(patcher.stop)
+		# The language files are only installed under /usr/share
+		patcher = mock.patch.object(vapt, "l10n_strings",
+									{"str_install_x_packages": "Install (%d) package(s)"})
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def test_install_one(self):
+		window = Window(["/tmp/a.deb", "/tmp/b.deb"], ["/tmp/c.deb"])
+		button = Button()
+		window.on_install(button, "/tmp/a.deb", False)
+
+		self.installer.assert_called_once_with(["/tmp/a.deb"], None)
+		self.assertFalse(button.sensitive)
+		self.assertEqual(window.list_installs, ["/tmp/b.deb"])
+		self.assertEqual(window.big_btn_install.label,
+						 "Install (2) package(s)")
+		self.assertTrue(window.big_btn_install.sensitive)
+
+		# A second click on the same tab does nothing
+		window.on_install(button, "/tmp/a.deb", False)
+		self.installer.assert_called_once()
+
+	def test_install_last(self):
+		window = Window(["/tmp/a.deb"], ["/tmp/c.deb"])
+		window.on_install(Button(), "/tmp/c.deb", True)
+		self.installer.assert_called_once_with(None, ["/tmp/c.deb"])
+		window.on_install(Button(), "/tmp/a.deb", False)
+
+		self.assertEqual(window.list_installs, [])
+		self.assertEqual(window.list_reinstalls, [])
+		self.assertEqual(window.big_btn_install.label,
+						 "Install (0) package(s)")
+		# Nothing left for install all
+		self.assertFalse(window.big_btn_install.sensitive)
+
+	def test_without_install_all(self):
+		window = Window(["/tmp/a.deb"], [])
+		window.big_btn_install = None
+		window.on_install(Button(), "/tmp/a.deb", False)
+		self.assertEqual(window.list_installs, [])
+
+
+class InstanceServerTest(unittest.TestCase):
+	def setUp(self):
+		patcher = mock.patch.object(vapt, "instance_socket_name",
+									"\0vapt-test-%d-%d" % (os.getpid(), id(self)))
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		# Straight to the callback, there is no main loop
+		patcher = mock.patch.object(vapt.ui_dispatch, "post", lambda fn, *args: fn(*args))
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		self.received = []
+		self.arrived = threading.Event()
+		def on_files(files):
+			self.received.append(files)
+			self.arrived.set()
+		self.server = vapt.InstanceServer(on_files)
+		self.addCleanup(self.server.sock.close)
+
+	def connect(self):
+		client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		client.connect(vapt.instance_socket_name)
+		self.addCleanup(client.close)
+		return client
+
+	def test_stalled_client(self):
+		# Connects and never sends its request
+		self.connect()
+		started = time.monotonic()
+		self.server._on_accept(None, None)
+		self.assertLess(time.monotonic() - started, 0.5)
+
+		client = self.connect()
+		client.sendall(b'{"files": ["/tmp/a.deb"]}\n')
+		self.server._on_accept(None, None)
+		self.assertEqual(client.makefile("r").readline(), '{"ok": true}\n')
+		self.assertTrue(self.arrived.wait(5))
+		self.assertEqual(self.received, [["/tmp/a.deb"]])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -1,73 +1,4397 @@
 #!/usr/bin/env python3
+import time
+_startup_t0 = time.perf_counter()
+
+import io
 import re
 import sys
 import glob
 import os.path
-import yaml
 import atexit
+import contextlib
 import threading
 import subprocess
-from PIL import Image
 
-# fmt: off
-import gi
-gi.require_version('Gtk', '3.0')
-from gi.repository import GLib, Gtk, Gdk, Gio, GdkPixbuf, Pango
-# fmt: on
+# == Startup profiling == #
+STARTUP_BUDGET_MS = 300
+
+class StartupProfile:
+	"""Wall time spent in each startup phase, measured from the first line"""
+	def __init__(self, t0: float):
+		self.t0 = t0
+		self.last = t0
+		self.phases = []  # (phase, seconds, counted in the total)
+
+	def mark(self, phase: str, counted: bool = True):
+		"""End phase now; shown but left out of the total if not counted"""
+		now = time.perf_counter()
+		self.phases.append((phase, now - self.last, counted))
+		self.last = now
+
+	@property
+	def total_ms(self) -> float:
+		return sum(seconds for _, seconds, counted in self.phases if counted) * 1000
+
+	def report(self, budget_ms: float = None, file=sys.stderr):
+		for phase, seconds, counted in self.phases:
+			print("%-14s %8.1f ms%s" % (phase, seconds * 1000,
+				"" if counted else " (not counted)"), file=file)
+		print("%-14s %8.1f ms" % ("total", self.total_ms), file=file)
+		if budget_ms is not None:
+			print("%-14s %8.1f ms (%s)" % ("budget", budget_ms,
+				"OK" if self.total_ms <= budget_ms else "EXCEEDED"), file=file)
+
+startup_profile = StartupProfile(_startup_t0)
+startup_profile.mark("imports")
 
 # == Configuration == #
-user_config_path = os.path.expandvars("$VAPT_CONFIG_PATH") or \
+user_config_path = os.environ.get("VAPT_CONFIG_PATH") or \
 	os.path.expandvars("$HOME/.config/vapt.yml")
-os.makedirs(os.path.dirname(user_config_path), exist_ok=True)
 
-user_config = {
+# Disposable data (compiled catalogs, etc.), safe to delete at any time
+cache_dir = os.environ.get("VAPT_CACHE_DIR") or os.path.join(
+	os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "vapt")
+
+# Kept across runs, unlike the cache (update history, ...)
+state_dir = os.environ.get("VAPT_STATE_DIR") or os.path.join(
+	os.environ.get("XDG_STATE_HOME") or os.path.expanduser("~/.local/state"), "vapt")
+
+def atomic_write(path: str, data: bytes):
+	"""Write to a temp file next to path, then rename it over path
+
+	The temp file has a unique name, so concurrent writers of the same path
+	do not clobber each other's, and reaches the disk before the rename."""
+	import tempfile
+	fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".",
+									suffix=".tmp", dir=os.path.dirname(path) or ".")
+	try:
+		with os.fdopen(fd, "wb") as f:
+			try:
+				# mkstemp makes it 0600, keep the mode of the file it replaces
+				os.fchmod(f.fileno(), os.stat(path).st_mode & 0o7777)
+			except FileNotFoundError:
+				pass
+			f.write(data)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmp_path, path)
+	except BaseException:
+		try:
+			os.unlink(tmp_path)
+		except OSError:
+			pass
+		raise
+
+class ConfigStore:
+	"""User settings backed by a YAML file
+
+	Values are addressed by "section/key" paths. The file is parsed once
+	and merged over typed defaults, so missing or mistyped keys fall back
+	to their default. Changes are coalesced into one atomic write per
+	burst, SAVE_DELAY seconds after the last set(). Safe to use from
+	worker threads."""
+	SAVE_DELAY = 0.5
+
+	def __init__(self, path: str, defaults: dict):
+		import copy
+		self.path = path
+		self.defaults = defaults
+		self.data = copy.deepcopy(defaults)
+		self.lock = threading.RLock()
+		# One flush at a time (timer, atexit...), set() does not wait for it
+		self.write_lock = threading.Lock()
+		self.dirty = False
+		self.save_timer = None
+
+	@staticmethod
+	def _merge(defaults: dict, loaded: dict, prefix: str = "") -> dict:
+		res = {}
+		for key, default in defaults.items():
+			value = loaded.get(key, default) if isinstance(loaded, dict) else default
+			if isinstance(default, dict):
+				res[key] = ConfigStore._merge(default, value, prefix + key + "/")
+			elif type(value) is type(default):
+				res[key] = value
+			else:
+				print("Ignoring invalid setting %s%s: %r" % (prefix, key, value), file=sys.stderr)
+				res[key] = default
+		return res
+
+	def load(self):
+		if not os.path.isfile(self.path):
+			return
+		import yaml
+		try:
+			with open(self.path, 'r', encoding="utf-8") as file:
+				loaded = yaml.load(file, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+		except (OSError, yaml.YAMLError) as e:
+			print("Could not read config file %s: %s" % (self.path, e), file=sys.stderr)
+			return
+		with self.lock:
+			self.data = self._merge(self.defaults, loaded or {})
+
+	def get(self, path: str):
+		with self.lock:
+			conf = self.data
+			for p in path.split("/"):
+				conf = conf[p]
+			return conf
+
+	def set(self, path: str, value):
+		paths = path.split("/")
+		with self.lock:
+			conf = self.data
+			for p in paths[:-1]:
+				conf = conf[p]
+			if conf.get(paths[-1]) == value:
+				return
+			conf[paths[-1]] = value
+			self.dirty = True
+
+			# Restart the delay, a burst of changes is written once
+			if self.save_timer is not None:
+				self.save_timer.cancel()
+			self.save_timer = threading.Timer(self.SAVE_DELAY, self.flush)
+			self.save_timer.daemon = True
+			self.save_timer.start()
+
+	def flush(self):
+		"""Write pending changes now"""
+		import yaml
+		with self.write_lock:
+			with self.lock:
+				if self.save_timer is not None:
+					self.save_timer.cancel()
+					self.save_timer = None
+				if not self.dirty:
+					return
+				data = yaml.dump(self.data).encode("utf-8")
+				self.dirty = False
+			try:
+				os.makedirs(os.path.dirname(self.path), exist_ok=True)
+				atomic_write(self.path, data)
+			except OSError as e:
+				print("Could not save config file %s: %s" % (self.path, e), file=sys.stderr)
+				# Written again on the next flush (at the latest at exit)
+				with self.lock:
+					self.dirty = True
+
+user_config = ConfigStore(user_config_path, {
 	'editor': {
 		'l10n_file': '',
 		'installs_autocompletion': True,
 		'upgrades_selected_by_default': True,
+		'search_as_you_type': False,
 	},
 	'apt_install': {
 		'fix_missing': True,
 		'fix_broken': True,
 		'fix_policy': False
+	},
+	'apt_query': {
+		# auto, apt_pkg (python3-apt) or cli
+		'backend': 'auto',
 	}
-}
+})
+atexit.register(user_config.flush)
 
 # == Localization == #
 lang_file_path = None
+l10n_dir = "/usr/share/vapt/l10n"
 master_lang_file_path = "/usr/share/vapt/l10n/en.yml"
 
 langs_available = [{"display": "", "file": ""}]
-l10n_strings = {}
-l10n_strings_master = {}
+l10n_index = {}
+l10n_strings = None
+l10n_strings_master = None
 
+L10N_CACHE_VERSION = 1
+
+
+def is_valid_l10n_file(yml: dict) -> bool:
+	locales = yml.get('locales', [])
+	strings = yml.get('strings', {})
+	displayName = yml.get('displayName', "")
+	return locales and strings and displayName
+
+def _l10n_catalog_path(lang_file: str) -> str:
+	return os.path.join(cache_dir, "l10n-%s.marshal" %
+						os.path.splitext(os.path.basename(lang_file))[0])
+
+def _l10n_compile(lang_file: str) -> dict:
+	"""Parse a YAML language file, store its strings compiled, return its index entry"""
+	import yaml
+	with open(lang_file, mode="r", encoding="utf-8") as f:
+		yml = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+
+	entry = {"valid": False, "displayName": "", "locales": [], "strings": {}}
+	if isinstance(yml, dict) and is_valid_l10n_file(yml):
+		entry["valid"] = True
+		entry["displayName"] = yml.get('displayName', "")
+		entry["locales"] = list(yml.get('locales', []))
+		entry["strings"] = dict(yml.get('strings', {}))
+	return entry
+
+def l10n_catalog_index(directory: str = None) -> dict:
+	"""Return {lang_file: entry} for every language file in directory
+
+	Entries hold displayName, locales and validity. Index and catalogs are
+	kept compiled in cache_dir and a file is only parsed again when its
+	mtime or size changed."""
+	import marshal
+	directory = directory or l10n_dir
+	index_path = os.path.join(cache_dir, "l10n-index.marshal")
+
+	cached = {}
+	try:
+		with open(index_path, "rb") as f:
+			data = marshal.load(f)
+		if data.get("version") == L10N_CACHE_VERSION and data.get("dir") == directory:
+			cached = data["files"]
+	except (OSError, EOFError, ValueError, TypeError, KeyError):
+		pass
+
+	index = {}
+	dirty = False
+	for lang_file in sorted(glob.glob(os.path.join(directory, "*.yml"))):
+		try:
+			st = os.stat(lang_file)
+		except OSError:
+			continue
+		stamp = (st.st_mtime_ns, st.st_size)
+
+		entry = cached.get(lang_file)
+		if entry is not None and tuple(entry["stamp"]) == stamp and \
+				os.path.isfile(_l10n_catalog_path(lang_file)):
+			index[lang_file] = entry
+			continue
+
+		try:
+			compiled = _l10n_compile(lang_file)
+		except Exception as e:
+			print("Could not read language file %s: %s" % (lang_file, e), file=sys.stderr)
+			continue
+		strings = compiled.pop("strings")
+		compiled["stamp"] = stamp
+		index[lang_file] = compiled
+		dirty = True
+
+		try:
+			os.makedirs(cache_dir, exist_ok=True)
+			atomic_write(_l10n_catalog_path(lang_file), marshal.dumps(strings))
+		except OSError:
+			pass
+
+	if dirty or len(index) != len(cached):
+		try:
+			os.makedirs(cache_dir, exist_ok=True)
+			atomic_write(index_path, marshal.dumps({
+				"version": L10N_CACHE_VERSION, "dir": directory, "files": index}))
+		except OSError:
+			pass
+	return index
+
+def l10n_load_strings(lang_file: str) -> dict:
+	"""Strings of a language file, from the compiled catalog when possible"""
+	import marshal
+	if lang_file is None:
+		return {}
+	try:
+		with open(_l10n_catalog_path(lang_file), "rb") as f:
+			strings = marshal.load(f)
+		if isinstance(strings, dict):
+			return strings
+	except (OSError, EOFError, ValueError, TypeError):
+		pass
+	try:
+		return _l10n_compile(lang_file)["strings"]
+	except Exception:
+		return {}
 
 def Localize(key: str) -> str:
 	global l10n_strings
 	global l10n_strings_master
+	# Catalogs are loaded on first use
+	if l10n_strings is None:
+		l10n_strings = l10n_load_strings(lang_file_path)
 	if key in l10n_strings:
 		return l10n_strings[key]
+	if l10n_strings_master is None:
+		l10n_strings_master = l10n_load_strings(master_lang_file_path)
 	if key in l10n_strings_master:
 		return l10n_strings_master[key]
 	return key
 
 
 # == APT Util == #
-APT_LANG_USER = []
-APT_LANG = ["env", "LANG=C", "env", "LC=C", "env", "LC_ALL=C", "env", "LANGUAGE=C", "env", "LC_MESSAGES=C"]
-APT_NONINTERACTIVE = ["env", "DEBIAN_FRONTEND=noninteractive"]
+# Environment overrides passed straight to the child process
+APT_ENV_USER = {}  # user terminal language, saved at startup
+APT_ENV_C = {"LANG": "C", "LC": "C", "LC_ALL": "C", "LANGUAGE": "C", "LC_MESSAGES": "C"}
+APT_ENV_NONINTERACTIVE = {"DEBIAN_FRONTEND": "noninteractive"}
+
+# == Command runner == #
+
+class CommandRecord:
+	"""Timing of one child process, from spawn to exit"""
+	def __init__(self, argv: list):
+		self.argv = list(argv)
+		self.started = time.monotonic()
+		self.ended = None
+		self.returncode = None
+		self.bytes_read = 0
+		self.parse_seconds = 0.0
+
+	@property
+	def latency(self) -> float:
+		return (self.ended or time.monotonic()) - self.started
+
+command_stats = []
+command_stats_lock = threading.Lock()
+COMMAND_STATS_MAX = 2000
+
+class Command:
+	"""Child process started through the central runner
+
+	Takes an explicit environment mapping, merged over os.environ, instead
+	of prefixing the command with env(1). Output read through lines() or
+	communicate() and the time spent in parsing() are recorded, and the
+	record is added to command_stats once the process exits.
+
+	Started from a scheduler job, the process is killed if the job is
+	cancelled, unless cancellable is False (e.g. shared helpers).
+
+	While recording a session its output is kept for the archive, and
+	while replaying one nothing is started: the recording is served."""
+	def __init__(self, argv: list, env: dict = None, stdin=None,
+				 stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+				 text: bool = True, bufsize: int = -1, cancellable: bool = True):
+		child_env = None
+		if env:
+			child_env = dict(os.environ)
+			child_env.update(env)
+		self.record = CommandRecord(argv)
+		self.chunks = [] if session_recorder is not None else None
+		if session_replay is not None:
+			self.proc = session_replay.spawn(argv, text)
+		else:
+			self.proc = subprocess.Popen(argv, env=child_env, stdin=stdin,
+										 stdout=stdout, stderr=stderr,
+										 text=text, bufsize=bufsize)
+		self._stdout = self.proc.stdout
+		if self.chunks is not None and self._stdout is not None:
+			self._stdout = _RecordingStream(self._stdout, self)
+		token = current_cancel_token() if cancellable else None
+		if token is not None:
+			token.attach(self)
+
+	@property
+	def stdin(self):
+		return self.proc.stdin
+
+	@property
+	def stdout(self):
+		return self._stdout
+
+	@property
+	def returncode(self) -> int:
+		return self.proc.returncode
+
+	def _finish(self):
+		if self.record.ended is not None:
+			return
+		self.record.ended = time.monotonic()
+		self.record.returncode = self.proc.returncode
+		with command_stats_lock:
+			command_stats.append(self.record)
+			if len(command_stats) > COMMAND_STATS_MAX:
+				del command_stats[:len(command_stats) - COMMAND_STATS_MAX]
+		if self.chunks is not None:
+			session_recorder.add(self.record, self.chunks)
+
+	def lines(self):
+		"""Iterate stdout line by line, then wait for the process"""
+		for line in self.stdout:
+			self.record.bytes_read += len(line)
+			yield line
+		self.wait()
+
+	def communicate(self, input=None) -> tuple:
+		out, err = self.proc.communicate(input)
+		if out:
+			self.record.bytes_read += len(out)
+			if self.chunks is not None:
+				self.chunks.append((time.monotonic() - self.record.started,
+									out.encode("utf-8") if isinstance(out, str) else out))
+		self._finish()
+		return out, err
+
+	def wait(self) -> int:
+		self.proc.wait()
+		self._finish()
+		return self.proc.returncode
+
+	def poll(self):
+		rc = self.proc.poll()
+		if rc is not None:
+			self._finish()
+		return rc
+
+	def terminate(self):
+		self.proc.terminate()
+
+	def kill(self):
+		self.proc.kill()
+
+	@contextlib.contextmanager
+	def parsing(self):
+		"""Account the enclosed block as parse time of this command"""
+		t_start = time.monotonic()
+		try:
+			yield
+		finally:
+			self.record.parse_seconds += time.monotonic() - t_start
+
+def run_command(argv: list, env: dict = None, text: bool = True) -> Command:
+	"""Run to completion, output is left in command.output"""
+	cmd = Command(argv, env=env, text=text)
+	cmd.output, _ = cmd.communicate()
+	return cmd
+
+def command_stats_summary() -> list:
+	"""Aggregated records per program: [{program, count, latency, ...}]"""
+	summary = {}
+	with command_stats_lock:
+		records = list(command_stats)
+	for r in records:
+		s = summary.setdefault(r.argv[0], {"program": r.argv[0], "count": 0,
+			"latency_total": 0.0, "latency_max": 0.0, "bytes_read": 0, "parse_total": 0.0})
+		s["count"] += 1
+		s["latency_total"] += r.latency
+		s["latency_max"] = max(s["latency_max"], r.latency)
+		s["bytes_read"] += r.bytes_read
+		s["parse_total"] += r.parse_seconds
+	return sorted(summary.values(), key=lambda s: s["latency_total"], reverse=True)
+
+def print_command_stats(file=sys.stderr):
+	print("%-14s %6s %11s %11s %11s %11s" % ("program", "calls", "total ms",
+		"max ms", "parse ms", "read"), file=file)
+	for s in command_stats_summary():
+		print("%-14s %6d %11.1f %11.1f %11.1f %11s" % (
+			os.path.basename(s["program"]), s["count"], s["latency_total"] * 1000,
+			s["latency_max"] * 1000, s["parse_total"] * 1000,
+			format_filesize(s["bytes_read"])), file=file)
+
+# == Session recording == #
+# Set from the command line, see --record-session and --replay-session
+session_recorder = None
+session_replay = None
+
+class _RecordingStream:
+	"""stdout of a recorded command, keeps what is read with its time"""
+	def __init__(self, stream, cmd):
+		self._stream = stream
+		self._cmd = cmd
+
+	def _keep(self, data):
+		if data:
+			self._cmd.chunks.append((time.monotonic() - self._cmd.record.started,
+									 data.encode("utf-8") if isinstance(data, str) else data))
+		return data
+
+	def read(self, *args):
+		return self._keep(self._stream.read(*args))
+
+	def readline(self, *args):
+		return self._keep(self._stream.readline(*args))
+
+	def __iter__(self):
+		for line in self._stream:
+			yield self._keep(line)
+
+	def __getattr__(self, name):
+		# fileno, close, closed... (a pipe to another command is not recorded)
+		return getattr(self._stream, name)
+
+def session_package_files() -> list:
+	"""(path, archive name) of the package databases vapt reads itself
+
+	The dpkg status and the apt lists (dependency check, live refresh...),
+	which are no command output."""
+	files = [(dpkg_status_path, "files/status")]
+	for path in sorted(glob.glob(os.path.join(apt_lists_dir, "*"))):
+		name = os.path.basename(path)
+		if os.path.isfile(path) and \
+				re.search(r"_(Packages|i18n_Translation-[^_]+|Release|InRelease)(\.\w+)?$", name):
+			files.append((path, "files/lists/" + name))
+	return files
+
+class SessionRecorder:
+	"""Saves every command, its output and timing into a zip archive
+
+	The package databases are saved right away, as they are when the
+	session starts."""
+	def __init__(self, path: str):
+		import zipfile
+		self.path = path
+		self.lock = threading.Lock()
+		self.entries = []
+		self.files = []
+		with zipfile.ZipFile(self.path, "w", zipfile.ZIP_DEFLATED) as archive:
+			for file_path, name in session_package_files():
+				try:
+					archive.write(file_path, name)
+				except OSError as e:
+					print("Not recorded: %s" % e, file=sys.stderr)
+					continue
+				self.files.append(name)
+
+	def add(self, record: CommandRecord, chunks: list):
+		with self.lock:
+			self.entries.append((record, chunks))
+
+	def write(self):
+		import json
+		import zipfile
+		with self.lock:
+			entries = list(self.entries)
+		manifest = []
+		with zipfile.ZipFile(self.path, "a", zipfile.ZIP_DEFLATED) as archive:
+			for i, (record, chunks) in enumerate(entries):
+				blob = "output/%05d" % i
+				archive.writestr(blob, b"".join(data for _, data in chunks))
+				manifest.append({
+					"argv": record.argv,
+					"started": record.started - entries[0][0].started,
+					"latency": record.latency,
+					"returncode": record.returncode,
+					"output": blob,
+					# (seconds after start, bytes) of every read
+					"chunks": [(offset, len(data)) for offset, data in chunks],
+				})
+			archive.writestr("manifest.json", json.dumps({"version": 1, "commands": manifest,
+														  "files": self.files}, indent=1))
+		print("Recorded %d commands in %s" % (len(manifest), self.path), file=sys.stderr)
+
+class _ReplayStream:
+	"""Recorded output, released at its original pace if latency is kept"""
+	def __init__(self, proc):
+		self.proc = proc
+		self.buffer = b""
+		self.closed = False
+
+	def _pull(self) -> bool:
+		if not self.proc.chunks:
+			return False
+		offset, data = self.proc.chunks.pop(0)
+		self.proc.sleep_until(offset)
+		self.buffer += data
+		return True
+
+	def _out(self, data: bytes):
+		return data.decode("utf-8", "replace") if self.proc.text else data
+
+	def read(self, size: int = -1):
+		while (size < 0 or len(self.buffer) < size) and self._pull():
+			pass
+		if size < 0:
+			size = len(self.buffer)
+		data, self.buffer = self.buffer[:size], self.buffer[size:]
+		return self._out(data)
+
+	def readline(self, size: int = -1):
+		while b"\n" not in self.buffer and self._pull():
+			pass
+		end = self.buffer.find(b"\n") + 1 or len(self.buffer)
+		data, self.buffer = self.buffer[:end], self.buffer[end:]
+		return self._out(data)
+
+	def __iter__(self):
+		while True:
+			line = self.readline()
+			if not line:
+				return
+			yield line
+
+	def close(self):
+		self.closed = True
+
+class ReplayProcess:
+	"""Stands in for subprocess.Popen, serving a recorded command"""
+	def __init__(self, entry: dict, data: bytes, text: bool, latency: bool):
+		self.entry = entry
+		self.text = text
+		self.latency = latency
+		self.started = time.monotonic()
+		self.chunks = []
+		pos = 0
+		for offset, length in entry["chunks"]:
+			self.chunks.append((offset, data[pos:pos + length]))
+			pos += length
+		self.returncode = None
+		self.stdin = io.StringIO() if text else io.BytesIO()
+		self.stdout = _ReplayStream(self)
+
+	def sleep_until(self, offset: float):
+		if self.latency:
+			delay = self.started + offset - time.monotonic()
+			if delay > 0:
+				time.sleep(delay)
+
+	def communicate(self, input=None) -> tuple:
+		out = self.stdout.read()
+		self.wait()
+		return out, None
+
+	def wait(self, timeout=None) -> int:
+		if self.returncode is None:
+			self.sleep_until(self.entry["latency"])
+			self.returncode = self.entry["returncode"]
+		return self.returncode
+
+	def poll(self):
+		if self.returncode is None and \
+				(not self.latency or time.monotonic() - self.started >= self.entry["latency"]):
+			self.returncode = self.entry["returncode"]
+		return self.returncode
+
+	def terminate(self):
+		if self.returncode is None:
+			self.returncode = -15
+
+	def kill(self):
+		if self.returncode is None:
+			self.returncode = -9
+
+class SessionReplay:
+	"""Serves the commands of a recorded session instead of running them
+
+	Commands are matched by argv, in recorded order; the last recording of
+	an argv is served again once its queue is exhausted."""
+	def __init__(self, path: str, latency: bool = True):
+		import json
+		import zipfile
+		self.latency = latency
+		self.lock = threading.Lock()
+		self.commands = {}
+		self.archive = zipfile.ZipFile(path)
+		manifest = json.loads(self.archive.read("manifest.json"))
+		for entry in manifest["commands"]:
+			self.commands.setdefault(tuple(entry["argv"]), []).append(entry)
+		# Not in sessions recorded before the package databases were
+		self.files = manifest.get("files", [])
+
+	def use_package_files(self):
+		"""Read the recorded dpkg status and apt lists instead of the local ones
+
+		apt_dir_options stay as recorded, the argv of commands must match."""
+		global dpkg_status_path, dpkg_updates_dir, apt_lists_dir
+		if not self.files:
+			print("No package databases in the recorded session, using the local ones",
+				  file=sys.stderr)
+			return
+		import tempfile
+		root = tempfile.mkdtemp(prefix="vapt-replay-")
+		atexit.register(rmforce, root)
+		for name in self.files:
+			self.archive.extract(name, root)
+		dpkg_status_path = os.path.join(root, "files", "status")
+		dpkg_updates_dir = os.path.join(root, "files", "updates")
+		apt_lists_dir = os.path.join(root, "files", "lists")
+		os.makedirs(dpkg_updates_dir, exist_ok=True)
+		os.makedirs(apt_lists_dir, exist_ok=True)
+
+	def spawn(self, argv: list, text: bool) -> ReplayProcess:
+		with self.lock:
+			queue = self.commands.get(tuple(argv))
+			if not queue:
+				print("Not in the recorded session: %s" % " ".join(argv), file=sys.stderr)
+				entry = {"argv": list(argv), "latency": 0.0, "returncode": 127,
+						 "chunks": [], "output": None}
+			else:
+				entry = queue.pop(0) if len(queue) > 1 else queue[0]
+			data = self.archive.read(entry["output"]) if entry["output"] else b""
+		return ReplayProcess(entry, data, text, self.latency)
+
+# == Job scheduler == #
+# Lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_PREFETCH = 1
+PRIORITY_INDEXING = 2
+JOB_STATS_MAX = 2000
+
+class JobCancelled(Exception):
+	pass
+
+class CancelToken:
+	"""Cancellation flag of a job, also kills the commands the job started"""
+	def __init__(self):
+		self.cancelled = False
+		self.commands = []
+		self.lock = threading.Lock()
+
+	def attach(self, cmd):
+		with self.lock:
+			if not self.cancelled:
+				self.commands.append(cmd)
+				return
+		cmd.kill()
+
+	def cancel(self):
+		with self.lock:
+			if self.cancelled:
+				return
+			self.cancelled = True
+			commands, self.commands = self.commands, []
+		for cmd in commands:
+			if cmd.poll() is None:
+				try:
+					cmd.kill()
+				except OSError:
+					pass
+
+_job_local = threading.local()
+
+def current_cancel_token() -> CancelToken:
+	"""Token of the job running on this thread, None outside of jobs"""
+	return getattr(_job_local, "token", None)
+
+def check_cancelled():
+	"""Raise JobCancelled if the job running on this thread was cancelled"""
+	token = current_cancel_token()
+	if token is not None and token.cancelled:
+		raise JobCancelled()
+
+class Job:
+	def __init__(self, fn, args: tuple, priority: int, source, long: bool = False):
+		self.fn = fn
+		self.args = args
+		self.priority = priority
+		self.source = source
+		self.long = long
+		self.token = CancelToken()
+		self.submitted = time.monotonic()
+		self.started = None
+		self.ended = None
+
+	@property
+	def cancelled(self) -> bool:
+		return self.token.cancelled
+
+	def cancel(self):
+		self.token.cancel()
+
+	@property
+	def bulk(self) -> bool:
+		"""Kept off the workers reserved for interactive jobs"""
+		return self.long or self.priority > PRIORITY_INTERACTIVE
+
+	@property
+	def wait_seconds(self) -> float:
+		return (self.started or time.monotonic()) - self.submitted
+
+	@property
+	def run_seconds(self) -> float:
+		if self.started is None:
+			return 0.0
+		return (self.ended or time.monotonic()) - self.started
+
+class JobScheduler:
+	"""Bounded pool of worker threads running jobs by priority
+
+	A job submitted with a source (a window, "search", ...) cancels the
+	previous job of that source, queued or running. Running jobs are never
+	preempted, so reserved workers only take short interactive jobs: long
+	ones (transactions, verification...) and prefetch or indexing jobs
+	share the rest, and cannot hold up a search or an autocompletion."""
+	def __init__(self, max_workers: int, reserved: int = 1):
+		self.max_workers = max_workers
+		self.bulk_workers = max(1, max_workers - reserved)
+		self.bulk_running = 0
+		self.workers = 0
+		self.idle = 0
+		self.queue = []  # heap of (priority, seq, job)
+		self.seq = 0
+		self.cond = threading.Condition()
+		self.running = set()
+		self.by_source = {}
+		self.finished = []
+		self.cancelled_count = 0
+
+	def submit(self, fn, *args, priority: int = PRIORITY_INTERACTIVE, source=None,
+			   long: bool = False) -> Job:
+		"""Queue fn(*args), long if it may run for seconds or more"""
+		import heapq
+		job = Job(fn, args, priority, source, long)
+		with self.cond:
+			if source is not None:
+				stale = self.by_source.get(source)
+				if stale is not None:
+					stale.cancel()
+				self.by_source[source] = job
+			self.seq += 1
+			heapq.heappush(self.queue, (priority, self.seq, job))
+			if not self._wake() and self.workers < self.max_workers:
+				self.workers += 1
+				threading.Thread(target=self._worker, daemon=True,
+								 name="vapt-job-%d" % self.workers).start()
+		return job
+
+	def _wake(self) -> bool:
+		"""Hand the queue to an idle worker, called with cond held
+
+		The worker leaves idle here and not once it runs, so a job
+		submitted right after does not count on the same worker."""
+		if self.idle == 0:
+			return False
+		self.idle -= 1
+		self.cond.notify()
+		return True
+
+	def cancel_source(self, source):
+		with self.cond:
+			job = self.by_source.pop(source, None)
+		if job is not None:
+			job.cancel()
+
+	def cancel_owner(self, owner):
+		"""Cancel the jobs of every (owner, ...) source"""
+		with self.cond:
+			sources = [source for source in self.by_source
+					   if isinstance(source, tuple) and source[0] is owner]
+			jobs = [self.by_source.pop(source) for source in sources]
+		for job in jobs:
+			job.cancel()
+
+	def _next(self) -> Job:
+		"""Pop the first job this worker may run, called with cond held"""
+		import heapq
+		full = self.bulk_running >= self.bulk_workers
+		for entry in sorted(self.queue) if full else self.queue[:1]:
+			job = entry[2]
+			if job.cancelled or not (full and job.bulk):
+				self.queue.remove(entry)
+				heapq.heapify(self.queue)
+				return job
+		return None
+
+	def _worker(self):
+		while True:
+			with self.cond:
+				job = self._next()
+				while job is None:
+					# _wake() takes it out of idle
+					self.idle += 1
+					self.cond.wait()
+					job = self._next()
+				if job.cancelled:
+					self._finish(job)
+					continue
+				if job.bulk:
+					self.bulk_running += 1
+				self.running.add(job)
+			job.started = time.monotonic()
+			_job_local.token = job.token
+			try:
+				job.fn(*job.args)
+			except JobCancelled:
+				pass
+			except Exception:
+				import traceback
+				traceback.print_exc()
+			finally:
+				_job_local.token = None
+				job.ended = time.monotonic()
+				with self.cond:
+					self.running.discard(job)
+					if job.bulk:
+						self.bulk_running -= 1
+						# Bulk jobs queued meanwhile may run now
+						self._wake()
+					self._finish(job)
+
+	def _finish(self, job: Job):
+		"""Account a job leaving the scheduler, called with cond held"""
+		if self.by_source.get(job.source) is job:
+			del self.by_source[job.source]
+		if job.cancelled:
+			self.cancelled_count += 1
+		self.finished.append(job)
+		if len(self.finished) > JOB_STATS_MAX:
+			del self.finished[:len(self.finished) - JOB_STATS_MAX]
+
+	def stats(self) -> dict:
+		"""Queue depth, running jobs and latency of the finished ones"""
+		with self.cond:
+			queued = [job for _, _, job in self.queue]
+			running = len(self.running)
+			finished = [job for job in self.finished if job.started is not None]
+			cancelled = self.cancelled_count
+		res = {"queued": len(queued), "running": running, "workers": self.workers,
+			   "cancelled": cancelled, "priorities": {}}
+		for priority, name in ((PRIORITY_INTERACTIVE, "interactive"),
+							   (PRIORITY_PREFETCH, "prefetch"),
+							   (PRIORITY_INDEXING, "indexing")):
+			jobs = [job for job in finished if job.priority == priority]
+			res["priorities"][name] = {
+				"queued": sum(1 for job in queued if job.priority == priority),
+				"count": len(jobs),
+				"wait_max": max((job.wait_seconds for job in jobs), default=0.0),
+				"wait_total": sum(job.wait_seconds for job in jobs),
+				"run_max": max((job.run_seconds for job in jobs), default=0.0),
+				"run_total": sum(job.run_seconds for job in jobs),
+			}
+		return res
+
+job_scheduler = JobScheduler(max(2, min(4, os.cpu_count() or 1)))
+
+def print_job_stats(file=sys.stderr):
+	s = job_scheduler.stats()
+	print("jobs: %d queued, %d running, %d workers, %d cancelled" % (
+		s["queued"], s["running"], s["workers"], s["cancelled"]), file=file)
+	print("%-12s %6s %6s %11s %11s %11s %11s" % ("priority", "queued", "jobs",
+		"avg wait ms", "max wait ms", "avg run ms", "max run ms"), file=file)
+	for name, p in s["priorities"].items():
+		n = max(p["count"], 1)
+		print("%-12s %6d %6d %11.1f %11.1f %11.1f %11.1f" % (name, p["queued"],
+			p["count"], p["wait_total"] * 1000 / n, p["wait_max"] * 1000,
+			p["run_total"] * 1000 / n, p["run_max"] * 1000), file=file)
+
+# == Parsers == #
+def apt_canonicalize_package(name: str, version: str, arch: str) -> str:
+	res = name.strip()
+	if arch:
+		res += ":" + arch.strip()
+	if version:
+		res += "=" + version.strip()
+	return res
+
+def _apt_list_rows(lines):
+	"""Split 'apt list' output lines into (name, [columns after name/suite])"""
+	for line in lines:
+		line = line.strip()
+		# Skip "Listing..." header if present
+		if not line or "/" not in line or line.lower().startswith("listing"):
+			continue
+		pkgcol = line.split("/", 1)
+		yield pkgcol[0].strip(), pkgcol[1].strip().split(" ")
+
+def iter_apt_list_upgradable(lines):
+	"""(name, candidate, installed, arch) from 'apt list --upgradable' lines"""
+	# pkg/suite 1.2-1 amd64 [upgradable from: 1.1-1]
+	for pkg, cols in _apt_list_rows(lines):
+		ver_cad = cols[1].strip() if len(cols) > 1 else None
+		arch = cols[2].strip() if len(cols) > 2 else None
+		ver_ins = cols[5].strip() if len(cols) > 5 else None
+
+		# Trim trailing bracket
+		if ver_ins and ver_ins[-1:] == "]":
+			ver_ins = ver_ins[:-1]
+
+		if ver_cad and ver_ins and arch:
+			yield pkg, ver_cad, ver_ins, arch
+
+def parse_apt_list_upgradable(out: str) -> list:
+	"""[(name, candidate, installed, arch)] from 'apt list --upgradable'"""
+	return list(iter_apt_list_upgradable(out.splitlines()))
+
+def iter_apt_list_installed(lines):
+	"""(name, installed, arch) from 'apt list --installed' lines"""
+	# pkg/suite,now 1.2-1 amd64 [installed]
+	for pkg, cols in _apt_list_rows(lines):
+		ver_ins = cols[1].strip() if len(cols) > 1 else None
+		arch = cols[2].strip() if len(cols) > 2 else None
+
+		if ver_ins and arch:
+			yield pkg, ver_ins, arch
+
+def parse_apt_list_installed(out: str) -> list:
+	"""[(name, installed, arch)] from 'apt list --installed'"""
+	return list(iter_apt_list_installed(out.splitlines()))
+
+def iter_apt_cache_search(lines):
+	"""(name, short description) from 'apt-cache search' lines"""
+	for line in lines:
+		# Skip empty lines
+		ln = line.strip()
+		if not ln or ln == "Sorting..." or ln == "Full Text Search...":
+			continue
+		pkg = ln.split(" - ", 1)
+		yield pkg[0].strip(), pkg[1].strip() if len(pkg) > 1 else ""
+
+def parse_apt_policy(out: str) -> tuple:
+	"""(installed, candidate, archs) from 'apt-cache policy <pkg>'"""
+	archs = []
+	installed = None
+	candidate = None
+	for pline in out.splitlines():
+		pline = pline.strip()
+		if pline.startswith("Candidate: "):
+			candidate = pline[len("Candidate: "):]
+		elif pline.startswith("Installed: "):
+			installed = pline[len("Installed: "):]
+		elif pline.endswith(" Packages"):
+			arch = pline.split()[3].strip()
+			if arch not in archs:
+				archs.append(arch)
+
+	return installed, candidate, archs
+
+_apt_update_line_re = re.compile(r"^(Hit|Get|Ign|Err):(\d+)\s+(\S+)\s+(.*?)(?:\s+\[([\d.,]+ [kMGT]?B)\])?\s*$")
+_apt_size_units = {"B": 1, "kB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3, "TB": 1000 ** 4}
+
+def parse_apt_size(text: str) -> int:
+	"""Bytes of an apt size like "8,787 kB" (decimal units)"""
+	num, _, unit = text.strip().partition(" ")
+	return int(float(num.replace(",", "")) * _apt_size_units.get(unit, 1))
+
+def parse_apt_update_line(line: str) -> tuple:
+	"""(status, item, uri, target, bytes) of a Hit/Get/Ign/Err line of
+	'apt-get update', None for other lines; bytes is None if not shown"""
+	# Get:2 http://deb.debian.org/debian bookworm/main amd64 Packages [8,787 kB]
+	m = _apt_update_line_re.match(line.rstrip())
+	if not m:
+		return None
+	size = parse_apt_size(m.group(5)) if m.group(5) else None
+	return m.group(1), int(m.group(2)), m.group(3), m.group(4), size
+
+def parse_package_info(out: str, pkgver: str = "") -> tuple:
+	"""(raw text, [[field, data]]) of the 'apt-cache show' or 'dpkg-deb -I'
+	blocks matching pkgver (every block if empty)"""
+	blocks = [block for block in out.strip().split("\n\n")
+			  if not pkgver or "Version: %s" % pkgver in block]
+	fields = []
+	for block in blocks:
+		for line in block.splitlines():
+			line = line.strip()
+			if not line:
+				continue
+
+			# Human readable size
+			if line.startswith("Installed-Size: "):
+				line = line.replace("Installed-Size: ", "").strip()
+				num = format_filesize(int(line) * 1024) # KiB to bytes
+				line = "Installed-Size: %s" % num
+
+
+			# Save URLs protocols
+			line = line.replace("http://", "http;;//")
+			line = line.replace("https://", "http;;//")
+
+			if ':' not in line:
+				# Restore URLs
+				line = line.replace("http;;//", "http://")
+				line = line.replace("https;;//", "http://")
+				# Append line to the previous field data
+				if fields:
+					fields[-1][1] += "\n" + line
+				continue
+
+			i_sep = line.index(":")
+
+			# Restore URLs protocols
+			line = line.replace("http;;//", "http://")
+			line = line.replace("https;;//", "http://")
+
+			field, data = line[:i_sep].strip(), line[i_sep + 1:].strip()
+			fields.append([field, data])
+	return "\n\n".join(blocks), fields
+
+def filter_matches(values, filter_term: str, search_cols) -> bool:
+	"""Row visibility of the list filters, filter_term already lowercase"""
+	for i in search_cols:
+		if filter_term in values[i].lower():
+			return True
+	return False
+
+def format_filesize(size_bytes: int) -> str:
+	"""Convert a filesize in bytes to a human-readable string with binary units."""
+	if size_bytes < 0: return "--"
+
+	# Define binary units
+	units = ["B", "KB", "MB", "GB", "TB", "PB"]
+	size = float(size_bytes)
+
+	for unit in units:
+		if size < 1024 or unit == units[-1]:
+			# Format to 2 decimal places for sizes >= KiB
+			if unit == "B":
+				return "%d %s" % (size, unit)
+			else:
+				return "%.2f %s" % (size, unit)
+		size /= 1024
+
+def mkdtemp():
+	import tempfile
+	return tempfile.mkdtemp()
+
+def rmforce(dir):
+	import shutil
+	shutil.rmtree(dir, ignore_errors=True)
+
+# == APT Index == #
+# Alternative root holding the package databases (e.g. a test fixture)
+apt_root = os.environ.get("VAPT_APT_ROOT") or None
+
+def apt_root_path(path: str) -> str:
+	return os.path.join(apt_root, path.lstrip("/")) if apt_root else path
+
+dpkg_status_path = apt_root_path("/var/lib/dpkg/status")
+# dpkg's journal, merged into the status file when a run ends
+dpkg_updates_dir = apt_root_path("/var/lib/dpkg/updates")
+apt_lists_dir = apt_root_path("/var/lib/apt/lists")
+
+# Same redirection for apt itself, passed to every apt query command
+apt_dir_options = [] if not apt_root else [
+	"-o", "Dir::State=" + apt_root_path("/var/lib/apt"),
+	"-o", "Dir::State::status=" + dpkg_status_path,
+	"-o", "Dir::Etc=" + apt_root_path("/etc/apt"),
+	"-o", "Dir::Cache=" + apt_root_path("/var/cache/apt"),
+]
+
+def _apt_order(c: str) -> int:
+	"""Character weight used by dpkg when comparing version strings"""
+	if c == "~":
+		return -1
+	if c.isdigit():
+		return 0
+	if c.isalpha():
+		return ord(c)
+	return ord(c) + 256
+
+def _apt_verrevcmp(a: str, b: str) -> int:
+	i = j = 0
+	while i < len(a) or j < len(b):
+		first_diff = 0
+		# Non-digit prefix, compared char by char with dpkg weights
+		while (i < len(a) and not a[i].isdigit()) or (j < len(b) and not b[j].isdigit()):
+			ac = _apt_order(a[i]) if i < len(a) else 0
+			bc = _apt_order(b[j]) if j < len(b) else 0
+			if ac != bc:
+				return ac - bc
+			i += 1
+			j += 1
+		# Numeric part, compared by value
+		while i < len(a) and a[i] == "0":
+			i += 1
+		while j < len(b) and b[j] == "0":
+			j += 1
+		while i < len(a) and a[i].isdigit() and j < len(b) and b[j].isdigit():
+			if not first_diff:
+				first_diff = ord(a[i]) - ord(b[j])
+			i += 1
+			j += 1
+		if i < len(a) and a[i].isdigit():
+			return 1
+		if j < len(b) and b[j].isdigit():
+			return -1
+		if first_diff:
+			return first_diff
+	return 0
+
+def apt_version_compare(a: str, b: str) -> int:
+	"""Compare two Debian versions, returns <0, 0 or >0 like dpkg"""
+	def split_(v: str) -> tuple:
+		epoch = 0
+		if ":" in v:
+			e, v = v.split(":", 1)
+			epoch = int(e) if e.isdigit() else 0
+		upstream, _, revision = v.rpartition("-") if "-" in v else (v, "", "")
+		return epoch, upstream, revision
+
+	ea, ua, ra = split_(a.strip())
+	eb, ub, rb = split_(b.strip())
+	if ea != eb:
+		return ea - eb
+	return _apt_verrevcmp(ua, ub) or _apt_verrevcmp(ra, rb)
+
+def apt_version_satisfies(version: str, op: str, ref: str) -> bool:
+	if op is None:
+		return True
+	if version is None:
+		return False
+	cmp = apt_version_compare(version, ref)
+	if op == "<<": return cmp < 0
+	if op == "<=": return cmp <= 0
+	if op == "=": return cmp == 0
+	if op == ">=": return cmp >= 0
+	if op == ">>": return cmp > 0
+	return False
+
+_apt_relation_re = re.compile(
+	r"^\s*([a-z0-9][a-z0-9+.\-]*)(?::([a-z0-9\-]+))?\s*"
+	r"(?:\(\s*(<<|<=|=|>=|>>|<|>)\s*([^)\s]+)\s*\))?\s*"
+	r"(?:\[[^\]]*\]\s*)?(?:<[^>]*>\s*)*$", re.I)
+
+def apt_parse_relations(value: str) -> list:
+	"""Parse a relation field into [[(name, arch, op, version), ...], ...]
+
+	Every item of the outer list is an AND group, every tuple inside is
+	an OR alternative (a | b). Missing arch, op or version are None."""
+	groups = []
+	if not value:
+		return groups
+	for group in value.split(","):
+		alts = []
+		for alt in group.split("|"):
+			m = _apt_relation_re.match(alt)
+			if not m:
+				continue
+			name, arch, op, ver = m.groups()
+			# Obsolete '<' and '>' mean '<=' and '>='
+			if op == "<": op = "<="
+			if op == ">": op = ">="
+			alts.append((name.lower(), arch.lower() if arch else None, op, ver))
+		if alts:
+			groups.append(alts)
+	return groups
+
+def apt_format_relation(alts: list) -> str:
+	res = []
+	for name, arch, op, ver in alts:
+		s = name + (":" + arch if arch else "")
+		if op:
+			s += " (%s %s)" % (op, ver)
+		res.append(s)
+	return " | ".join(res)
+
+def iter_deb822(lines, fields: set = None):
+	"""Yield one dict per stanza of a Packages/status style file
+
+	Only the requested fields are kept (all if fields is None), and
+	continuation lines of other fields are skipped without parsing."""
+	stanza = {}
+	key = None
+	for line in lines:
+		if line[:1] in (" ", "\t"):
+			if key is not None:
+				stanza[key] += "\n" + line.strip()
+			continue
+		line = line.rstrip("\n")
+		if not line:
+			if stanza:
+				yield stanza
+				stanza = {}
+			key = None
+			continue
+		i_sep = line.find(":")
+		if i_sep == -1:
+			key = None
+			continue
+		key = line[:i_sep]
+		if fields is not None and key not in fields:
+			key = None
+			continue
+		stanza[key] = line[i_sep + 1:].strip()
+	if stanza:
+		yield stanza
+
+def apt_open_index_file(path: str):
+	"""Open a (possibly compressed) apt list file as text, None if unsupported"""
+	if path.endswith(".gz"):
+		import gzip
+		return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+	if path.endswith(".xz"):
+		import lzma
+		return lzma.open(path, "rt", encoding="utf-8", errors="replace")
+	if path.endswith(".bz2"):
+		import bz2
+		return bz2.open(path, "rt", encoding="utf-8", errors="replace")
+	if path.endswith(".lz4") or path.endswith(".zst"):
+		return None
+	return open(path, "r", encoding="utf-8", errors="replace")
+
+def apt_list_files(lists_dir: str = None) -> list:
+	lists_dir = lists_dir or apt_lists_dir
+	return sorted(f for f in glob.glob(os.path.join(lists_dir, "*_Packages*"))
+				  if re.search(r"_Packages(\.(gz|xz|bz2|lz4|zst))?$", f))
+
+def apt_translation_files(lists_dir: str = None) -> list:
+	lists_dir = lists_dir or apt_lists_dir
+	return sorted(glob.glob(os.path.join(lists_dir, "*_i18n_Translation-en*")))
+
+def apt_file_signature(path: str) -> tuple:
+	"""(mtime, size) of a file, None if it is gone"""
+	try:
+		st = os.stat(path)
+	except OSError:
+		return None
+	return (st.st_mtime_ns, st.st_size)
+
+def apt_file_digest(path: str, data: bytes = None) -> str:
+	"""Content hash of a list file as stored (compressed or not)"""
+	import hashlib
+	if data is not None:
+		return hashlib.blake2b(data).hexdigest()
+	h = hashlib.blake2b()
+	try:
+		with open(path, "rb") as f:
+			for chunk in iter(lambda: f.read(1 << 20), b""):
+				h.update(chunk)
+	except OSError:
+		return None
+	return h.hexdigest()
+
+def apt_uri_filename(uri: str) -> str:
+	"""Name apt stores a downloaded URI as in its lists directory
+
+	Same as apt's URItoFileName: scheme and credentials dropped, some
+	characters %-quoted and "/" replaced by "_"."""
+	rest = uri.split("://", 1)[1] if "://" in uri else uri.split(":", 1)[-1]
+	host, sep, path = rest.partition("/")
+	rest = host.rpartition("@")[2] + sep + path
+	return "".join("%%%02x" % ord(c) if c in '\\|{}[]<>"^~_=!@#$%&*' or not " " < c < "\x7f" else c
+				   for c in rest).replace("/", "_")
+
+def apt_update_fetched(lines) -> set:
+	"""List files apt-get update downloaded, from its "Get:" lines
+
+	Names come without the compression extension, match them as prefixes.
+	Indexes vapt does not read (Contents, DEP-11...) are left out."""
+	fetched = set()
+	for line in lines:
+		tokens = line.split()
+		if len(tokens) < 4 or not tokens[0].startswith("Get:"):
+			continue
+		# Get:2 http://deb.debian.org/debian bookworm/main amd64 Packages [8,787 kB]
+		uri, where, rest = tokens[1].rstrip("/"), tokens[2], tokens[3:]
+		kind = next((t for t in rest if t in ("InRelease", "Release", "Packages")
+					 or t.startswith("Translation-")), None)
+		if kind is None:
+			continue
+		if where.endswith("/"):
+			# Flat repository, "./" or a subdirectory
+			target = "%s/%s%s" % (uri, where, kind)
+		elif kind == "Packages":
+			if rest.index(kind) == 0:
+				continue
+			target = "%s/dists/%s/binary-%s/Packages" % (uri, where, rest[rest.index(kind) - 1])
+		elif kind.startswith("Translation-"):
+			target = "%s/dists/%s/i18n/%s" % (uri, where, kind)
+		else:
+			target = "%s/dists/%s/%s" % (uri, where, kind)
+		fetched.add(apt_uri_filename(target))
+	return fetched
+
+# What the last apt-get update run here said it fetched, for the next reindex
+apt_lists_fetched = set()
+
+class AptListChanges:
+	"""Remembers the list files an index was built from, to reindex per list
+
+	A list changed when apt-get update fetched it, or else when its mtime
+	or size moved and its content hash with them: a list that was only
+	touched is kept."""
+	def __init__(self):
+		self.seen = {}  # path -> (signature, digest)
+
+	def add(self, path: str, signature: tuple, data: bytes = None):
+		"""Record path as indexed, signature taken before it was read"""
+		self.seen[path] = (signature, apt_file_digest(path, data))
+
+	def forget(self, path: str):
+		self.seen.pop(path, None)
+
+	def changes(self, paths: list, fetched: set = None) -> tuple:
+		"""(changed or new paths, removed paths) against the current files"""
+		changed = []
+		for path in paths:
+			old = self.seen.get(path)
+			signature = apt_file_signature(path)
+			if old is not None and old[0] == signature:
+				continue
+			base = os.path.basename(path)
+			if old is not None and not any(base.startswith(p) for p in fetched or ()) \
+					and apt_file_digest(path) == old[1]:
+				self.seen[path] = (signature, old[1])
+				continue
+			changed.append(path)
+		current = set(paths)
+		return changed, [path for path in self.seen if path not in current]
+
+class AptPackage:
+	"""One version of a binary package, as seen by the relation checker"""
+	__slots__ = ("name", "version", "arch", "multi_arch", "provides",
+				 "conflicts", "breaks", "origin")
+
+	FIELDS = {"Package", "Version", "Architecture", "Multi-Arch", "Provides",
+			  "Conflicts", "Breaks", "Status"}
+
+	def __init__(self, fields: dict, origin: str):
+		self.name = fields.get("Package", "").strip().lower()
+		self.version = fields.get("Version", "").strip()
+		self.arch = fields.get("Architecture", "").strip()
+		self.multi_arch = fields.get("Multi-Arch", "no").strip()
+		self.provides = [g[0] for g in apt_parse_relations(fields.get("Provides", ""))]
+		self.conflicts = fields.get("Conflicts", "")
+		self.breaks = fields.get("Breaks", "")
+		self.origin = origin  # "installed", "available" or "local"
+
+	def describe(self) -> str:
+		return "%s %s (%s)" % (self.name, self.version, Localize("str_deps_origin_" + self.origin))
+
+class PackageIndex:
+	"""In-memory index of installed and available packages"""
+	def __init__(self, native_arch: str = None):
+		self.native_arch = native_arch
+		self.packages = {}          # name -> [AptPackage]
+		self.providers = {}         # virtual name -> [(AptPackage, provided version)]
+		self.reverse_conflicts = {} # name -> [(AptPackage, field, alt)]
+		self.lists = {}             # list file -> [AptPackage]
+		self.list_changes = AptListChanges()
+
+	def add(self, pkg: AptPackage):
+		if not pkg.name:
+			return
+		self.packages.setdefault(pkg.name, []).append(pkg)
+		for name, arch, op, ver in pkg.provides:
+			self.providers.setdefault(name, []).append(
+				(pkg, ver if op == "=" else None))
+		if pkg.origin == "installed":
+			for field, value in (("Conflicts", pkg.conflicts), ("Breaks", pkg.breaks)):
+				for group in apt_parse_relations(value):
+					for alt in group:
+						self.reverse_conflicts.setdefault(alt[0], []).append((pkg, field, alt))
+
+	def load_status(self, path: str = None):
+		with open(path or dpkg_status_path, "r", encoding="utf-8", errors="replace") as f:
+			for fields in iter_deb822(f, AptPackage.FIELDS):
+				# "install ok installed", "hold ok installed", ...
+				status = fields.get("Status", "").split()
+				if status and status[-1] in ("installed", "half-configured", "unpacked"):
+					self.add(AptPackage(fields, "installed"))
+
+	def load_lists(self, lists_dir: str = None):
+		for list_file in apt_list_files(lists_dir):
+			self.load_list(list_file)
+
+	def load_list(self, list_file: str):
+		signature = apt_file_signature(list_file)
+		f = apt_open_index_file(list_file)
+		if f is None:
+			return
+		pkgs = []
+		with f:
+			for fields in iter_deb822(f, AptPackage.FIELDS):
+				pkg = AptPackage(fields, "available")
+				self.add(pkg)
+				pkgs.append(pkg)
+		self.lists[list_file] = pkgs
+		self.list_changes.add(list_file, signature)
+
+	def drop_list(self, list_file: str):
+		"""Take out the packages that came from list_file"""
+		pkgs = self.lists.pop(list_file, [])
+		self.list_changes.forget(list_file)
+		dropped = set(map(id, pkgs))
+		# New lists instead of in-place edits, for readers in other threads
+		for name in {pkg.name for pkg in pkgs}:
+			left = [p for p in self.packages.get(name, []) if id(p) not in dropped]
+			if left:
+				self.packages[name] = left
+			else:
+				self.packages.pop(name, None)
+		for name in {prov[0] for pkg in pkgs for prov in pkg.provides}:
+			left = [p for p in self.providers.get(name, []) if id(p[0]) not in dropped]
+			if left:
+				self.providers[name] = left
+			else:
+				self.providers.pop(name, None)
+
+	def reload_lists(self, lists_dir: str = None, fetched: set = None) -> list:
+		"""Re-read only the lists that changed since loaded, returns them"""
+		changed, removed = self.list_changes.changes(apt_list_files(lists_dir), fetched)
+		for list_file in removed + changed:
+			self.drop_list(list_file)
+		for list_file in changed:
+			self.load_list(list_file)
+		return changed
+
+	def candidates(self, name: str) -> list:
+		"""[(AptPackage, version to compare)] for real and virtual packages"""
+		res = [(p, p.version) for p in self.packages.get(name, [])]
+		res.extend(self.providers.get(name, []))
+		return res
+
+_apt_native_arch = None
+
+def apt_native_arch() -> str:
+	"""dpkg architecture, only asked once per process"""
+	global _apt_native_arch
+	if _apt_native_arch is None:
+		_apt_native_arch = run_command(["dpkg", "--print-architecture"]).output.strip()
+	return _apt_native_arch or None
+
+def os_pretty_name() -> str:
+	"""PRETTY_NAME from os-release, None if not available"""
+	for path in ("/etc/os-release", "/usr/lib/os-release"):
+		try:
+			with open(path, "r", encoding="utf-8") as f:
+				for line in f:
+					if line.startswith("PRETTY_NAME="):
+						return line.split("=", 1)[1].strip().strip("\"'")
+		except OSError:
+			continue
+	return None
+
+package_index = None
+package_index_status = None
+package_index_lock = threading.Lock()
+
+def get_package_index() -> PackageIndex:
+	"""Build the shared index once, later callers get the same instance
+
+	After apt changed the lists, only the ones that changed are re-read; a
+	new dpkg status means a new index."""
+	global package_index, package_index_status
+	with package_index_lock:
+		status = apt_file_signature(dpkg_status_path)
+		if package_index is None or status != package_index_status:
+			index = PackageIndex(apt_native_arch())
+			index.load_status()
+			index.load_lists()
+			package_index, package_index_status = index, status
+		else:
+			package_index.reload_lists(fetched=apt_lists_fetched)
+		return package_index
+
+class DebRelationReport:
+	"""Per-relation verdict of a local package against a PackageIndex"""
+	def __init__(self):
+		self.entries = []  # [(field, relation, state, detail)]
+
+	def add(self, field: str, relation: str, state: str, detail: str = ""):
+		self.entries.append((field, relation, state, detail))
+
+	def count(self, state: str) -> int:
+		return sum(1 for e in self.entries if e[2] == state)
+
+	@property
+	def installable(self) -> bool:
+		return self.count("missing") == 0
+
+def _apt_arch_matches(dependent: AptPackage, arch: str, cand: AptPackage, native_arch: str) -> bool:
+	if cand.arch == "all" or not cand.arch:
+		return True
+	if arch == "any":
+		return cand.multi_arch == "allowed" or cand.arch in (dependent.arch, native_arch)
+	if arch == "native":
+		return cand.arch == native_arch
+	if arch:
+		return cand.arch == arch
+	if cand.multi_arch == "foreign":
+		return True
+	own_arch = native_arch if dependent.arch in ("all", "") else dependent.arch
+	return cand.arch == own_arch
+
+def _apt_match_alt(index: PackageIndex, dependent: AptPackage, alt: tuple, exclude_self: bool = False) -> list:
+	name, arch, op, ver = alt
+	res = []
+	for cand, cand_ver in index.candidates(name):
+		if exclude_self and cand.name == dependent.name:
+			continue
+		if not _apt_arch_matches(dependent, arch, cand, index.native_arch):
+			continue
+		if op is not None and cand.name != name and cand_ver is None:
+			# Unversioned provides never satisfy a versioned relation
+			continue
+		if apt_version_satisfies(cand_ver, op, ver):
+			res.append(cand)
+	return res
+
+def deb_check_relations(control: dict, index: PackageIndex, local_controls: list = None) -> DebRelationReport:
+	"""Evaluate Pre-Depends, Depends, Conflicts and Breaks of a .deb control
+
+	local_controls are the other packages opened alongside this one, that
+	are expected to be installed in the same transaction."""
+	report = DebRelationReport()
+	pkg = AptPackage(control, "local")
+
+	local_index = PackageIndex(index.native_arch)
+	for c in local_controls or []:
+		other = AptPackage(c, "local")
+		if other.name != pkg.name:
+			local_index.add(other)
+
+	def installed_(cands):
+		return [c for c in cands if c.origin == "installed"]
+
+	for field in ("Pre-Depends", "Depends"):
+		for group in apt_parse_relations(control.get(field, "")):
+			relation = apt_format_relation(group)
+			found = {"installed": [], "local": [], "available": []}
+			for alt in group:
+				local = _apt_match_alt(local_index, pkg, alt)
+				matches = _apt_match_alt(index, pkg, alt)
+				found["local"] += local
+				found["installed"] += installed_(matches)
+				found["available"] += [c for c in matches if c.origin == "available"]
+
+			if found["installed"]:
+				report.add(field, relation, "ok", found["installed"][0].describe())
+			elif found["local"]:
+				report.add(field, relation, "ok", found["local"][0].describe())
+			elif found["available"]:
+				report.add(field, relation, "ok", found["available"][0].describe())
+			else:
+				report.add(field, relation, "missing")
+
+	for field in ("Conflicts", "Breaks"):
+		for group in apt_parse_relations(control.get(field, "")):
+			for alt in group:
+				relation = apt_format_relation([alt])
+				hits = installed_(_apt_match_alt(index, pkg, alt, exclude_self=True))
+				hits += _apt_match_alt(local_index, pkg, alt, exclude_self=True)
+				for hit in hits:
+					report.add(field, relation, "conflict", hit.describe())
+
+	# Installed packages declaring Conflicts/Breaks against this one
+	for target, target_ver in [(pkg.name, pkg.version)] + \
+			[(p[0], p[3] if p[2] == "=" else None) for p in pkg.provides]:
+		for other, field, alt in index.reverse_conflicts.get(target, []):
+			if other.name == pkg.name:
+				continue
+			name, arch, op, ver = alt
+			if op is not None and (target != pkg.name and target_ver is None):
+				continue
+			if apt_version_satisfies(target_ver, op, ver):
+				report.add(field, "%s → %s" % (other.name, apt_format_relation([alt])),
+						   "conflict", other.describe())
+
+	return report
+
+# == DEB Util == #
+deb_control_fields = ("Package", "Version", "Architecture", "Multi-Arch", "Provides",
+					  "Pre-Depends", "Depends", "Conflicts", "Breaks")
+
+class DebVerifyResult:
+	"""Outcome of checking a .deb data.tar against its md5sums control file"""
+	def __init__(self):
+		self.error = None
+		self.files_checked = 0
+		self.bytes_hashed = 0
+		self.seconds = 0.0
+		self.mismatched = []  # paths whose md5 differs
+		self.missing = []     # paths listed in md5sums but absent in data.tar
+
+	@property
+	def ok(self) -> bool:
+		return self.error is None and not self.mismatched and not self.missing
+
+	@property
+	def throughput(self) -> float:
+		"""Hashed bytes per second"""
+		if self.seconds <= 0:
+			return 0.0
+		return self.bytes_hashed / self.seconds
+
+class DebVerifyRun:
+	"""A verification in progress, the others asking for that file wait on it"""
+	def __init__(self):
+		self.done = threading.Event()
+		self.result = None  # stays None if the run was cancelled
+
+deb_verify_cache = {}
+deb_verify_running = {}  # deb_file_identity -> DebVerifyRun
+deb_verify_lock = threading.Lock()
+
+def deb_file_identity(path: str) -> tuple:
+	"""Key that changes whenever the file at path is replaced or modified"""
+	st = os.stat(path)
+	return (os.path.realpath(path), st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+def deb_member_path(path: str) -> str:
+	"""Normalize './usr/bin/x' (data.tar) and 'usr/bin/x' (md5sums) alike"""
+	path = path.strip()
+	if path.startswith("./"):
+		path = path[2:]
+	return path.lstrip("/")
+
+def deb_read_md5sums(deb_file: str) -> dict:
+	"""Returns {path: md5} from the md5sums control file, or None if missing"""
+	cmd = run_command(["dpkg-deb", "--info", deb_file, "md5sums"])
+	if cmd.returncode != 0:
+		return None
+
+	md5sums = {}
+	with cmd.parsing():
+		for line in cmd.output.splitlines():
+			# <md5>  <path relative to />
+			parts = line.strip().split(None, 1)
+			if len(parts) != 2:
+				continue
+			md5sums[deb_member_path(parts[1])] = parts[0].lower()
+	return md5sums
+
+def deb_verify_md5sums(deb_file: str) -> DebVerifyResult:
+	"""Check deb_file against its md5sums, once per version of the file
+
+	Callers asking while it is being checked share that result."""
+	try:
+		identity = deb_file_identity(deb_file)
+	except OSError as e:
+		res = DebVerifyResult()
+		res.error = str(e)
+		return res
+
+	while True:
+		with deb_verify_lock:
+			if identity in deb_verify_cache:
+				return deb_verify_cache[identity]
+			run = deb_verify_running.get(identity)
+			if run is None:
+				run = deb_verify_running[identity] = DebVerifyRun()
+				break
+		# Same file already being hashed (Verify all and a tab's Verify)
+		while not run.done.wait(0.1):
+			check_cancelled()
+		if run.result is not None:
+			return run.result
+		# Its job was cancelled, verify here instead
+
+	try:
+		res = _deb_verify_stream(deb_file, identity)
+		token = current_cancel_token()
+		# A cancelled job killed dpkg-deb, that is no result for the others
+		if token is None or not token.cancelled:
+			run.result = res
+		return res
+	finally:
+		with deb_verify_lock:
+			del deb_verify_running[identity]
+		run.done.set()
+
+def _deb_verify_stream(deb_file: str, identity: tuple) -> DebVerifyResult:
+	"""Stream data.tar once, hashing every member against md5sums"""
+	import hashlib
+	import tarfile
+
+	res = DebVerifyResult()
+	t_start = time.monotonic()
+
+	md5sums = deb_read_md5sums(deb_file)
+	if not md5sums:
+		res.error = Localize("str_integrity_no_md5sums")
+		return res
+
+	pending = dict(md5sums)
+	digests = {}  # path -> md5 of the files read so far, for hardlinks to them
+	proc = Command(["dpkg-deb", "--fsys-tarfile", deb_file], text=False)
+	try:
+		# Stream mode: members are read in archive order, no seeking
+		with tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+			for member in tar:
+				name = deb_member_path(member.name)
+				if member.islnk():
+					# Its target came earlier in the archive, same content
+					digest = digests.get(deb_member_path(member.linkname))
+				elif member.isfile():
+					md5 = hashlib.md5()
+					f = tar.extractfile(member)
+					while True:
+						chunk = f.read(1 << 20)
+						if not chunk:
+							break
+						md5.update(chunk)
+						res.bytes_hashed += len(chunk)
+					proc.record.bytes_read += member.size
+					digest = digests[name] = md5.hexdigest()
+				else:
+					continue
+
+				# Conffiles are not listed in md5sums
+				expected = pending.pop(name, None)
+				if expected is None:
+					continue
+				res.files_checked += 1
+				if digest != expected:
+					res.mismatched.append(name)
+	except (tarfile.TarError, OSError) as e:
+		res.error = str(e)
+	finally:
+		proc.stdout.close()
+		proc.wait()
+
+	if res.error is None and proc.returncode != 0:
+		res.error = "dpkg-deb --fsys-tarfile exited with %d" % proc.returncode
+
+	res.missing = sorted(pending.keys())
+	res.seconds = time.monotonic() - t_start
+
+	# Only cache complete runs, errors may be transient (e.g. shared storage)
+	if res.error is None:
+		with deb_verify_lock:
+			deb_verify_cache[identity] = res
+	return res
+
+def deb_read_info(deb_file: str) -> tuple:
+	"""(metadata shown in the header, control relation fields) from
+	'dpkg-deb -I', (None, None) if it is not readable"""
+	proc = Command(["dpkg-deb", "-I", deb_file])
+	info, _ = proc.communicate()
+	if not info:
+		return None, None
+
+	metadata = {
+		"Package": None,
+		"Version": None,
+		"Architecture": None,
+		"Installed-Size": None,
+		"Vendor": None,
+		"Maintainer": None,
+		"Homepage": None,
+		"Depends": None
+	}
+	control = {}
+	with proc.parsing():
+		for line in info.split("\n"):
+			line = line.strip()
+			for key in deb_control_fields:
+				if line.startswith("%s: " % key):
+					control[key] = line[len("%s: " % key):].strip()
+			for key in metadata.keys():
+				if line.startswith("%s: " % key):
+					value = line[len("%s: " % key):].strip()
+					if key == "Installed-Size":
+						value = format_filesize(int(value) * 1024) # size is in KiB, so scale to bytes
+					if key == "Depends":
+						value = ", ".join([d.strip() for d in value.split(",")])
+					metadata[key] = value
+	return metadata, control
+
+def deb_list_files(deb_file: str) -> list:
+	"""[(path, size)] of the data members, in archive order"""
+	proc = Command(["dpkg-deb", "-c", deb_file])
+	out, _ = proc.communicate()
+	files = []
+	with proc.parsing():
+		for line in out.splitlines():
+			# dpkg -c outputs lines like:
+			# -rw-r--r-- root/root       1234 2026-01-15 12:34 ./usr/bin/example -> /usr/share/example/example
+			parts = line.split(None, 5)
+			if len(parts) >= 6:
+				files.append((parts[5], int(parts[2])))
+	return files
+
+def deb_extract_file(deb_file: str, path: str) -> bytes:
+	"""Content of one data member, extracted in memory"""
+	p1 = Command(["dpkg-deb", "--fsys-tarfile", deb_file], text=False)
+	p2 = Command(["tar", "-xO", path], stdin=p1.stdout, text=False)
+	# Important: allow proper pipe shutdown
+	p1.stdout.close()
+	output, _ = p2.communicate()
+	p1.wait()
+	return output
+
+deb_icon_formats = (".png", ".jpg", ".jpeg", ".bmp", ".svg")
+
+def deb_icon_score(path: str) -> int:
+	score = 0
+	p = path.lower()
+
+	# Prefer hicolor theme
+	if "/hicolor/" in p:
+		score += 50
+
+	# Prefer scalable icons
+	if "/scalable/" in p:
+		score += 40
+
+	# Prefer larger size directories (e.g. 256x256 > 128x128 > 64x64)
+	m = re.search(r'/(\d+)x\1/', p)
+	if m:
+		score += int(m.group(1))
+
+	# Slight preference for PNG over others
+	if p.endswith(".png"):
+		score += 10
+
+	return score
+
+def deb_find_icon(deb_file: str, files: list) -> str:
+	"""Member path of the icon named by the .desktop files, None if none"""
+	icon = None
+	for df in [d for d in files if d.endswith(".desktop")]:
+		# Read the file and find "Icon"
+		desktop_content = deb_extract_file(deb_file, df).decode("utf-8", "replace")
+		for line in desktop_content.splitlines():
+			if line.startswith("Icon="):
+				icon = line[5:].strip()
+				break
+	if not icon:
+		return None
+
+	if icon.startswith("/"):
+		# Easy, it's an absolute path inside the package
+		return "." + icon
+
+	if icon.endswith(deb_icon_formats):
+		possible_icons = [d for d in files if d.endswith(icon)]
+	else:
+		# Try searching the Icon in some common image folders
+		possible_icons = []
+		for fmt in deb_icon_formats:
+			possible_icons += [d for d in files if d.endswith(icon + fmt)]
+
+	# Select the most probable icon from possible_icons
+	possible_icons.sort(key=deb_icon_score, reverse=True)
+	return possible_icons[0] if possible_icons else None
+
+def deb_verify_async(deb_file: str, callback, source=None) -> Job:
+	"""Verify as a scheduler job, callback(result) is called from the worker
+
+	Not called at all if the job is cancelled. Unexpected failures still
+	call it, with the error in the result."""
+	def worker_():
+		try:
+			res = deb_verify_md5sums(deb_file)
+		except Exception as e:
+			print("Verifying %s failed: %s" % (deb_file, e), file=sys.stderr)
+			res = DebVerifyResult()
+			res.error = str(e)
+		check_cancelled()
+		callback(res)
+	return job_scheduler.submit(worker_, source=source, long=True)
+
+# == APT query helper == #
+apt_cache_dir = apt_root_path("/var/cache/apt")
+apt_etc_dir = apt_root_path("/etc/apt")
+
+def apt_cache_stamp() -> tuple:
+	"""Changes whenever apt or dpkg rewrite their package databases"""
+	stamp = []
+	for path in (os.path.join(apt_cache_dir, "pkgcache.bin"), dpkg_status_path, apt_lists_dir):
+		try:
+			st = os.stat(path)
+			stamp.append((st.st_mtime_ns, st.st_size))
+		except OSError:
+			stamp.append(None)
+	return tuple(stamp)
+
+def apt_pinned_packages():
+	"""Packages whose candidate apt preferences may change
+
+	Returns a set of names, or None when some pin (or a default release)
+	applies to every package."""
+	pinned = set()
+	prefs = [os.path.join(apt_etc_dir, "preferences")]
+	prefs += glob.glob(os.path.join(apt_etc_dir, "preferences.d", "*"))
+	for path in prefs:
+		name = os.path.basename(path)
+		# apt ignores files with other extensions than none or .pref
+		if "." in name and not name.endswith(".pref"):
+			continue
+		try:
+			with open(path, "r", encoding="utf-8", errors="replace") as f:
+				for fields in iter_deb822(f, {"Package"}):
+					for pkg in fields.get("Package", "").split():
+						# Globs and regexes may match anything
+						if any(c in pkg for c in "*?[/"):
+							return None
+						pinned.add(pkg.lower())
+		except OSError:
+			continue
+	cmd = run_command(["apt-config", *apt_dir_options, "shell", "V", "APT::Default-Release"])
+	if cmd.output.strip():
+		return None
+	return pinned
+
+def apt_release_for_list(list_file: str) -> dict:
+	"""Fields of the (In)Release file a Packages list was fetched with"""
+	base = os.path.basename(list_file)
+	i_dists = base.find("_dists_")
+	if i_dists == -1:
+		return {}
+	# <host>_<path>_dists_<suite>_<component>_binary-<arch>_Packages
+	suite_end = base.find("_", i_dists + len("_dists_"))
+	prefix = os.path.join(os.path.dirname(list_file), base[:suite_end])
+	for release in (prefix + "_InRelease", prefix + "_Release"):
+		try:
+			with open(release, "r", encoding="utf-8", errors="replace") as f:
+				for fields in iter_deb822(f, {"Origin", "Label", "Suite", "Codename",
+											  "NotAutomatic", "ButAutomaticUpgrades"}):
+					return fields
+		except OSError:
+			continue
+	return {}
+
+def apt_list_arch(list_file: str) -> str:
+	m = re.search(r"_binary-([a-z0-9\-]+)_Packages", os.path.basename(list_file))
+	return m.group(1) if m else None
+
+class LRUCache:
+	"""The size most recently used entries of a dict"""
+	def __init__(self, size: int):
+		import collections
+		self.size = size
+		self.entries = collections.OrderedDict()
+		self.lock = threading.Lock()
+
+	def get(self, key, default=None):
+		with self.lock:
+			if key not in self.entries:
+				return default
+			self.entries.move_to_end(key)
+			return self.entries[key]
+
+	def put(self, key, value):
+		with self.lock:
+			self.entries[key] = value
+			self.entries.move_to_end(key)
+			while len(self.entries) > self.size:
+				self.entries.popitem(last=False)
+
+	def items(self) -> list:
+		with self.lock:
+			return list(self.entries.items())
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+
+# Recent queries answered without matching again, per process
+SEARCH_CACHE_SIZE = 32
+
+# Search terms "field:value" answered by AptFieldIndex bitmaps
+apt_query_fields = ("section", "maintainer", "arch", "origin", "suite",
+					"priority", "installed", "size", "tag")
+_query_size_re = re.compile(r"^(\d+(?:\.\d+)?)([kmgt]?)i?b?$")
+
+def apt_query_field(term: str) -> bool:
+	field, sep, _ = term.partition(":")
+	return bool(sep) and field.lower() in apt_query_fields
+
+def parse_query_size(text: str) -> float:
+	"""KiB (the unit of Installed-Size) of a size like 512, 10k or 1.5M"""
+	m = _query_size_re.match(text.strip().lower())
+	if not m:
+		raise ValueError("Bad size: %s" % text)
+	return float(m.group(1)) * 1024 ** " kmgt".index(m.group(2) or " ") / 1024
+
+def parse_query_size_range(value: str) -> tuple:
+	"""(low, high) KiB of 1M..5M, >10M, <=100k or 2M; None if unbounded
+
+	Bounds are inclusive except for > and <, which move them by a KiB."""
+	if ".." in value:
+		low, high = value.split("..", 1)
+		return (parse_query_size(low) if low else None,
+				parse_query_size(high) if high else None)
+	for op in (">=", "<=", ">", "<"):
+		if value.startswith(op):
+			size = parse_query_size(value[len(op):])
+			if op[0] == ">":
+				return (size + 1 if op == ">" else size), None
+			return None, (size - 1 if op == "<" else size)
+	size = parse_query_size(value)
+	return size, size
+
+def parse_apt_query(terms: list) -> tuple:
+	"""([(field, value)], free terms) of a search, see apt_query_fields
+
+	section:python maintainer:foo installed:no arch:arm64 size:>10M ...
+	Values are lowercase, may use * and ? wildcards (maintainer: matches
+	any part of the field), installed: is a bool and size: a (low, high) range. Free
+	terms keep matching names and descriptions."""
+	fields, free = [], []
+	for term in terms:
+		if not apt_query_field(term):
+			free.append(term)
+			continue
+		field, _, value = term.partition(":")
+		field, value = field.lower(), value.strip().lower()
+		if field == "installed":
+			if value not in ("yes", "no", "true", "false", "1", "0"):
+				raise ValueError("installed: takes yes or no, not %s" % value)
+			value = value in ("yes", "true", "1")
+		elif field == "size":
+			value = parse_query_size_range(value)
+		fields.append((field, value))
+	return fields, free
+
+def search_terms_refine(terms, base) -> bool:
+	"""True if whatever matches every term of terms matches every base term
+
+	Only plain text terms are compared (one containing the other), regular
+	expressions never refine anything; both need the same field terms, an
+	extra one would not be applied to the cached rows."""
+	def literal(term):
+		return not apt_query_field(term) and not any(c in term for c in ".^$*+?{}[]\\|()")
+	if {t for t in terms if apt_query_field(t)} != {b for b in base if apt_query_field(b)}:
+		return False
+	words = [t.lower() for t in terms if literal(t)]
+	return all(apt_query_field(b) or literal(b) and any(b.lower() in t for t in words)
+			   for b in base)
+
+def bitmap_from_ids(ids) -> int:
+	"""Python int with the bits of ids set"""
+	ids = list(ids)
+	if not ids:
+		return 0
+	bits = bytearray((max(ids) >> 3) + 1)
+	for i in ids:
+		bits[i >> 3] |= 1 << (i & 7)
+	return int.from_bytes(bits, "little")
+
+def bitmap_ids(mask: int) -> list:
+	"""Positions of the set bits of mask, ascending"""
+	bits = bin(mask)[:1:-1]
+	res = []
+	i = bits.find("1")
+	while i != -1:
+		res.append(i)
+		i = bits.find("1", i + 1)
+	return res
+
+class AptFieldIndex:
+	"""Bitmaps of the packages of one list (or the status file) per value
+	of the fields parse_apt_query can ask for
+
+	A package is a bit, numbered by AptQueryService.ids; queries OR the
+	indexes of every list and AND one bitmap per field term."""
+	FIELDS = (("section", "Section"), ("maintainer", "Maintainer"),
+			  ("arch", "Architecture"), ("priority", "Priority"), ("tag", "Tag"))
+
+	def __init__(self):
+		import collections
+		# field -> raw value -> [ids], while adding (values repeat a lot,
+		# they are split and lowercased once each in finish)
+		self.values = {field: collections.defaultdict(list) for field, _ in self.FIELDS}
+		self.all_ids = []
+		self.sizes = []  # (Installed-Size, id)
+
+	def add(self, pkg_id: int, fields: dict):
+		self.all_ids.append(pkg_id)
+		values = self.values
+		for field, key in self.FIELDS:
+			value = fields.get(key)
+			if value:
+				values[field][value].append(pkg_id)
+		size = fields.get("Installed-Size")
+		if size and size.isdigit():
+			self.sizes.append((int(size), pkg_id))
+
+	@staticmethod
+	def _keys(field: str, value: str) -> list:
+		value = value.lower()
+		if field == "tag":
+			return [tag.strip() for tag in value.split(",") if tag.strip()]
+		if field == "section" and "/" in value:
+			# contrib/net is also in net
+			return [value, value.rsplit("/", 1)[1]]
+		return [value]
+
+	def finish(self):
+		"""Turn the id lists into bitmaps, nothing can be added after"""
+		self.bitmaps = {}
+		for field, values in self.values.items():
+			keys = {}
+			for value, ids in values.items():
+				for key in self._keys(field, value):
+					keys.setdefault(key, []).extend(ids)
+			self.bitmaps[field] = {key: bitmap_from_ids(ids) for key, ids in keys.items()}
+		self.all = bitmap_from_ids(self.all_ids)
+		self.sizes.sort()
+		self.size_keys = [size for size, _ in self.sizes]
+		del self.values, self.all_ids
+
+	def match(self, field: str, value) -> int:
+		import bisect
+		import fnmatch
+		if field == "size":
+			low, high = value
+			i = 0 if low is None else bisect.bisect_left(self.size_keys, low)
+			j = len(self.sizes) if high is None else bisect.bisect_right(self.size_keys, high)
+			return bitmap_from_ids(pkg_id for _, pkg_id in self.sizes[i:j])
+		values = self.bitmaps[field]
+		if field == "maintainer":
+			pattern = "*%s*" % value
+		elif any(c in value for c in "*?["):
+			pattern = value
+		else:
+			return values.get(value, 0)
+		mask = 0
+		for candidate, bitmap in values.items():
+			if fnmatch.fnmatchcase(candidate, pattern):
+				mask |= bitmap
+		return mask
+
+class AptQueryService:
+	"""Answers package queries from the apt lists, kept in memory
+
+	This is what the helper process and the daemon run: the lists are read
+	once and every query is served without spawning apt-cache. Each list
+	file is its own partition, refresh() re-reads only the ones apt changed."""
+	FIELDS = {"Package", "Version", "Architecture", "Description", "Description-md5",
+			  # Only kept in the AptFieldIndex bitmaps
+			  "Section", "Maintainer", "Priority", "Installed-Size", "Tag"}
+
+	def __init__(self, status_path: str = None, lists_dir: str = None):
+		self.status_path = status_path or dpkg_status_path
+		self.lists_dir = lists_dir or apt_lists_dir
+		# Queries wait for a refresh in progress (the daemon serves threads)
+		self.lock = threading.RLock()
+		self.stamp = None
+		self.pinned = None
+		self.sources = {}      # list file -> {path, arch, priority, data, names, index}
+		self.records = {}      # name -> [{version, arch, source, start, end, desc, md5}]
+		self.installed = {}    # name -> [{version, arch, text}]
+		self.translations = {} # Translation file -> {Description-md5: long description}
+		self.status_signature = None
+		self.status_index = AptFieldIndex()
+		self.status_index.finish()
+		self.list_changes = AptListChanges()
+		self.names = []
+		# Bit numbers of the AptFieldIndex bitmaps, never reused
+		self.ids = {}
+		self.id_names = []
+		# terms -> rows of the finished searches, and the state of the ones paging
+		self.search_cache = LRUCache(SEARCH_CACHE_SIZE)
+		self.search_runs = LRUCache(SEARCH_CACHE_SIZE)
+		self.refresh()
+
+	def refresh(self, fetched: set = None) -> dict:
+		"""Reindex the lists that changed since the last refresh
+
+		fetched holds list names apt-get update reported downloading (see
+		apt_update_fetched). Returns {"reindexed": [...], "removed": [...],
+		"kept": n} so callers can tell how much work it was."""
+		with self.lock:
+			self.stamp = apt_cache_stamp()
+			self.pinned = apt_pinned_packages()
+			list_files = apt_list_files(self.lists_dir)
+			tr_files = apt_translation_files(self.lists_dir)
+			changed, removed = self.list_changes.changes(list_files + tr_files, fetched)
+
+			touched = set()
+			for path in removed + changed:
+				touched |= self._drop(path)
+			for path in changed:
+				if path in tr_files:
+					self._load_translation(path)
+				else:
+					touched |= self._load_list(path)
+			for source in self.sources.values():
+				# The Release may have changed without the list (Hit)
+				self._set_priority(source)
+
+			status = apt_file_signature(self.status_path)
+			status_changed = status != self.status_signature
+			if status_changed:
+				self.status_signature = status
+				self.load_status()
+				self.names = sorted(set(self.records) | set(self.installed))
+			else:
+				self._update_names(touched)
+			if changed or removed or status_changed:
+				self.search_cache.clear()
+				self.search_runs.clear()
+			return {"reindexed": changed, "removed": removed,
+					"kept": len(list_files) + len(tr_files) - len(changed)}
+
+	@staticmethod
+	def _set_priority(source: dict):
+		release = apt_release_for_list(source["path"])
+		priority = 500
+		if release.get("NotAutomatic") == "yes":
+			priority = 100 if release.get("ButAutomaticUpgrades") == "yes" else 1
+		source["release"], source["priority"] = release, priority
+
+	def _load_list(self, list_file: str) -> set:
+		"""Add the records of one list, returns the names it holds"""
+		signature = apt_file_signature(list_file)
+		compressed = list_file.endswith((".gz", ".xz", ".bz2", ".lz4", ".zst"))
+		if compressed:
+			f = apt_open_index_file(list_file)
+			if f is None:
+				return set()
+			with f:
+				data = f.read().encode("utf-8")
+		else:
+			try:
+				with open(list_file, "rb") as f:
+					data = f.read()
+			except OSError:
+				return set()
+
+		source = {"path": list_file, "arch": apt_list_arch(list_file),
+				  # Uncompressed lists are re-read on demand by offset
+				  "data": data if compressed else None}
+		self._set_priority(source)
+		names = set()
+		index = AptFieldIndex()
+		for start, end in self._stanzas(data):
+			fields = self._fields(data[start:end].decode("utf-8", "replace"))
+			name = fields.get("Package", "").lower()
+			if not name:
+				continue
+			names.add(name)
+			index.add(self._id(name), fields)
+			self.records.setdefault(name, []).append({
+				"version": fields.get("Version", ""),
+				"arch": fields.get("Architecture", ""),
+				"source": list_file,
+				"start": start, "end": end,
+				"desc": fields.get("Description", ""),
+				"md5": fields.get("Description-md5"),
+			})
+		source["names"] = names
+		index.finish()
+		source["index"] = index
+		self.sources[list_file] = source
+		self.list_changes.add(list_file, signature, None if compressed else data)
+		return names
+
+	def _load_translation(self, tr_file: str):
+		signature = apt_file_signature(tr_file)
+		f = apt_open_index_file(tr_file)
+		if f is None:
+			return
+		descs = {}
+		with f:
+			for fields in iter_deb822(f, {"Description-md5", "Description-en"}):
+				if "Description-md5" in fields:
+					descs[fields["Description-md5"]] = fields.get("Description-en", "")
+		self.translations[tr_file] = descs
+		self.list_changes.add(tr_file, signature)
+
+	def _drop(self, path: str) -> set:
+		"""Take out one list or translation file, returns the names it held"""
+		self.list_changes.forget(path)
+		self.translations.pop(path, None)
+		source = self.sources.pop(path, None)
+		if source is None:
+			return set()
+		for name in source["names"]:
+			left = [rec for rec in self.records.get(name, []) if rec["source"] != path]
+			if left:
+				self.records[name] = left
+			else:
+				self.records.pop(name, None)
+		return source["names"]
+
+	def _update_names(self, touched: set):
+		"""Keep the sorted name index in step with the records, per name"""
+		import bisect
+		for name in touched:
+			i = bisect.bisect_left(self.names, name)
+			present = i < len(self.names) and self.names[i] == name
+			wanted = name in self.records or name in self.installed
+			if wanted and not present:
+				self.names.insert(i, name)
+			elif present and not wanted:
+				del self.names[i]
+
+	def _id(self, name: str) -> int:
+		pkg_id = self.ids.get(name)
+		if pkg_id is None:
+			pkg_id = self.ids[name] = len(self.id_names)
+			self.id_names.append(name)
+		return pkg_id
+
+	def load_status(self):
+		self.installed = {}
+		index = AptFieldIndex()
+		try:
+			with open(self.status_path, "r", encoding="utf-8", errors="replace") as f:
+				text = f.read()
+		except OSError:
+			text = ""
+		for block in text.split("\n\n"):
+			fields = self._fields(block)
+			status = fields.get("Status", "").split()
+			if not status or status[-1] != "installed":
+				continue
+			name = fields.get("Package", "").lower()
+			index.add(self._id(name), fields)
+			self.installed.setdefault(name, []).append({
+				"version": fields.get("Version", ""),
+				"arch": fields.get("Architecture", ""),
+				"text": block.strip(),
+				"desc": fields.get("Description", ""),
+			})
+		index.finish()
+		self.status_index = index
+
+	@staticmethod
+	def _stanzas(data: bytes):
+		pos = 0
+		while pos < len(data):
+			end = data.find(b"\n\n", pos)
+			if end == -1:
+				end = len(data)
+			if end > pos:
+				yield pos, end
+			pos = end + 2
+
+	@staticmethod
+	def _fields(text: str) -> dict:
+		fields = {}
+		key = None
+		for line in text.split("\n"):
+			if line[:1] in (" ", "\t"):
+				if key in ("Description", "Tag"):
+					fields[key] += "\n" + line
+				continue
+			i_sep = line.find(":")
+			if i_sep == -1:
+				key = None
+				continue
+			key = line[:i_sep]
+			if key in AptQueryService.FIELDS or key == "Status":
+				fields[key] = line[i_sep + 1:].strip()
+			else:
+				key = None
+		return fields
+
+	def _record_text(self, rec: dict) -> str:
+		source = self.sources[rec["source"]]
+		data = source["data"]
+		if data is None:
+			with open(source["path"], "rb") as f:
+				f.seek(rec["start"])
+				return f.read(rec["end"] - rec["start"]).decode("utf-8", "replace")
+		return data[rec["start"]:rec["end"]].decode("utf-8", "replace")
+
+	def pkgnames(self, prefix: str) -> list:
+		import bisect
+		prefix = prefix.lower()
+		res = []
+		for i in range(bisect.bisect_left(self.names, prefix), len(self.names)):
+			if not self.names[i].startswith(prefix):
+				break
+			res.append(self.names[i])
+		return res
+
+	def policy(self, name: str) -> dict:
+		"""Same data as parse_apt_policy: installed, candidate and archs
+
+		Like apt-cache policy, of the native architecture package (or the
+		one of name:arch); the other architectures are left out."""
+		name, _, arch = name.strip().lower().partition(":")
+		native = apt_native_arch()
+		def arch_of(rec):
+			return native if rec["arch"] == "all" else rec["arch"]
+		present = {arch_of(rec) for rec in self.records.get(name, []) + self.installed.get(name, [])}
+		# apt picks between foreign architectures itself
+		exact = bool(arch) or native in present or len(present) <= 1
+		if not arch:
+			arch = native if native in present or not present else sorted(present)[0]
+
+		installed = [rec for rec in self.installed.get(name, []) if arch_of(rec) == arch]
+		versions = []
+		archs = []
+		for rec in self.records.get(name, []):
+			if arch_of(rec) != arch:
+				continue
+			source = self.sources[rec["source"]]
+			versions.append((source["priority"], rec["version"]))
+			if source["arch"] and source["arch"] not in archs:
+				archs.append(source["arch"])
+
+		inst_ver = installed[0]["version"] if installed else None
+		candidate = None
+		for priority, version in versions:
+			if candidate is None or priority > candidate[0] or \
+					(priority == candidate[0] and apt_version_compare(version, candidate[1]) > 0):
+				candidate = (priority, version)
+		if inst_ver is not None:
+			# Never downgrade or pick a lower priority than the installed one
+			if candidate is None or candidate[0] < 100 or \
+					(candidate[0] < 1000 and apt_version_compare(candidate[1], inst_ver) < 0):
+				candidate = (100, inst_ver)
+
+		return {
+			"installed": inst_ver or "(none)",
+			"candidate": candidate[1] if candidate else "(none)",
+			"archs": archs,
+			# Pinned packages are only resolved exactly by apt itself
+			"exact": exact and self.pinned is not None and name not in self.pinned,
+		}
+
+	def show(self, name: str) -> str:
+		name = name.strip().lower()
+		blocks = []
+		seen = set()
+		for rec in self.records.get(name, []):
+			key = (rec["version"], rec["arch"])
+			if key in seen:
+				continue
+			seen.add(key)
+			blocks.append(self._record_text(rec).strip())
+		for rec in self.installed.get(name, []):
+			if (rec["version"], rec["arch"]) not in seen:
+				blocks.append(rec["text"])
+		return "\n\n".join(blocks)
+
+	def _description(self, rec: dict) -> str:
+		desc = rec.get("desc", "")
+		if "\n" not in desc and rec.get("md5"):
+			for descs in self.translations.values():
+				if rec["md5"] in descs:
+					return descs[rec["md5"]]
+		return desc
+
+	def search(self, terms: list) -> list:
+		"""[(name, short description)] like 'apt-cache search', sorted by name"""
+		return self.search_page(terms, 0, len(self.names))["rows"]
+
+	def _field_mask(self, field: str, value) -> int:
+		"""Bitmap of the packages matching one parse_apt_query field term"""
+		import fnmatch
+		indexes = [source["index"] for source in self.sources.values()] + [self.status_index]
+		if field == "installed":
+			if value:
+				return self.status_index.all
+			available = 0
+			for index in indexes:
+				available |= index.all
+			return available & ~self.status_index.all
+		if field in ("origin", "suite"):
+			# Per list, from its Release file
+			keys = ("Origin", "Label") if field == "origin" else ("Suite", "Codename")
+			mask = 0
+			for source in self.sources.values():
+				if any(fnmatch.fnmatchcase(source["release"].get(key, "").lower(), value)
+					   for key in keys):
+					mask |= source["index"].all
+			return mask
+		mask = 0
+		for index in indexes:
+			mask |= index.match(field, value)
+		return mask
+
+	def query(self, fields: list) -> list:
+		"""Sorted names matching every (field, value) of parse_apt_query"""
+		mask = None
+		for field, value in fields:
+			bitmap = self._field_mask(field, value)
+			mask = bitmap if mask is None else mask & bitmap
+			if not mask:
+				return []
+		return sorted(self.id_names[i] for i in bitmap_ids(mask))
+
+	def _search_universe(self, terms: list, fields: list) -> list:
+		"""Names a search has to look at: the matches of the smallest cached
+		search it refines, else every name (or those matching fields)"""
+		best = None
+		for base, rows in self.search_cache.items():
+			if search_terms_refine(terms, base) and (best is None or len(rows) < len(best)):
+				best = rows
+		if best is not None:
+			return [name for name, _ in best]
+		return self.query(fields) if fields else self.names
+
+	def search_page(self, terms: list, start: int, scan: int) -> dict:
+		"""Matches among the scan names from index start on
+
+		{"rows": [(name, short description)], "next": start of the next
+		page, None at the end}; pages keep a long search interruptible.
+		A finished search is cached whole, and a search that refines a
+		cached one only looks at its matches. Field terms (parse_apt_query)
+		pick the names from the field bitmaps before any text is matched."""
+		fields, free = parse_apt_query(terms)
+		key = tuple(terms)
+		if start == 0:
+			cached = self.search_cache.get(key)
+			if cached is not None:
+				return {"rows": cached, "next": None}
+		run = self.search_runs.get(key)
+		if run is None or start == 0:
+			# Indexes of later pages refer to this universe, keep it
+			universe = run["universe"] if run is not None else self._search_universe(terms, fields)
+			run = {"universe": universe, "rows": [], "next": 0}
+			self.search_runs.put(key, run)
+		universe = run["universe"]
+
+		patterns = []
+		for term in free:
+			try:
+				patterns.append(re.compile(term, re.I))
+			except re.error:
+				patterns.append(re.compile(re.escape(term), re.I))
+
+		res = []
+		end = min(start + scan, len(universe))
+		for name in universe[start:end]:
+			recs = self.records.get(name) or self.installed.get(name, [])
+			for rec in recs:
+				desc = self._description(rec)
+				haystack = name + "\n" + desc
+				if all(p.search(haystack) for p in patterns):
+					res.append((name, desc.split("\n", 1)[0].strip()))
+					break
+		if start == run["next"]:
+			run["rows"].extend(res)
+			run["next"] = end
+			if end >= len(universe):
+				self.search_cache.put(key, run["rows"])
+		return {"rows": res, "next": end if end < len(universe) else None}
+
+	def handle(self, request: dict):
+		op = request.get("op")
+		with self.lock:
+			if op == "ping":
+				return {"stamp": self.stamp}
+			if op == "refresh":
+				return self.refresh(set(request.get("fetched", [])))
+			if op == "pkgnames":
+				return self.pkgnames(request.get("prefix", ""))
+			if op == "policy":
+				return {name: self.policy(name) for name in request.get("names", [])}
+			if op == "show":
+				return self.show(request.get("name", ""))
+			if op == "search":
+				return self.search(request.get("terms", []))
+			if op == "search_page":
+				return self.search_page(request.get("terms", []), request.get("start", 0),
+										request.get("scan", SEARCH_PAGE_SCAN))
+		raise ValueError("Unknown operation: %s" % op)
+
+def apt_helper_main() -> int:
+	"""Serve AptQueryService over stdin/stdout, one JSON object per line"""
+	import json
+	service = AptQueryService()
+	sys.stdout.write(json.dumps({"ready": True}) + "\n")
+	sys.stdout.flush()
+	for line in sys.stdin:
+		if not line.strip():
+			continue
+		req_id = None
+		try:
+			request = json.loads(line)
+			req_id = request.get("id")
+			response = {"id": req_id, "result": service.handle(request)}
+		except Exception as e:
+			response = {"id": req_id, "error": str(e)}
+		sys.stdout.write(json.dumps(response) + "\n")
+		sys.stdout.flush()
+	return 0
+
+class AptHelperError(Exception):
+	pass
+
+class AptHelperClient:
+	"""Talks to a long-lived helper process holding the apt lists in memory
+
+	The helper is started on first use. When the package databases change
+	on disk it reindexes the lists that changed, and is restarted only if
+	it died."""
+	def __init__(self):
+		self.cmd = None
+		self.stamp = None
+		self.next_id = 0
+		self.lock = threading.Lock()
+		self.disabled = False
+
+	def _stop(self):
+		if self.cmd is not None:
+			try:
+				self.cmd.stdin.close()
+			except OSError:
+				pass
+			if self.cmd.poll() is None:
+				self.cmd.terminate()
+			self.cmd.wait()
+			self.cmd = None
+
+	def _start(self):
+		import json
+		self.stamp = apt_cache_stamp()
+		# Outlives the job that happened to start it
+		self.cmd = Command([sys.executable, os.path.abspath(__file__), "--apt-helper"],
+						   stdin=subprocess.PIPE, bufsize=1, cancellable=False)
+		ready = self.cmd.stdout.readline()
+		if not ready or not json.loads(ready).get("ready"):
+			self._stop()
+			raise AptHelperError("apt helper did not start")
+
+	def _call(self, op: str, params: dict):
+		import json
+		try:
+			self.next_id += 1
+			params.update({"id": self.next_id, "op": op})
+			self.cmd.stdin.write(json.dumps(params) + "\n")
+			self.cmd.stdin.flush()
+			line = self.cmd.stdout.readline()
+			self.cmd.record.bytes_read += len(line)
+		except (OSError, ValueError) as e:
+			# Do not keep retrying a broken helper, fall back to apt-cache
+			self._stop()
+			self.disabled = True
+			raise AptHelperError(str(e))
+
+		if not line:
+			self._stop()
+			raise AptHelperError("apt helper exited")
+		try:
+			response = json.loads(line)
+			if "error" not in response:
+				return response["result"]
+		except (ValueError, TypeError, KeyError) as e:
+			# Truncated or garbage output, same as a broken pipe
+			self._stop()
+			self.disabled = True
+			raise AptHelperError("Bad apt helper response: %s" % e)
+		raise AptHelperError(response["error"])
+
+	def request(self, op: str, **params):
+		with self.lock:
+			if self.disabled:
+				raise AptHelperError("apt helper disabled")
+			try:
+				if self.cmd is not None and self.cmd.poll() is not None:
+					self._stop()
+				if self.cmd is None:
+					self._start()
+			except (OSError, ValueError) as e:
+				self._stop()
+				self.disabled = True
+				raise AptHelperError(str(e))
+
+			stamp = apt_cache_stamp()
+			if self.stamp != stamp:
+				self.stamp = stamp
+				self._call("refresh", {"fetched": sorted(apt_lists_fetched)})
+			return self._call(op, params)
+
+	def close(self):
+		with self.lock:
+			self._stop()
+
+apt_helper = AptHelperClient()
+atexit.register(apt_helper.close)
+
+def apt_pkgnames(prefix: str) -> list:
+	try:
+		return apt_helper.request("pkgnames", prefix=prefix)
+	except AptHelperError:
+		cmd = run_command(["apt-cache", *apt_dir_options, "pkgnames", prefix], env=APT_ENV_C)
+		return [l.strip() for l in cmd.output.splitlines() if l.strip()]
+
+def apt_policy(pkgname: str) -> tuple:
+	"""(installed, candidate, archs) of a package"""
+	try:
+		res = apt_helper.request("policy", names=[pkgname])[pkgname]
+		if res["exact"]:
+			return res["installed"], res["candidate"], res["archs"]
+	except AptHelperError:
+		pass
+	cmd = run_command(["apt-cache", *apt_dir_options, "policy", pkgname.strip()], env=APT_ENV_C)
+	with cmd.parsing():
+		return parse_apt_policy(cmd.output)
+
+def apt_show(pkgname: str) -> str:
+	try:
+		return apt_helper.request("show", name=pkgname)
+	except AptHelperError:
+		return run_command(["apt-cache", *apt_dir_options, "show", pkgname], env=APT_ENV_USER).output
+
+def apt_search(search_term: str) -> list:
+	"""[(name, short description)] matching every term of search_term"""
+	try:
+		return [tuple(r) for r in apt_helper.request("search", terms=search_term.split())]
+	except AptHelperError:
+		pass
+	cmd = run_command(["apt-cache", *apt_dir_options, "search", *search_term.split()], env=APT_ENV_C)
+	with cmd.parsing():
+		return list(iter_apt_cache_search(cmd.output.splitlines()))
+
+# Names a search_page request looks at, a few milliseconds of matching
+SEARCH_PAGE_SCAN = 2000
+
+def apt_search_pages(request, terms: list):
+	"""Rows of search_page requests (helper or daemon), one page at a time
+
+	The first page is asked right away, so an unavailable helper raises
+	here and not halfway through the rows."""
+	page = request("search_page", terms=terms, start=0, scan=SEARCH_PAGE_SCAN)
+	def rows_(page):
+		while True:
+			for row in page["rows"]:
+				yield tuple(row)
+			if page["next"] is None:
+				return
+			check_cancelled()
+			page = request("search_page", terms=terms, start=page["next"], scan=SEARCH_PAGE_SCAN)
+	return rows_(page)
+
+def apt_iter_search(search_term: str):
+	"""Same rows as apt_search, as soon as they are found"""
+	try:
+		return apt_search_pages(apt_helper.request, search_term.split())
+	except AptHelperError:
+		pass
+	cmd = Command(["apt-cache", *apt_dir_options, "search", *search_term.split()], env=APT_ENV_C)
+	return iter_apt_cache_search(cmd.lines())
+
+def apt_reindex(fetched: set):
+	"""Reindex what apt-get update just fetched now, not on the next query"""
+	apt_lists_fetched.clear()
+	apt_lists_fetched.update(fetched)
+	if apt_helper.cmd is not None:
+		try:
+			# Any request refreshes the helper once the lists moved
+			apt_helper.request("ping")
+		except AptHelperError:
+			pass
+	if package_index is not None:
+		get_package_index()
+
+# == APT sources == #
+# One-line options and the deb822 fields they stand for
+apt_source_options = {
+	"arch": "Architectures", "lang": "Languages", "target": "Targets",
+	"pdiffs": "PDiffs", "by-hash": "By-Hash", "trusted": "Trusted",
+	"signed-by": "Signed-By", "allow-insecure": "Allow-Insecure",
+	"allow-weak": "Allow-Weak", "allow-downgrade-to-insecure": "Allow-Downgrade-To-Insecure",
+	"check-valid-until": "Check-Valid-Until", "valid-until-min": "Valid-Until-Min",
+	"valid-until-max": "Valid-Until-Max", "check-date": "Check-Date",
+	"date-max-future": "Date-Max-Future", "inrelease-path": "InRelease-Path",
+	"snapshot": "Snapshot",
+}
+_apt_source_line_re = re.compile(r"^(deb|deb-src)\s+(?:\[([^\]]*)\]\s+)?(\S+)\s+(\S+)\s*(.*)$")
+
+class AptSource:
+	"""One repository of the sources lists: a URI and a suite
+
+	options holds the other deb822 fields (Signed-By, Architectures...), so
+	the source can be written back alone for a targeted apt-get update."""
+	def __init__(self, path: str, types: list, uri: str, suite: str, components: list,
+				 options: dict = None, enabled: bool = True):
+		self.path = path
+		self.types = types
+		self.uri = uri
+		self.suite = suite
+		self.components = components
+		self.options = options or {}
+		self.enabled = enabled
+
+	def release_files(self, lists_dir: str = None) -> list:
+		"""InRelease and Release as apt stores them for this source"""
+		base = self.uri.rstrip("/")
+		# Flat repositories have a path ending in "/" instead of a suite
+		dists = "%s/%s" % (base, self.suite) if self.suite.endswith("/") \
+			else "%s/dists/%s/" % (base, self.suite)
+		return [os.path.join(lists_dir or apt_lists_dir, apt_uri_filename(dists + name))
+				for name in ("InRelease", "Release")]
+
+	def last_refresh(self, lists_dir: str = None) -> float:
+		"""When its Release was last fetched (mtime), None if never"""
+		for path in self.release_files(lists_dir):
+			try:
+				return os.stat(path).st_mtime
+			except OSError:
+				continue
+		return None
+
+	def deb822(self) -> str:
+		fields = [("Types", " ".join(self.types)), ("URIs", self.uri), ("Suites", self.suite)]
+		if self.components:
+			fields.append(("Components", " ".join(self.components)))
+		fields += sorted(self.options.items())
+		return "".join("%s: %s\n" % (key, value.replace("\n", "\n ")) for key, value in fields)
+
+def apt_parse_source_line(line: str, path: str) -> AptSource:
+	"""A one-line style entry, None for comments and blank lines"""
+	m = _apt_source_line_re.match(line.split("#", 1)[0].strip())
+	if not m:
+		return None
+	options = {}
+	for opt in (m.group(2) or "").split():
+		key, _, value = opt.partition("=")
+		suffix = ""
+		if key.endswith(("+", "-")):
+			key, suffix = key[:-1], "-Add" if key.endswith("+") else "-Remove"
+		field = apt_source_options.get(key, key.title())
+		options[field + suffix] = value.replace(",", " ")
+	return AptSource(path, [m.group(1)], m.group(3), m.group(4), m.group(5).split(), options)
+
+def apt_parse_sources_file(path: str) -> list:
+	"""Sources of a .list (one-line) or .sources (deb822) file"""
+	try:
+		with open(path, "r", encoding="utf-8", errors="replace") as f:
+			lines = f.readlines()
+	except OSError:
+		return []
+	if not path.endswith(".sources"):
+		return [src for src in (apt_parse_source_line(l, path) for l in lines) if src]
+
+	sources = []
+	for fields in iter_deb822(l for l in lines if not l.startswith("#")):
+		enabled = fields.pop("Enabled", "yes").strip().lower() != "no"
+		types = fields.pop("Types", "").split()
+		uris = fields.pop("URIs", "").split()
+		suites = fields.pop("Suites", "").split()
+		components = fields.pop("Components", "").split()
+		for uri in uris:
+			for suite in suites:
+				sources.append(AptSource(path, types, uri, suite, components, dict(fields), enabled))
+	return sources
+
+def apt_sources(etc_dir: str = None) -> list:
+	"""Every source of sources.list and sources.list.d, in apt's order"""
+	etc_dir = etc_dir or apt_etc_dir
+	parts = sorted(glob.glob(os.path.join(etc_dir, "sources.list.d", "*.list")) +
+				   glob.glob(os.path.join(etc_dir, "sources.list.d", "*.sources")))
+	sources = []
+	for path in [os.path.join(etc_dir, "sources.list")] + parts:
+		sources.extend(apt_parse_sources_file(path))
+	return sources
+
+update_history_path = os.path.join(state_dir, "update-history.jsonl")
+# Runs kept in the history file, older ones are dropped
+UPDATE_HISTORY_RUNS = 200
+
+class AptUpdateStats:
+	"""Per-source events of an apt-get update run, fed its output lines
+
+	A source is a URI and suite; for each one it counts the Hit, Get, Ign
+	and Err items, the bytes fetched and the time from its first line to
+	its last one."""
+	def __init__(self):
+		self.started = time.monotonic()
+		self.wall_started = time.time()
+		self.sources = {}
+		self.summary = None
+		self._err_source = None
+
+	def feed(self, line: str) -> bool:
+		"""Account for one output line, True if some source changed"""
+		now = time.monotonic() - self.started
+		if line[:1] == " " and self._err_source is not None:
+			# Err:3 http://... InRelease
+			#   Could not resolve 'example.org'
+			self._err_source["error"] = line.strip()
+			return True
+		self._err_source = None
+		parsed = parse_apt_update_line(line)
+		if parsed is None:
+			if line.startswith("Fetched "):
+				self.summary = line.strip()
+			return False
+
+		status, item, uri, target, size = parsed
+		suite = target.split()[0] if target else ""
+		if not suite.endswith("/"):
+			suite = suite.partition("/")[0]
+		key = "%s %s" % (uri, suite)
+		src = self.sources.get(key)
+		if src is None:
+			src = self.sources[key] = {"source": key, "Hit": set(), "Get": set(), "Ign": set(),
+									   "Err": set(), "sizes": {}, "first": now, "error": None}
+		# apt repeats an item (Get:4 ... then Ign:4) as it tries alternatives
+		src[status].add(item)
+		if size is not None:
+			src["sizes"][item] = size
+		src["last"] = now
+		if status == "Err":
+			self._err_source = src
+		return True
+
+	def rows(self) -> list:
+		"""[{source, hit, get, ign, err, bytes, seconds, error}] in first seen order"""
+		return [{"source": src["source"], "hit": len(src["Hit"]), "get": len(src["Get"]),
+				 "ign": len(src["Ign"]), "err": len(src["Err"]),
+				 "bytes": sum(src["sizes"].values()),
+				 "seconds": round(src["last"] - src["first"], 3), "error": src["error"]}
+				for src in self.sources.values()]
+
+	def save(self, returncode: int, path: str = None):
+		"""Append this run to the history file (JSON lines)"""
+		import json
+		path = path or update_history_path
+		record = json.dumps({"time": round(self.wall_started), "returncode": returncode,
+							 "seconds": round(time.monotonic() - self.started, 3),
+							 "summary": self.summary, "sources": self.rows()})
+		try:
+			with open(path, "r", encoding="utf-8") as f:
+				runs = f.read().splitlines()[-(UPDATE_HISTORY_RUNS - 1):]
+		except OSError:
+			runs = []
+		try:
+			os.makedirs(os.path.dirname(path), exist_ok=True)
+			atomic_write(path, ("\n".join(runs + [record]) + "\n").encode("utf-8"))
+		except OSError as e:
+			print("Cannot write the update history: %s" % e, file=sys.stderr)
+
+def apt_update_history(path: str = None) -> list:
+	"""Runs recorded by AptUpdateStats.save, oldest first"""
+	import json
+	runs = []
+	try:
+		with open(path or update_history_path, "r", encoding="utf-8") as f:
+			for line in f:
+				try:
+					runs.append(json.loads(line))
+				except ValueError:
+					continue
+	except OSError:
+		pass
+	return runs
+
+# apt-get update of a single sources file, keeping the other lists and the
+# package cache (it would only hold that source)
+apt_source_update_options = ("Dir::Etc::sourceparts=-", "APT::Get::List-Cleanup=0",
+							 "Dir::Cache::pkgcache=", "Dir::Cache::srcpkgcache=")
+
+def apt_source_update_argv(sources_file: str) -> list:
+	argv = ["apt-get", "update", *apt_dir_options, "-o", "Dir::Etc::sourcelist=" + sources_file]
+	for opt in apt_source_update_options:
+		argv += ["-o", opt]
+	return argv
+
+def apt_source_update_file(path: str) -> bool:
+	"""True for a sources file apt_update_source may hand to apt-get
+
+	Only files in sources.list.d, which only root can write to."""
+	parts_dir = os.path.realpath(os.path.join(apt_etc_dir, "sources.list.d"))
+	return os.path.isabs(path) and path.endswith(".sources") and os.path.isfile(path) and \
+		os.path.dirname(os.path.realpath(path)) == parts_dir
+
+def apt_update_source(source: AptSource):
+	"""Start apt-get update for source alone, returns (transaction, temp file)
+	or (None, error message)
+
+	The caller removes the temporary sources file once it is done. It is
+	a dot file of sources.list.d, which apt itself skips when listing it,
+	and only root can create it."""
+	import tempfile
+	try:
+		fd, sources_file = tempfile.mkstemp(prefix=".vapt-", suffix=".sources",
+											dir=os.path.join(apt_etc_dir, "sources.list.d"))
+	except OSError as e:
+		return None, str(e)
+	try:
+		with os.fdopen(fd, "w") as f:
+			f.write(source.deb822())
+		return apt_transaction(apt_source_update_argv(sources_file)), sources_file
+	except OSError as e:
+		os.unlink(sources_file)
+		return None, str(e)
+
+# == Backend daemon == #
+# Optional resident process (vapt.py --daemon), usually run as root
+daemon_socket_path = os.environ.get("VAPT_DAEMON_SOCKET") or "/run/vapt.sock"
+DAEMON_POLL_SECONDS = 2
+
+# apt-get arguments a transaction may carry, anything else is refused
+daemon_apt_actions = ("install", "remove", "update")
+daemon_apt_flags = {"-y", "--allow-downgrades", "--reinstall",
+					"--fix-missing", "--fix-broken", "--fix-policy"}
+_daemon_pkg_re = re.compile(r"^[a-z0-9][a-z0-9+.\-]*(:[a-z0-9\-]+)?(=[A-Za-z0-9.+~:\-]+)?$")
+_daemon_locale_re = re.compile(r"^[A-Za-z0-9_.@:\-]*$")
+
+def apt_list_diff(old: list, new: list) -> tuple:
+	"""(removed keys, updated rows) turning old rows into new ones
+
+	Rows are keyed by (name, arch), their first and last columns; updated
+	holds the new and the changed rows."""
+	old_rows = {(r[0], r[-1]): tuple(r) for r in old}
+	new_rows = {(r[0], r[-1]): tuple(r) for r in new}
+	removed = [key for key in old_rows if key not in new_rows]
+	updated = [row for key, row in new_rows.items() if old_rows.get(key) != row]
+	return removed, updated
+
+def daemon_check_transaction(argv: list):
+	"""Raise ValueError unless argv is an apt-get call the windows make"""
+	if len(argv) < 2 or argv[0] != "apt-get" or argv[1] not in daemon_apt_actions:
+		raise ValueError("Not an apt-get transaction: %s" % " ".join(argv))
+	args = iter(argv[2:])
+	for arg in args:
+		if arg in daemon_apt_flags or _daemon_pkg_re.match(arg):
+			continue
+		if arg == "-o" and argv[1] == "update":
+			# Only what apt_source_update_argv passes
+			opt = next(args, "")
+			name, _, value = opt.partition("=")
+			if opt in apt_source_update_options or opt in apt_dir_options or \
+					(name == "Dir::Etc::sourcelist" and apt_source_update_file(value)):
+				continue
+			raise ValueError("Option not allowed in a transaction: %s" % opt)
+		# Local packages, by absolute path
+		if os.path.isabs(arg) and arg.endswith(".deb") and os.path.isfile(arg):
+			continue
+		raise ValueError("Argument not allowed in a transaction: %s" % arg)
+
+def _peer_credentials(sock) -> tuple:
+	"""(pid, uid, gid) of the process at the other end of a Unix socket"""
+	import socket
+	import struct
+	creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+	return struct.unpack("3i", creds)
+
+class VaptDaemon:
+	"""Resident backend: warm package index, cached lists and transactions
+
+	Speaks the query helper protocol (one JSON object per line) over a Unix
+	socket, plus "upgradable"/"installed" rows, "subscribe" and
+	"transaction". Subscribers get the current rows of their lists, then a
+	(removed, updated) diff whenever apt changes the package databases;
+	a diff may arrive twice, applying it again changes nothing."""
+	LISTS = ("upgradable", "installed")
+
+	def __init__(self, path: str):
+		self.path = path
+		self.lock = threading.Lock()
+		# One dpkg run at a time, instead of racing on its lock, and
+		# one refresh and publish of its changes
+		self.transaction_lock = threading.Lock()
+		self.stamp = None
+		self.service = None
+		self.lists = {}
+		self.subscribers = []  # [(send, list names)]
+		self.refresh()
+
+	def refresh(self, fetched: set = None) -> dict:
+		"""Reload after apt changed, {list: (removed, updated)} of the changes
+
+		fetched is what apt-get update said it downloaded, if it just ran."""
+		stamp = apt_cache_stamp()
+		with self.lock:
+			if stamp == self.stamp:
+				return {}
+		if self.service is None:
+			service = AptQueryService()
+		else:
+			# Per list, queries wait meanwhile instead of seeing half of it
+			service = self.service
+			service.refresh(fetched)
+		backend = get_apt_backend()
+		lists = {"upgradable": backend.upgradable(), "installed": backend.installed()}
+		with self.lock:
+			diffs = {}
+			if self.stamp is not None:
+				for name, rows in lists.items():
+					removed, updated = apt_list_diff(self.lists.get(name, []), rows)
+					if removed or updated:
+						diffs[name] = (removed, updated)
+			self.service, self.lists, self.stamp = service, lists, stamp
+		return diffs
+
+	def publish(self, diffs: dict):
+		for name, (removed, updated) in diffs.items():
+			with self.lock:
+				targets = [send for send, lists in self.subscribers if name in lists]
+			for send in targets:
+				try:
+					send({"event": "diff", "list": name, "removed": removed, "updated": updated})
+				except OSError:
+					self.unsubscribe(send)
+
+	def watch(self):
+		"""Poll the apt stamp, outside transactions (they refresh when done)"""
+		while True:
+			time.sleep(DAEMON_POLL_SECONDS)
+			# Refresh and publish as one step, like a transaction does
+			if not self.transaction_lock.acquire(blocking=False):
+				continue
+			try:
+				self.publish(self.refresh())
+			except Exception as e:
+				print("vapt daemon: refresh failed: %s" % e, file=sys.stderr)
+			finally:
+				self.transaction_lock.release()
+
+	def subscribe(self, send, lists: list) -> dict:
+		lists = [name for name in lists if name in self.LISTS]
+		with self.lock:
+			self.subscribers.append((send, lists))
+			return {name: self.lists[name] for name in lists}
+
+	def unsubscribe(self, send):
+		with self.lock:
+			self.subscribers = [s for s in self.subscribers if s[0] is not send]
+
+	def transaction(self, argv: list, env: dict, on_line) -> dict:
+		daemon_check_transaction(argv)
+		env = {k: v for k, v in (env or {}).items()
+			   if k in APT_ENV_C and isinstance(v, str) and _daemon_locale_re.match(v)}
+		output = []
+		with self.transaction_lock:
+			cmd = Command(argv, env={**env, **APT_ENV_NONINTERACTIVE},
+						  stderr=subprocess.STDOUT, bufsize=1, cancellable=False)
+			try:
+				for line in cmd.lines():
+					if argv[1] == "update":
+						output.append(line)
+					on_line(line)
+			except OSError:
+				# The client went away, like closing an installer window
+				cmd.terminate()
+				cmd.wait()
+				raise
+			# Before the next transaction or watch() sees the databases
+			self.publish(self.refresh(apt_update_fetched(output)))
+		return {"returncode": cmd.returncode}
+
+	def handle(self, request: dict):
+		op = request.get("op")
+		with self.lock:
+			if op in self.LISTS:
+				return self.lists[op]
+			service = self.service
+		return service.handle(request)
+
+	def serve_connection(self, conn):
+		import json
+		_, uid, _ = _peer_credentials(conn)
+		rfile = conn.makefile("r", encoding="utf-8", errors="replace")
+		write_lock = threading.Lock()
+		def send(obj: dict):
+			with write_lock:
+				conn.sendall((json.dumps(obj) + "\n").encode("utf-8"))
+
+		try:
+			for line in rfile:
+				if not line.strip():
+					continue
+				req_id = None
+				try:
+					request = json.loads(line)
+					req_id = request.get("id")
+					op = request.get("op")
+					if op == "subscribe":
+						result = self.subscribe(send, request.get("lists", []))
+					elif op == "transaction":
+						# Group membership is no proof of a password just typed,
+						# clients authenticate first (pkexec) and connect as root
+						if uid != 0:
+							raise PermissionError("Transactions need root")
+						result = self.transaction(request.get("argv", []), request.get("env"),
+							lambda out: send({"id": req_id, "line": out}))
+					else:
+						result = self.handle(request)
+					response = {"id": req_id, "result": result}
+				except Exception as e:
+					response = {"id": req_id, "error": str(e)}
+				send(response)
+		except OSError:
+			pass
+		finally:
+			self.unsubscribe(send)
+			conn.close()
+
+	def serve(self):
+		import socket
+		if os.path.exists(self.path):
+			probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			try:
+				probe.connect(self.path)
+				raise OSError("another daemon is already listening")
+			except ConnectionRefusedError:
+				# Left behind by a daemon that was killed
+				os.unlink(self.path)
+			finally:
+				probe.close()
+
+		server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		server.bind(self.path)
+		# Anyone may query, only root may start transactions
+		os.chmod(self.path, 0o666)
+		server.listen(16)
+		print("vapt daemon listening on %s" % self.path, file=sys.stderr)
+		# Long-lived (subscriptions), so plain threads and not scheduler jobs
+		threading.Thread(target=self.watch, daemon=True).start()
+		try:
+			while True:
+				conn, _ = server.accept()
+				threading.Thread(target=self.serve_connection, args=(conn,), daemon=True).start()
+		finally:
+			server.close()
+			os.unlink(self.path)
+
+def daemon_main() -> int:
+	"""Serve VaptDaemon on daemon_socket_path until interrupted"""
+	user_config.load()
+	# The daemon is the warm process itself
+	apt_helper.disabled = True
+	apt_daemon.disabled = True
+	import signal
+	# Exit through serve() so the socket is removed
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+	try:
+		VaptDaemon(daemon_socket_path).serve()
+	except KeyboardInterrupt:
+		pass
+	except OSError as e:
+		print("vapt daemon: %s: %s" % (daemon_socket_path, e), file=sys.stderr)
+		return 1
+	return 0
+
+class AptDaemonError(Exception):
+	pass
+
+class AptDaemonTransaction:
+	"""apt-get run by the daemon, read like a Command
+
+	Closing the connection (terminate) makes the daemon kill apt-get."""
+	def __init__(self, sock):
+		self.sock = sock
+		self.rfile = sock.makefile("r", encoding="utf-8", errors="replace")
+		self.returncode = None
+
+	def lines(self):
+		import json
+		for raw in self.rfile:
+			try:
+				msg = json.loads(raw)
+				line = msg.get("line")
+				if line is None and "error" not in msg:
+					returncode = msg["result"]["returncode"]
+			except (ValueError, TypeError, KeyError, AttributeError) as e:
+				# Truncated or garbage output, apt-get may still be running
+				self.returncode = 1
+				self.sock.close()
+				raise AptDaemonError("Bad vapt daemon response: %s" % e)
+			if line is not None:
+				yield line
+				continue
+			if "error" in msg:
+				yield "E: %s\n" % msg["error"]
+				returncode = 1
+			self.returncode = returncode
+			break
+		if self.returncode is None:
+			# Connection lost before apt-get finished
+			self.returncode = 1
+		self.sock.close()
+
+	def wait(self) -> int:
+		if self.returncode is None:
+			for _ in self.lines():
+				pass
+		return self.returncode
+
+	def poll(self):
+		return self.returncode
+
+	def terminate(self):
+		import socket
+		try:
+			self.sock.shutdown(socket.SHUT_RDWR)
+		except OSError:
+			pass
+
+class AptDaemonClient:
+	"""Talks to a running vapt daemon, see VaptDaemon
+
+	Requests share one connection; every subscription and transaction
+	gets its own."""
+	def __init__(self, path: str):
+		self.path = path
+		self.sock = None
+		self.rfile = None
+		self.next_id = 0
+		self.lock = threading.Lock()
+		self.disabled = False
+		self.subscriptions = {}
+
+	def _connect(self):
+		import socket
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			sock.connect(self.path)
+		except OSError:
+			sock.close()
+			raise
+		return sock
+
+	def _close(self):
+		if self.sock is not None:
+			self.sock.close()
+			self.sock = None
+			self.rfile = None
+
+	def request(self, op: str, **params):
+		import json
+		with self.lock:
+			if self.disabled:
+				raise AptDaemonError("vapt daemon disabled")
+			try:
+				if self.sock is None:
+					self.sock = self._connect()
+					self.rfile = self.sock.makefile("r", encoding="utf-8", errors="replace")
+				self.next_id += 1
+				params.update({"id": self.next_id, "op": op})
+				self.sock.sendall((json.dumps(params) + "\n").encode("utf-8"))
+				line = self.rfile.readline()
+			except OSError as e:
+				self._close()
+				raise AptDaemonError(str(e))
+			if not line:
+				self._close()
+				raise AptDaemonError("vapt daemon closed the connection")
+			try:
+				response = json.loads(line)
+				if "error" not in response:
+					return response["result"]
+			except (ValueError, TypeError, KeyError) as e:
+				# Truncated or garbage output, the next reply would not match
+				self._close()
+				raise AptDaemonError("Bad vapt daemon response: %s" % e)
+			raise AptDaemonError(response["error"])
+
+	def subscribe(self, key, lists: list, callback):
+		"""Call callback(list, removed, updated) from a reader thread
+
+		First with removed None and the current rows in updated, then with
+		every diff. A new subscription with the same key replaces the old."""
+		import json
+		sock = self._connect()
+		with self.lock:
+			old = self.subscriptions.pop(key, None)
+			self.subscriptions[key] = sock
+		if old is not None:
+			self._end_subscription(old)
+		sock.sendall((json.dumps({"id": 0, "op": "subscribe", "lists": lists}) + "\n").encode("utf-8"))
+
+		def reader():
+			try:
+				for line in sock.makefile("r", encoding="utf-8", errors="replace"):
+					msg = json.loads(line)
+					if "result" in msg:
+						for name, rows in msg["result"].items():
+							callback(name, None, [tuple(r) for r in rows])
+					elif msg.get("event") == "diff":
+						callback(msg["list"], [tuple(k) for k in msg["removed"]],
+								 [tuple(r) for r in msg["updated"]])
+			except (OSError, ValueError):
+				pass
+		threading.Thread(target=reader, daemon=True).start()
+
+	def _end_subscription(self, sock):
+		import socket
+		# The reader's file keeps the socket open, close() alone would not stop it
+		try:
+			sock.shutdown(socket.SHUT_RDWR)
+		except OSError:
+			pass
+		sock.close()
+
+	def unsubscribe(self, key):
+		with self.lock:
+			sock = self.subscriptions.pop(key, None)
+		if sock is not None:
+			self._end_subscription(sock)
+
+	def transaction(self, argv: list, env: dict = None) -> AptDaemonTransaction:
+		import json
+		# The daemon runs elsewhere: local packages by absolute path
+		argv = [os.path.abspath(a) if a.endswith(".deb") and os.path.exists(a) else a
+				for a in argv]
+		try:
+			sock = self._connect()
+			sock.sendall((json.dumps({"id": 0, "op": "transaction", "argv": argv,
+									  "env": env or {}}) + "\n").encode("utf-8"))
+		except OSError as e:
+			raise AptDaemonError(str(e))
+		return AptDaemonTransaction(sock)
+
+apt_daemon = AptDaemonClient(daemon_socket_path)
+
+# == APT backends == #
+# Relation fields answered by AptBackend.depends, in apt-cache show order
+apt_relation_fields = ("Pre-Depends", "Depends", "Recommends", "Suggests", "Conflicts", "Breaks")
+
+class AptBackend:
+	"""Package queries the windows need, whatever answers them
+
+	Rows and tuples have the same shape as the apt list/policy parsers."""
+	name = None
+
+	def pkgnames(self, prefix: str) -> list:
+		raise NotImplementedError
+
+	def policy(self, pkgname: str) -> tuple:
+		"""(installed, candidate, archs)"""
+		raise NotImplementedError
+
+	def show(self, pkgname: str) -> str:
+		raise NotImplementedError
+
+	def search(self, search_term: str) -> list:
+		"""[(name, short description)]"""
+		raise NotImplementedError
+
+	def iter_search(self, search_term: str):
+		"""Same rows as search(), as soon as they are found"""
+		return iter(self.search(search_term))
+
+	def depends(self, pkgname: str) -> dict:
+		"""{field: apt_parse_relations(...)} of the candidate version"""
+		raise NotImplementedError
+
+	def upgradable(self) -> list:
+		"""[(name, candidate, installed, arch)]"""
+		raise NotImplementedError
+
+	def installed(self) -> list:
+		"""[(name, installed, arch)]"""
+		raise NotImplementedError
+
+	def iter_upgradable(self):
+		"""Same rows as upgradable(), as soon as they are known"""
+		return iter(self.upgradable())
+
+	def iter_installed(self):
+		"""Same rows as installed(), as soon as they are known"""
+		return iter(self.installed())
+
+class CliBackend(AptBackend):
+	"""apt/apt-cache output, through the query helper when possible"""
+	name = "cli"
+
+	def pkgnames(self, prefix: str) -> list:
+		return apt_pkgnames(prefix)
+
+	def policy(self, pkgname: str) -> tuple:
+		return apt_policy(pkgname)
+
+	def show(self, pkgname: str) -> str:
+		return apt_show(pkgname)
+
+	def search(self, search_term: str) -> list:
+		return apt_search(search_term)
+
+	def iter_search(self, search_term: str):
+		return apt_iter_search(search_term)
+
+	def depends(self, pkgname: str) -> dict:
+		_, candidate, _ = self.policy(pkgname)
+		for fields in iter_deb822(self.show(pkgname).splitlines(), {"Version", *apt_relation_fields}):
+			if fields.get("Version") == candidate:
+				return {field: apt_parse_relations(fields[field])
+						for field in apt_relation_fields if field in fields}
+		return {}
+
+	def upgradable(self) -> list:
+		proc = Command(["apt", *apt_dir_options, "list", "--upgradable"], env=APT_ENV_C)
+		out, _ = proc.communicate()
+		with proc.parsing():
+			return parse_apt_list_upgradable(out)
+
+	def installed(self) -> list:
+		proc = Command(["apt", *apt_dir_options, "list", "--installed"], env=APT_ENV_C)
+		out, _ = proc.communicate()
+		with proc.parsing():
+			return parse_apt_list_installed(out)
+
+	def iter_upgradable(self):
+		proc = Command(["apt", *apt_dir_options, "list", "--upgradable"], env=APT_ENV_C)
+		return iter_apt_list_upgradable(proc.lines())
+
+	def iter_installed(self):
+		proc = Command(["apt", *apt_dir_options, "list", "--installed"], env=APT_ENV_C)
+		return iter_apt_list_installed(proc.lines())
+
+class AptPkgBackend(AptBackend):
+	"""python3-apt in-process, no child process for any query
+
+	The cache is reopened whenever apt_cache_stamp() changes. Queries run
+	on scheduler workers: each one keeps the cache it started with, and
+	gets its own PackageRecords (lookup() moves a shared cursor)."""
+	name = "apt_pkg"
+
+	def __init__(self):
+		import apt_pkg
+		self.apt_pkg = apt_pkg
+		apt_pkg.init_config()
+		# Same Dir:: overrides the CLI backend passes with -o
+		for option in apt_dir_options[1::2]:
+			key, value = option.split("=", 1)
+			apt_pkg.config.set(key, value)
+		apt_pkg.init_system()
+		self.lock = threading.Lock()
+		self.stamp = None
+		self.cache = None
+
+	def _open(self):
+		"""(cache, depcache, {name: [Package]}), fresh if apt changed"""
+		with self.lock:
+			stamp = apt_cache_stamp()
+			if self.cache is None or stamp != self.stamp:
+				cache = self.apt_pkg.Cache(None)
+				by_name = {}
+				for pkg in cache.packages:
+					by_name.setdefault(pkg.name, []).append(pkg)
+				self.cache = (cache, self.apt_pkg.DepCache(cache), by_name)
+				self.stamp = stamp
+			return self.cache
+
+	def _package(self, by_name: dict, pkgname: str):
+		"""Same package as 'apt-cache policy <name>': the native (or only) one"""
+		pkgs = by_name.get(pkgname.strip().lower(), [])
+		return next((p for p in pkgs if p.architecture == apt_native_arch()),
+					pkgs[0] if pkgs else None)
+
+	def pkgnames(self, prefix: str) -> list:
+		by_name = self._open()[2]
+		prefix = prefix.lower()
+		return sorted(name for name, pkgs in by_name.items()
+					  if name.startswith(prefix) and any(p.version_list for p in pkgs))
+
+	def policy(self, pkgname: str) -> tuple:
+		_, depcache, by_name = self._open()
+		pkg = self._package(by_name, pkgname)
+		if pkg is None:
+			return None, None, []
+
+		archs = []
+		for ver in pkg.version_list:
+			for pkg_file, _ in ver.file_list:
+				# The dpkg status file is the "now" archive, not a Packages list
+				if pkg_file.archive != "now" and pkg_file.architecture \
+						and pkg_file.architecture not in archs:
+					archs.append(pkg_file.architecture)
+		cand = depcache.get_candidate_ver(pkg)
+		return (pkg.current_ver.ver_str if pkg.current_ver else "(none)",
+				cand.ver_str if cand else "(none)", archs)
+
+	def show(self, pkgname: str) -> str:
+		cache, _, by_name = self._open()
+		records = self.apt_pkg.PackageRecords(cache)
+		blocks = []
+		for pkg in by_name.get(pkgname.strip().lower(), []):
+			for ver in pkg.version_list:
+				if not ver.file_list:
+					continue
+				records.lookup(ver.file_list[0])
+				blocks.append(records.record.strip())
+		return "\n\n".join(b for b in blocks if b)
+
+	def search(self, search_term: str) -> list:
+		return list(self.iter_search(search_term))
+
+	def iter_search(self, search_term: str):
+		if any(apt_query_field(term) for term in search_term.split()):
+			# Field terms are answered from the bitmaps of the query helper
+			try:
+				rows = apt_search_pages(apt_helper.request, search_term.split())
+			except AptHelperError:
+				rows = None
+			if rows is not None:
+				yield from rows
+				return
+		cache, depcache, by_name = self._open()
+		records = self.apt_pkg.PackageRecords(cache)
+		patterns = []
+		for term in search_term.split():
+			try:
+				patterns.append(re.compile(term, re.I))
+			except re.error:
+				patterns.append(re.compile(re.escape(term), re.I))
+
+		for name in sorted(by_name):
+			for pkg in by_name[name]:
+				ver = depcache.get_candidate_ver(pkg) or pkg.current_ver
+				desc = ver.translated_description if ver is not None else None
+				if desc is None or not desc.file_list:
+					continue
+				records.lookup(desc.file_list[0])
+				if all(p.search(name + "\n" + records.long_desc) for p in patterns):
+					yield name, records.short_desc
+					break
+
+	def depends(self, pkgname: str) -> dict:
+		_, depcache, by_name = self._open()
+		pkg = self._package(by_name, pkgname)
+		cand = depcache.get_candidate_ver(pkg) if pkg is not None else None
+		if cand is None:
+			return {}
+
+		res = {}
+		for field in apt_relation_fields:
+			alts_list = []
+			for or_group in cand.depends_list.get(field, []):
+				alts = []
+				for dep in or_group:
+					target = dep.target_pkg
+					arch = target.architecture if target.architecture != cand.arch else None
+					alts.append((target.name, arch, dep.comp_type_deb or None,
+								 dep.target_ver or None))
+				alts_list.append(alts)
+			if alts_list:
+				res[field] = alts_list
+		return res
+
+	def upgradable(self) -> list:
+		_, depcache, by_name = self._open()
+		rows = []
+		for name in sorted(by_name):
+			for pkg in by_name[name]:
+				cur = pkg.current_ver
+				cand = depcache.get_candidate_ver(pkg) if cur is not None else None
+				if cand is not None and self.apt_pkg.version_compare(cand.ver_str, cur.ver_str) > 0:
+					rows.append((name, cand.ver_str, cur.ver_str, cand.arch))
+		return rows
+
+	def installed(self) -> list:
+		by_name = self._open()[2]
+		return [(name, pkg.current_ver.ver_str, pkg.current_ver.arch)
+				for name in sorted(by_name) for pkg in by_name[name]
+				if pkg.current_ver is not None]
+
+class DaemonBackend(CliBackend):
+	"""Queries answered by a running vapt daemon, apt-cache if it goes away"""
+	name = "daemon"
+
+	def __init__(self):
+		# Not running (or this is the daemon): get_apt_backend picks another
+		apt_daemon.request("ping")
+
+	def pkgnames(self, prefix: str) -> list:
+		try:
+			return apt_daemon.request("pkgnames", prefix=prefix)
+		except AptDaemonError:
+			return super().pkgnames(prefix)
+
+	def policy(self, pkgname: str) -> tuple:
+		try:
+			res = apt_daemon.request("policy", names=[pkgname])[pkgname]
+			if res["exact"]:
+				return res["installed"], res["candidate"], res["archs"]
+		except AptDaemonError:
+			pass
+		return super().policy(pkgname)
+
+	def show(self, pkgname: str) -> str:
+		try:
+			return apt_daemon.request("show", name=pkgname)
+		except AptDaemonError:
+			return super().show(pkgname)
+
+	def search(self, search_term: str) -> list:
+		try:
+			return [tuple(r) for r in apt_daemon.request("search", terms=search_term.split())]
+		except AptDaemonError:
+			return super().search(search_term)
+
+	def iter_search(self, search_term: str):
+		try:
+			return apt_search_pages(apt_daemon.request, search_term.split())
+		except AptDaemonError:
+			return super().iter_search(search_term)
+
+	def upgradable(self) -> list:
+		try:
+			return [tuple(r) for r in apt_daemon.request("upgradable")]
+		except AptDaemonError:
+			return super().upgradable()
+
+	def installed(self) -> list:
+		try:
+			return [tuple(r) for r in apt_daemon.request("installed")]
+		except AptDaemonError:
+			return super().installed()
+
+	def iter_upgradable(self):
+		return iter(self.upgradable())
+
+	def iter_installed(self):
+		return iter(self.installed())
+
+apt_backends = {"daemon": DaemonBackend, "apt_pkg": AptPkgBackend, "cli": CliBackend}
+apt_backend = None
+apt_backend_lock = threading.Lock()
+
+def get_apt_backend() -> AptBackend:
+	"""Backend set in apt_query/backend, "auto" prefers python3-apt"""
+	global apt_backend
+	with apt_backend_lock:
+		if apt_backend is None:
+			choice = user_config.get("apt_query/backend")
+			if session_recorder is not None or session_replay is not None:
+				# Sessions only hold child processes
+				choice = "cli"
+			names = [choice, "cli"] if choice in apt_backends else list(apt_backends)
+			for name in names:
+				try:
+					apt_backend = apt_backends[name]()
+					break
+				except (ImportError, SystemError, AptDaemonError) as e:
+					# python3-apt missing, unable to read the apt configuration
+					# or no daemon running
+					if name == choice:
+						print("APT backend %s unavailable: %s" % (name, e), file=sys.stderr)
+		return apt_backend
+
+def reset_apt_backend():
+	"""Pick the backend again on the next query, e.g. after a settings change"""
+	global apt_backend
+	with apt_backend_lock:
+		apt_backend = None
+
+def apt_transaction(argv: list):
+	"""Start an apt-get transaction, in the daemon when it is the backend
+
+	Either way the result reads like a Command: lines(), wait(), poll()
+	and terminate()."""
+	# The daemon only takes them from root
+	if isinstance(get_apt_backend(), DaemonBackend) and os.geteuid() == 0:
+		try:
+			return apt_daemon.transaction(argv, APT_ENV_USER)
+		except AptDaemonError as e:
+			print("vapt daemon unavailable, running apt-get here: %s" % e, file=sys.stderr)
+	return Command(argv, env={**APT_ENV_USER, **APT_ENV_NONINTERACTIVE},
+				   stderr=subprocess.STDOUT, bufsize=1)
+
+def apt_lookup_packages(prefix: str, grep_terms: list = None) -> list:
+	"""Package names for the autocompletion: prefix, then every extra term
+	anywhere in the name (case insensitive)"""
+	terms = [t.lower() for t in grep_terms or [] if t]
+	return [name for name in get_apt_backend().pkgnames(prefix.lower())
+			if all(t in name.lower() for t in terms)]
+
+# == Headless CLI == #
+# Subcommands answered before GI is imported, no display needed
+cli_commands = ("list-upgradable", "list-installed", "search", "show", "update-history")
+
+def cli_parse_args(argv: list):
+	import argparse
+	parser = argparse.ArgumentParser(prog="vapt",
+		description="Visual APT Manager, package queries without a display")
+	commands = parser.add_subparsers(dest="command", required=True)
+
+	def add_command(name: str, help: str):
+		cmd = commands.add_parser(name, help=help)
+		output = cmd.add_mutually_exclusive_group()
+		output.add_argument("--json", action="store_true",
+			help="print a JSON array")
+		output.add_argument("--ndjson", action="store_true",
+			help="print one JSON object per line, as soon as it is parsed")
+		return cmd
+
+	add_command("list-upgradable", "packages with a newer candidate (the Upgrade tab)")
+	add_command("list-installed", "installed packages (the Remove tab)")
+	add_command("search", "packages matching every term in their name or "
+		"description, or field:value terms (section, maintainer, arch, origin, "
+		"suite, priority, installed, size, tag)").add_argument("terms", nargs="+")
+	add_command("show", "package records, NAME=VERSION for a single "
+		"version").add_argument("packages", nargs="+")
+	add_command("update-history", "per source totals of the recorded "
+		"apt-get update runs").add_argument("--runs", type=int, default=UPDATE_HISTORY_RUNS,
+		help="only the last RUNS runs")
+	return parser.parse_args(argv)
+
+def cli_write(items, args, text_line):
+	"""Print dict items as text_line(item) lines, a JSON array or NDJSON"""
+	import json
+	out = sys.stdout
+	if args.ndjson:
+		for item in items:
+			out.write(json.dumps(item) + "\n")
+	elif args.json:
+		json.dump(list(items), out, indent=1)
+		out.write("\n")
+	else:
+		for item in items:
+			out.write(text_line(item) + "\n")
+
+def cli_show(args) -> int:
+	backend = get_apt_backend()
+	status = 0
+	blocks = []
+	for arg in args.packages:
+		pkgname, _, pkgver = arg.partition("=")
+		raw_text, _ = parse_package_info(backend.show(pkgname), pkgver)
+		if not raw_text:
+			print("vapt: package not found: %s" % arg, file=sys.stderr)
+			status = 1
+			continue
+		blocks.append(raw_text)
+
+	if args.json or args.ndjson:
+		# One object per version record, same values as apt-cache show
+		cli_write((stanza for block in blocks for stanza in iter_deb822(block.splitlines())),
+				  args, None)
+	else:
+		sys.stdout.write("\n\n".join(blocks) + "\n" if blocks else "")
+	return status
+
+def cli_update_history(args):
+	"""Per source: runs, failed runs, mean and worst seconds, last error"""
+	totals = {}
+	for run in apt_update_history()[-args.runs:] if args.runs > 0 else []:
+		for row in run.get("sources", []):
+			t = totals.setdefault(row["source"], {"source": row["source"], "runs": 0, "failed": 0,
+												  "seconds": 0.0, "worst": 0.0, "bytes": 0,
+												  "error": None})
+			t["runs"] += 1
+			t["seconds"] += row["seconds"]
+			t["worst"] = max(t["worst"], row["seconds"])
+			t["bytes"] += row["bytes"]
+			if row["err"]:
+				t["failed"] += 1
+				t["error"] = row["error"]
+	rows = sorted(totals.values(), key=lambda t: t["seconds"] / t["runs"], reverse=True)
+	for t in rows:
+		t["mean"] = round(t.pop("seconds") / t["runs"], 3)
+	cli_write(rows, args, lambda t: "%(source)s\t%(runs)d runs\t%(failed)d failed\t"
+			  "%(mean).1f s mean\t%(worst).1f s worst" % t + ("\t" + t["error"] if t["error"] else ""))
+
+def cli_main(argv: list) -> int:
+	args = cli_parse_args(argv)
+	user_config.load()
+	# One query per run, indexing everything in the helper would not pay
+	# off, unless field terms need its bitmaps
+	apt_helper.disabled = not (args.command == "search" and
+							   any(apt_query_field(term) for term in args.terms))
+	backend = get_apt_backend()
+
+	try:
+		if args.command == "list-upgradable":
+			cli_write(({"package": pkg, "version": ver_cad, "installed": ver_ins, "arch": arch}
+					   for pkg, ver_cad, ver_ins, arch in backend.iter_upgradable()), args,
+					  lambda r: "%(package)s\t%(version)s\t%(installed)s\t%(arch)s" % r)
+		elif args.command == "list-installed":
+			cli_write(({"package": pkg, "version": ver_ins, "arch": arch}
+					   for pkg, ver_ins, arch in backend.iter_installed()), args,
+					  lambda r: "%(package)s\t%(version)s\t%(arch)s" % r)
+		elif args.command == "search":
+			try:
+				parse_apt_query(args.terms)
+			except ValueError as e:
+				print("vapt: %s" % e, file=sys.stderr)
+				return 2
+			cli_write(({"package": pkg, "description": description}
+					   for pkg, description in backend.iter_search(" ".join(args.terms))), args,
+					  lambda r: "%(package)s - %(description)s" % r)
+		elif args.command == "show":
+			return cli_show(args)
+		elif args.command == "update-history":
+			cli_update_history(args)
+		sys.stdout.flush()
+	except BrokenPipeError:
+		# Reader went away (e.g. piped into head), skip the flush at exit
+		os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+		return 1
+	return 0
+
+if __name__ == "__main__":
+	# Before the GI imports below, neither of these needs a display
+	if sys.argv[1:2] == ["--apt-helper"]:
+		sys.exit(apt_helper_main())
+	if sys.argv[1:2] == ["--daemon"]:
+		sys.exit(daemon_main())
+	if sys.argv[1:2] and sys.argv[1] in cli_commands:
+		sys.exit(cli_main(sys.argv[1:]))
+
+# fmt: off
+# Everything below needs a display
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import GLib, Gtk, Gdk, Gio, GdkPixbuf, Pango
+# fmt: on
+startup_profile.mark("gi_imports")
+
+# == UI dispatch == #
+UI_FRAME_MS = 16
+
+class UIDispatcher:
+	"""Hands updates from worker threads to the main loop, once per frame
+
+	post(fn, *args) runs fn(*args) in order. post_latest(key, ...) keeps
+	only the last update per key in a frame (label text, progress).
+	post_batch(key, fn, item) calls fn(items) once with every item queued
+	under key; with a limit, the rest waits for the next frame."""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.pending = []  # ("call", fn, args), ("latest", key) or ("batch", key)
+		self.latest = {}   # key -> (fn, args)
+		self.batches = {}  # key -> (fn, [items], limit)
+		self.source_id = None
+		self.frames = 0
+		self.events = 0
+		self.events_total = 0
+		self.events_max = 0
+		self.handler_max = (0.0, None)
+
+	def _schedule(self):
+		"""Called with lock held"""
+		self.events += 1
+		if self.source_id is None:
+			self.source_id = GLib.timeout_add(UI_FRAME_MS, self._drain)
+
+	def post(self, fn, *args):
+		with self.lock:
+			self.pending.append(("call", fn, args))
+			self._schedule()
+
+	def post_latest(self, key, fn, *args):
+		with self.lock:
+			if key not in self.latest:
+				self.pending.append(("latest", key))
+			self.latest[key] = (fn, args)
+			self._schedule()
+
+	def post_batch(self, key, fn, item, limit: int = None):
+		with self.lock:
+			batch = self.batches.get(key)
+			if batch is None:
+				self.pending.append(("batch", key))
+				batch = self.batches[key] = (fn, [], limit)
+			batch[1].append(item)
+			self._schedule()
+
+	def _drain(self):
+		with self.lock:
+			pending, self.pending = self.pending, []
+			latest, self.latest = self.latest, {}
+			batches, self.batches = self.batches, {}
+			events, self.events = self.events, 0
+			self.source_id = None
+
+		self.frames += 1
+		self.events_total += events
+		self.events_max = max(self.events_max, events)
+		for entry in pending:
+			if entry[0] == "call":
+				fn, args = entry[1], entry[2]
+			elif entry[0] == "latest":
+				fn, args = latest[entry[1]]
+			else:
+				fn, items, limit = batches[entry[1]]
+				if limit is not None and len(items) > limit:
+					# Leftovers go first in the next frame
+					with self.lock:
+						rest = self.batches.get(entry[1])
+						self.batches[entry[1]] = (fn, items[limit:] + (rest[1] if rest else []), limit)
+						if rest is None:
+							self.pending.insert(0, ("batch", entry[1]))
+						if self.source_id is None:
+							self.source_id = GLib.timeout_add(UI_FRAME_MS, self._drain)
+					items = items[:limit]
+				args = (items,)
+
+			name = getattr(fn, "__qualname__", repr(fn))
+			# Attribute the frame to each update when tracing the main loop
+			span = main_loop_tracer.span(name, "dispatch") if main_loop_tracer \
+				else contextlib.nullcontext()
+			t_start = time.perf_counter()
+			try:
+				with span:
+					fn(*args)
+			except Exception:
+				import traceback
+				traceback.print_exc()
+			elapsed = time.perf_counter() - t_start
+			if elapsed > self.handler_max[0]:
+				self.handler_max = (elapsed, name)
+		return False
+
+	def stats(self) -> dict:
+		return {"frames": self.frames, "events": self.events_total,
+				"events_per_frame": self.events_total / max(self.frames, 1),
+				"events_max": self.events_max,
+				"handler_max_ms": self.handler_max[0] * 1000,
+				"handler_max": self.handler_max[1]}
+
+ui_dispatch = UIDispatcher()
+
+def print_ui_dispatch_stats(file=sys.stderr):
+	s = ui_dispatch.stats()
+	print("ui dispatch: %d events in %d frames (%.1f per frame, max %d), "
+		  "longest handler %.1f ms (%s)" % (s["events"], s["frames"], s["events_per_frame"],
+		  s["events_max"], s["handler_max_ms"], s["handler_max"]), file=file)
+
+# == Main loop tracing == #
+STALL_THRESHOLD_MS = 100
+TRACE_EVENTS_MAX = 200000
+
+class MainLoopTracer:
+	"""Times every signal, idle and timeout handler run by the main loop
+
+	Handlers over threshold_ms are logged with their name, and a watchdog
+	thread dumps the main thread stack while the loop is stuck. Spans and
+	stalls are written as Chrome trace events (chrome://tracing, Perfetto)."""
+	def __init__(self, trace_path: str, threshold_ms: float = STALL_THRESHOLD_MS):
+		self.trace_path = trace_path
+		self.threshold = threshold_ms / 1000
+		self.t0 = time.perf_counter()
+		self.pid = os.getpid()
+		self.main_ident = threading.get_ident()
+		self.events = []
+		self.lock = threading.Lock()
+		self.current = []  # names of the handlers running, innermost last
+		self.heartbeat = time.perf_counter()
+		self.stall_reported = False
+
+	def _us(self, t: float) -> float:
+		return (t - self.t0) * 1e6
+
+	def _add(self, event: dict):
+		with self.lock:
+			if len(self.events) < TRACE_EVENTS_MAX:
+				self.events.append(event)
+
+	@contextlib.contextmanager
+	def span(self, name: str, category: str):
+		self.current.append(name)
+		t_start = time.perf_counter()
+		try:
+			yield
+		finally:
+			elapsed = time.perf_counter() - t_start
+			self.current.pop()
+			self._add({"name": name, "cat": category, "ph": "X",
+					   "ts": self._us(t_start), "dur": elapsed * 1e6,
+					   "pid": self.pid, "tid": threading.get_ident()})
+			if elapsed > self.threshold and not self.current:
+				print("Main loop stalled %.1f ms in %s (%s)" % (
+					elapsed * 1000, name, category), file=sys.stderr)
+
+	def wrap(self, fn, name: str, category: str):
+		def traced(*args):
+			with self.span(name, category):
+				return fn(*args)
+		return traced
+
+	@staticmethod
+	def handler_name(fn) -> str:
+		return getattr(fn, "__qualname__", None) or repr(fn)
+
+	def install(self):
+		"""Patch GObject.connect and GLib idle/timeout registration"""
+		from gi.repository import GObject
+		tracer = self
+
+		connect = GObject.Object.connect
+		connect_after = GObject.Object.connect_after
+		def traced_connect(obj, signal, handler, *args):
+			name = "%s::%s %s" % (type(obj).__name__, signal, tracer.handler_name(handler))
+			return connect(obj, signal, tracer.wrap(handler, name, "signal"), *args)
+		def traced_connect_after(obj, signal, handler, *args):
+			name = "%s::%s %s" % (type(obj).__name__, signal, tracer.handler_name(handler))
+			return connect_after(obj, signal, tracer.wrap(handler, name, "signal"), *args)
+		GObject.Object.connect = traced_connect
+		GObject.Object.connect_after = traced_connect_after
+
+		timeout_add = GLib.timeout_add
+		for attr, category in (("idle_add", "idle"), ("timeout_add", "timeout"),
+							   ("timeout_add_seconds", "timeout")):
+			def make(register, category):
+				def traced_add(*args, **kwargs):
+					# (function, *data) or (interval|priority, function, *data)
+					i_fn = 0 if callable(args[0]) else 1
+					fn = args[i_fn]
+					args = args[:i_fn] + (tracer.wrap(fn, tracer.handler_name(fn), category),) + args[i_fn + 1:]
+					return register(*args, **kwargs)
+				return traced_add
+			setattr(GLib, attr, make(getattr(GLib, attr), category))
+
+		# Heartbeat on the loop (not traced), checked by the watchdog thread
+		def beat():
+			self.heartbeat = time.perf_counter()
+			self.stall_reported = False
+			return True
+		timeout_add(max(1, int(self.threshold * 1000 / 4)), beat)
+		threading.Thread(target=self._watchdog, daemon=True, name="vapt-stall-watchdog").start()
+		atexit.register(self.write)
+
+	def _watchdog(self):
+		import traceback
+		while True:
+			time.sleep(self.threshold / 2)
+			late = time.perf_counter() - self.heartbeat
+			if late <= self.threshold or self.stall_reported:
+				continue
+			self.stall_reported = True
+			frame = sys._current_frames().get(self.main_ident)
+			stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+			handler = self.current[-1] if self.current else "(main loop)"
+			print("Main loop blocked for %.0f ms in %s:\n%s" % (late * 1000, handler, stack),
+				  file=sys.stderr)
+			self._add({"name": "stall", "cat": "stall", "ph": "i", "s": "p",
+					   "ts": self._us(time.perf_counter()), "pid": self.pid,
+					   "tid": self.main_ident,
+					   "args": {"handler": handler, "stack": stack}})
+
+	def write(self):
+		import json
+		with self.lock:
+			events = list(self.events)
+		data = {"traceEvents": events, "displayTimeUnit": "ms"}
+		try:
+			with open(self.trace_path, "w", encoding="utf-8") as f:
+				json.dump(data, f)
+		except OSError as e:
+			print("Could not write trace %s: %s" % (self.trace_path, e), file=sys.stderr)
+
+main_loop_tracer = None
+
+# == Single instance == #
+# Abstract Unix socket (nothing left on disk), one instance per user
+instance_socket_name = "\0vapt-instance-%d" % os.geteuid()
+instance_server = None
+INSTANCE_TIMEOUT_SECONDS = 10
+
+def instance_forward(files: list) -> bool:
+	"""Hand files to the running instance, False if there is none"""
+	import json
+	import socket
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	# A frozen instance must not hang this one too
+	sock.settimeout(INSTANCE_TIMEOUT_SECONDS)
+	try:
+		sock.connect(instance_socket_name)
+		sock.sendall((json.dumps({"files": [os.path.abspath(f) for f in files]}) + "\n").encode("utf-8"))
+		# Answered once the files are queued, the instance may be busy
+		return bool(sock.makefile("r", encoding="utf-8").readline())
+	except OSError:
+		return False
+	finally:
+		sock.close()
+
+class InstanceServer:
+	"""Takes the files of later invocations, on_files(files) runs on the main loop
+
+	Raises OSError when another instance already listens."""
+	def __init__(self, on_files):
+		import socket
+		self.on_files = on_files
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			self.sock.bind(instance_socket_name)
+		except OSError:
+			self.sock.close()
+			raise
+		self.sock.listen(16)
+		GLib.io_add_watch(self.sock.fileno(), GLib.PRIORITY_DEFAULT, GLib.IOCondition.IN,
+						  self._on_accept)
+
+	def _on_accept(self, fd, condition) -> bool:
+		try:
+			conn, _ = self.sock.accept()
+		except OSError:
+			return True
+		# A client that stalls must not hold up the main loop
+		job_scheduler.submit(self._read_request, conn)
+		return True
+
+	def _read_request(self, conn):
+		"""Runs as a job, hands the files to the main loop"""
+		import json
+		try:
+			# Another user's vapt must not open windows here
+			_, uid, _ = _peer_credentials(conn)
+			if uid != os.geteuid():
+				return
+			conn.settimeout(1.0)
+			request = json.loads(conn.makefile("r", encoding="utf-8").readline() or "{}")
+			files = [f for f in request.get("files", []) if isinstance(f, str)]
+			conn.sendall(b'{"ok": true}\n')
+		except (OSError, ValueError, AttributeError):
+			return
+		finally:
+			conn.close()
+		if files:
+			ui_dispatch.post(self.on_files, files)
+
+# Quiet time after the last change before the lists are refreshed
+LIVE_REFRESH_DEBOUNCE_MS = 1500
+
+class AptStateMonitor:
+	"""Calls callback() on the main loop once dpkg and apt settle after a change
+
+	Watches the dpkg status file and journal, and the apt lists. Events
+	less than LIVE_REFRESH_DEBOUNCE_MS apart are coalesced, so a whole
+	apt run in a terminal ends up as a single callback."""
+	def __init__(self, callback):
+		self.callback = callback
+		self.timeout_id = None
+		self.monitors = []
+		for path, is_dir in ((dpkg_status_path, False), (dpkg_updates_dir, True),
+							 (apt_lists_dir, True)):
+			gfile = Gio.File.new_for_path(path)
+			try:
+				if is_dir:
+					monitor = gfile.monitor_directory(Gio.FileMonitorFlags.NONE, None)
+				else:
+					monitor = gfile.monitor_file(Gio.FileMonitorFlags.NONE, None)
+			except GLib.Error as e:
+				print("Cannot watch %s: %s" % (path, e.message), file=sys.stderr)
+				continue
+			monitor.connect("changed", self.on_changed)
+			self.monitors.append(monitor)
+
+	def on_changed(self, monitor, file, other_file, event_type):
+		if event_type == Gio.FileMonitorEvent.ATTRIBUTE_CHANGED:
+			return
+		# Restart the quiet period
+		if self.timeout_id is not None:
+			GLib.source_remove(self.timeout_id)
+		self.timeout_id = GLib.timeout_add(LIVE_REFRESH_DEBOUNCE_MS, self.on_settled)
+
+	def on_settled(self) -> bool:
+		self.timeout_id = None
+		self.callback()
+		return False
+
+	def cancel(self):
+		for monitor in self.monitors:
+			monitor.cancel()
+		self.monitors = []
+		if self.timeout_id is not None:
+			GLib.source_remove(self.timeout_id)
+			self.timeout_id = None
+
+def open_local_packages(files: list):
+	"""Add files as tabs of the open LocalPackageWindow, or open one"""
+	window = LocalPackageWindow.current
+	if window is None:
+		# The first window of this instance still decides when it ends
+		LocalPackageWindow(files, quit_on_close=False)
+	else:
+		window.add_files(files)
+		window.present()
 
 # == GTK Util == #
 
 
-def gtk_image_icon(path: str, size: int) -> Gtk.Image:
-	return Gtk.Image.new_from_pixbuf(GdkPixbuf.Pixbuf.new_from_file_at_scale(
+# Decoded assets shared by every window, keyed by (path, size[, rate])
+asset_cache = {}
+asset_cache_lock = threading.Lock()
+asset_cache_stats = {"hits": 0, "misses": 0, "decode_seconds": 0.0}
+
+def _asset_cached(key: tuple, loader):
+	with asset_cache_lock:
+		if key in asset_cache:
+			asset_cache_stats["hits"] += 1
+			return asset_cache[key]
+
+	t_start = time.monotonic()
+	asset = loader()
+	elapsed = time.monotonic() - t_start
+
+	with asset_cache_lock:
+		asset_cache_stats["misses"] += 1
+		asset_cache_stats["decode_seconds"] += elapsed
+		# Another thread may have won the race, keep the first one
+		return asset_cache.setdefault(key, asset)
+
+def load_pixbuf(path: str, size: int) -> GdkPixbuf.Pixbuf:
+	"""Shared pixbuf of a static asset, scaled to fit size x size"""
+	return _asset_cached((path, size), lambda: GdkPixbuf.Pixbuf.new_from_file_at_scale(
 		filename=path,
 		width=size, height=size,
 		preserve_aspect_ratio=True
 	))
 
-def gtk_gif_icon(path: str, size: int, rate: float) -> Gtk.Image:
+def gtk_image_icon(path: str, size: int) -> Gtk.Image:
+	return Gtk.Image.new_from_pixbuf(load_pixbuf(path, size))
+
+def _load_gif_native(path: str, size: int) -> GdkPixbuf.PixbufAnimation:
+	# The loader wraps the animation in a scaled animation when
+	# the requested size differs, so no frame is copied here
+	loader = GdkPixbuf.PixbufLoader()
+	loader.connect("size-prepared", lambda l, w, h: l.set_size(size, size))
+	with open(path, "rb") as f:
+		loader.write(f.read())
+	loader.close()
+	return loader.get_animation()
+
+def _load_gif_pil(path: str, size: int, rate: float) -> GdkPixbuf.PixbufAnimation:
+	from PIL import Image
+
 	# Open the animated GIF with Pillow
 	img_pil = Image.open(path)
 
@@ -110,53 +4434,73 @@ def gtk_gif_icon(path: str, size: int, rate: float) -> Gtk.Image:
 		# Pillow throws an EOFError when there are no more frames
 		pass
 
+	return simpleanim
+
+def load_animation(path: str, size: int, rate: float) -> GdkPixbuf.PixbufAnimation:
+	"""Shared animation of a GIF asset. Native loader first, Pillow only as
+	fallback, in which case frames are resampled at rate fps"""
+	def loader_():
+		try:
+			return _load_gif_native(path, size)
+		except GLib.Error:
+			return _load_gif_pil(path, size, rate)
+	return _asset_cached((path, size, rate), loader_)
+
+def gtk_gif_icon(path: str, size: int, rate: float) -> Gtk.Image:
 	# Apply to a Gtk.Image and return
 	img = Gtk.Image()
-	img.set_from_animation(simpleanim)
+	img.set_from_animation(load_animation(path, size, rate))
 	return img
 
-def apt_canonicalize_package(name: str, version: str, arch: str) -> str:
-	res = name.strip()
-	if arch:
-		res += ":" + arch.strip()
-	if version:
-		res += "=" + version.strip()
-	return res
-
-def format_filesize(size_bytes: int) -> str:
-	"""Convert a filesize in bytes to a human-readable string with binary units."""
-	if size_bytes < 0: return "--"
-
-	# Define binary units
-	units = ["B", "KB", "MB", "GB", "TB", "PB"]
-	size = float(size_bytes)
-
-	for unit in units:
-		if size < 1024 or unit == units[-1]:
-			# Format to 2 decimal places for sizes >= KiB
-			if unit == "B":
-				return "%d %s" % (size, unit)
-			else:
-				return "%.2f %s" % (size, unit)
-		size /= 1024
-
-def mkdtemp():
-	return subprocess.Popen(
-		["mktemp", "-d"],
-		stdout=subprocess.PIPE,
-		stderr=subprocess.DEVNULL,
-		text=True
-	).communicate()[0].strip()
-
-def rmforce(dir):
-	subprocess.Popen(
-		["rm", "-Rf", dir],
-		stdout=subprocess.DEVNULL,
-		stderr=subprocess.DEVNULL,
-		text=True
-	)
+def file_tree_insert(tree_store: Gtk.TreeStore, path: str, size: int):
+	"""Insert path into the (name, size) tree, creating the missing folders"""
+	# If path contains " -> ", don't split after it
+	path_s = path
+	path_e = None
+	symidx = path.find(" -> ")
+	if symidx != -1:
+		symidx = path.rfind("/", 0, symidx) + 1
+		path_s = path[:symidx]
+		path_e = path[symidx:]
+	parts = path_s.strip("/").split("/")
+	if path_e is not None: parts.append(path_e)
+
+	parent = None
+	for part in parts:
+		# Check if this node already exists under parent
+		exists = False
+		iter_ = tree_store.get_iter_first() if parent is None else tree_store.iter_children(parent)
+		while iter_:
+			if tree_store[iter_][0] == part:
+				exists = True
+				parent = iter_
+				# Remove size from folders
+				tree_store[iter_][1] = ""
+				break
+			iter_ = tree_store.iter_next(iter_)
+		if not exists:
+			# Create new node
+			parent = tree_store.append(parent, [part, format_filesize(size)])
+
+def deb_load_icon(deb_file: str, path: str, size: int) -> GdkPixbuf.Pixbuf:
+	"""Decode an icon member of the package, None if it is not an image"""
+	loader = GdkPixbuf.PixbufLoader()
+	loader.connect("size-prepared", lambda l, w, h: l.set_size(
+		*((size, max(1, h * size // w)) if w >= h else (max(1, w * size // h), size))))
+	try:
+		loader.write(deb_extract_file(deb_file, path))
+		loader.close()
+	except GLib.Error:
+		return None
+	return loader.get_pixbuf()
 
 # == GTK windows == #
+# Search rows added to the view per frame, and per "show more"
+SEARCH_FRAME_ROWS = 200
+SEARCH_SHOW_ROWS = 1000
+# Search as you type: wait for a pause in typing, and a few characters
+SEARCH_DEBOUNCE_MS = 250
+SEARCH_LIVE_MIN_CHARS = 2
 
 class MainWindow(Gtk.Window):
 	def __init__(self):
@@ -166,6 +4510,14 @@ class MainWindow(Gtk.Window):
 		self.set_default_size(640, 480)
 		self.set_position(Gtk.WindowPosition.CENTER)
 
+		# Rows last shown in the Upgrade and Remove tabs, to diff the next ones
+		self.upgradable_rows = []
+		self.installed_rows = []
+		# Lists the daemon keeps up to date by itself
+		self.daemon_lists = set()
+		self.daemon_lock = threading.Lock()
+		self.destroyed = False
+
 		# Create header bar
 		header_bar = Gtk.HeaderBar()
 		header_bar.set_show_close_button(True)
@@ -177,10 +4529,7 @@ class MainWindow(Gtk.Window):
 			if not self.filter_input.get_text():
 				return True
 			filter_term = self.filter_input.get_text().strip().lower()
-			for i in search_cols:
-				if filter_term in model[iter][i].lower():
-					return True
-			return False
+			return filter_matches(model[iter], filter_term, search_cols)
 
 		# Add a warning label that appears when filter is active
 		filter_active_label = Gtk.Label(label=Localize("str_warning_filter_active"))
@@ -246,24 +4595,8 @@ class MainWindow(Gtk.Window):
 		btn_box.set_border_width(6)
 
 		# Get os pretty name
-		proc = subprocess.Popen(
-			["bash", "-c",
-			 "echo \"$(grep '^PRETTY_NAME=' /etc/os-release | cut -d= -f2 | tr -d '\"')\""],
-			stdout=subprocess.PIPE,
-			stderr=subprocess.DEVNULL,
-			text=True
-		)
-		os_name, _ = proc.communicate()
-		os_name = os_name.strip() or "Unknown OS"
-
-		proc = subprocess.Popen(
-			["dpkg", "--print-architecture"],
-			stdout=subprocess.PIPE,
-			stderr=subprocess.DEVNULL,
-			text=True
-		)
-		dpkg_arch, _ = proc.communicate()
-		dpkg_arch = dpkg_arch.strip() or "N/A"
+		os_name = os_pretty_name() or "Unknown OS"
+		dpkg_arch = apt_native_arch() or "N/A"
 
 		label = Gtk.Label(label=os_name)
 		label.set_tooltip_text(Localize("str_tooltip_osname"))
@@ -308,6 +4641,7 @@ class MainWindow(Gtk.Window):
 		self.apt_list_install_autocomplete = Gtk.ListStore(str)
 		entry = Gtk.Entry()
 		entry.set_placeholder_text(Localize("str_search_package"))
+		entry.set_tooltip_text(Localize("str_tooltip_search_query"))
 		completion = Gtk.EntryCompletion.new()
 		completion.set_model(self.apt_list_install_autocomplete)
 		completion.set_text_column(0)
@@ -315,6 +4649,8 @@ class MainWindow(Gtk.Window):
 		entry.set_completion(completion)
 
 		entry.connect("activate", self.on_search_entry_activate)
+		entry.connect("changed", self.on_search_entry_changed)
+		self.search_debounce_id = None
 		paned.pack_start(entry, False, False, 0)
 
 		# Bottom: List
@@ -343,6 +4679,24 @@ class MainWindow(Gtk.Window):
 		search_scroll.add(treeview)
 		paned.pack_start(search_scroll, True, True, 0)
 
+		# Result count, and more rows on demand past SEARCH_SHOW_ROWS
+		search_status_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+		self.search_label = Gtk.Label()
+		self.search_label.set_xalign(0)
+		search_status_box.pack_start(self.search_label, True, True, 0)
+		self.search_more_button = Gtk.Button(label=Localize("str_search_show_more"))
+		self.search_more_button.connect("clicked", self.on_search_show_more)
+		self.search_more_button.set_no_show_all(True)
+		search_status_box.pack_start(self.search_more_button, False, False, 0)
+		paned.pack_start(search_status_box, False, False, 0)
+		# Every row of the current query; only the first search_cap are in the view
+		self.search_gen = 0
+		self.search_rows = []
+		self.search_cap = SEARCH_SHOW_ROWS
+		self.search_done = True
+		# Search term -> (apt_cache_stamp(), rows) of recent queries
+		self.search_cache = LRUCache(SEARCH_CACHE_SIZE)
+
 		# Put paned into notebook tab
 		tab1_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
 		tab1_box.pack_start(paned, True, True, 0)
@@ -394,25 +4748,30 @@ class MainWindow(Gtk.Window):
 		# Add debounce time
 		self._install_entry_timeout_id = None
 
-		def _apt_lookup(text):
-			terms = text.strip().split(" ")
-			prefix = terms[0]
-			grep_terms = terms[1:]
-
+		def _apt_lookup_done(candidates):
 			self.apt_list_install_autocomplete.clear()
-			if len(text) >= 1:
-				for cand in self.lookup_apt_packages(prefix, grep_terms):
-					cand = cand.lower().strip()
-					self.apt_list_install_autocomplete.append([cand])
+			for cand in candidates:
+				self.apt_list_install_autocomplete.append([cand.lower().strip()])
 			# Force completion popup refresh
 			completion.complete()
 			return False
 
+		def _apt_lookup_worker(text):
+			terms = text.strip().split(" ")
+			candidates = self.lookup_apt_packages(terms[0], terms[1:])
+			check_cancelled()
+			ui_dispatch.post_latest("autocompletion", _apt_lookup_done, candidates)
+
+		def _apt_lookup(text):
+			# Replaces the lookup of what was typed before, if still running
+			job_scheduler.submit(_apt_lookup_worker, text, source="autocompletion")
+			return False
+
 		# Whenever the user types, refill store dynamically
 		def on_install_entry_changed(editable):
 			global user_config
 
-			if not user_config["editor"]["installs_autocompletion"]:
+			if not user_config.get("editor/installs_autocompletion"):
 				return
 
 			# Cancel previous scheduled call if it exists
@@ -422,6 +4781,7 @@ class MainWindow(Gtk.Window):
 
 			text = editable.get_text().lower().strip()
 			if not text:
+				job_scheduler.cancel_source("autocompletion")
 				self.apt_list_install_autocomplete.clear()
 				completion.complete()
 				return
@@ -569,7 +4929,45 @@ class MainWindow(Gtk.Window):
 			label=Localize("str_remove")))
 
 		# -----------------------
-		# Tab 4: Settings
+		# Tab 4: Sources
+		# -----------------------
+		sources_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
+
+		# Rows hold the index of their AptSource in self.apt_sources
+		self.apt_sources = []
+		self.list_sources = Gtk.ListStore(int, str, str, str, str, str)
+
+		self.sources_view = Gtk.TreeView(model=self.list_sources)
+		for i, title in enumerate(("str_source_uri", "str_source_suite", "str_source_components",
+								   "str_source_last_refresh", "str_form_file"), 1):
+			column = Gtk.TreeViewColumn(Localize(title), Gtk.CellRendererText(), text=i)
+			column.set_sort_column_id(i)
+			self.sources_view.append_column(column)
+
+		sources_scroll = Gtk.ScrolledWindow()
+		sources_scroll.set_policy(Gtk.PolicyType.AUTOMATIC,
+								  Gtk.PolicyType.AUTOMATIC)
+		sources_scroll.add(self.sources_view)
+		sources_box.pack_start(sources_scroll, True, True, 0)
+
+		sources_btn_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+		sources_btn_box.set_border_width(6)
+		self.sources_label = Gtk.Label()
+		self.sources_label.set_xalign(0)
+		self.sources_label.set_ellipsize(Pango.EllipsizeMode.END)
+		sources_btn_box.pack_start(self.sources_label, True, True, 0)
+		self.sources_refresh_button = Gtk.Button(label=Localize("str_source_refresh"))
+		self.sources_refresh_button.set_tooltip_text(Localize("str_tooltip_source_refresh"))
+		self.sources_refresh_button.connect("clicked", self.on_refresh_source)
+		sources_btn_box.pack_start(self.sources_refresh_button, False, False, 0)
+		sources_box.pack_start(sources_btn_box, False, False, 0)
+
+		self.notebook.append_page(sources_box, Gtk.Label(
+			label=Localize("str_sources")))
+		self.get_apt_sources()
+
+		# -----------------------
+		# Tab 5: Settings
 		# -----------------------
 		settings_box = Gtk.VBox()
 		settings_box.set_border_width(16)
@@ -594,9 +4992,9 @@ class MainWindow(Gtk.Window):
 		langs_combo.add_attribute(render_text, "text", 0)
 
 		active_lang_idx = 0
-		if user_config["editor"]["l10n_file"] != "":
+		if user_config.get("editor/l10n_file") != "":
 			for i, l in enumerate(langs_available):
-				if l["file"] == user_config["editor"]["l10n_file"]:
+				if l["file"] == user_config.get("editor/l10n_file"):
 					active_lang_idx = i
 		langs_combo.set_active(active_lang_idx)
 		langs_combo.connect("changed", self.on_lang_changed)
@@ -607,19 +5005,41 @@ class MainWindow(Gtk.Window):
 		lang_box.pack_start(langs_combo, False, False, 0)
 		settings_box.pack_start(lang_box, False, False, 0)
 
+		# Backend combobox
+		backend_label = Gtk.Label(
+			label="  " + Localize("str_settings_label_backend"))
+		backend_label.set_xalign(0)
+		backend_combo = Gtk.ComboBoxText()
+		for backend in ("auto", "daemon", "apt_pkg", "cli"):
+			backend_combo.append(backend, Localize("str_settings_backend_" + backend))
+		backend_combo.set_active_id(user_config.get("apt_query/backend"))
+		backend_combo.connect("changed", self.on_backend_changed)
+
+		backend_box = Gtk.HBox(spacing=6)
+		backend_box.pack_start(backend_label, False, False, 0)
+		backend_box.pack_start(backend_combo, False, False, 0)
+		settings_box.pack_start(backend_box, False, False, 0)
+
 		button = Gtk.CheckButton(label=Localize(
 			"str_setting_package_list_autocompletion"))
 		button.set_tooltip_text(Localize("str_tooltip_editor_autocompletion"))
-		button.set_active(user_config["editor"]["installs_autocompletion"])
+		button.set_active(user_config.get("editor/installs_autocompletion"))
 		button.data_path = "editor/installs_autocompletion"
 		button.connect("toggled", self.on_settings_toggle)
 		settings_box.pack_start(button, False, False, 0)
 
+		button = Gtk.CheckButton(label=Localize(
+			"str_setting_search_as_you_type"))
+		button.set_tooltip_text(Localize("str_tooltip_editor_search_as_you_type"))
+		button.set_active(user_config.get("editor/search_as_you_type"))
+		button.data_path = "editor/search_as_you_type"
+		button.connect("toggled", self.on_settings_toggle)
+		settings_box.pack_start(button, False, False, 0)
+
 		button = Gtk.CheckButton(label=Localize(
 			"str_setting_select_upgrades_on_startup"))
 		button.set_tooltip_text(Localize("str_tooltip_editor_upgrades_selected"))
-		button.set_active(user_config["editor"]
-						  ["upgrades_selected_by_default"])
+		button.set_active(user_config.get("editor/upgrades_selected_by_default"))
 		button.data_path = "editor/upgrades_selected_by_default"
 		button.connect("toggled", self.on_settings_toggle)
 		settings_box.pack_start(button, False, False, 0)
@@ -631,21 +5051,21 @@ class MainWindow(Gtk.Window):
 
 		button = Gtk.CheckButton(label="Fix missing")
 		button.set_tooltip_text(Localize("str_tooltip_apt_fix_missing"))
-		button.set_active(user_config["apt_install"]["fix_missing"])
+		button.set_active(user_config.get("apt_install/fix_missing"))
 		button.data_path = "apt_install/fix_missing"
 		button.connect("toggled", self.on_settings_toggle)
 		settings_box.pack_start(button, False, False, 0)
 
 		button = Gtk.CheckButton(label="Fix broken")
 		button.set_tooltip_text(Localize("str_tooltip_apt_fix_broken"))
-		button.set_active(user_config["apt_install"]["fix_broken"])
+		button.set_active(user_config.get("apt_install/fix_broken"))
 		button.data_path = "apt_install/fix_broken"
 		button.connect("toggled", self.on_settings_toggle)
 		settings_box.pack_start(button, False, False, 0)
 
 		button = Gtk.CheckButton(label="Fix policy")
 		button.set_tooltip_text(Localize("str_tooltip_apt_fix_policy"))
-		button.set_active(user_config["apt_install"]["fix_policy"])
+		button.set_active(user_config.get("apt_install/fix_policy"))
 		button.data_path = "apt_install/fix_policy"
 		button.connect("toggled", self.on_settings_toggle)
 		settings_box.pack_start(button, False, False, 0)
@@ -654,6 +5074,11 @@ class MainWindow(Gtk.Window):
 			label=Localize("str_settings")))
 		self.notebook.set_current_page(2)
 
+		# Follow apt and dpkg runs made outside of this window
+		self.apt_monitor = AptStateMonitor(self.on_apt_state_changed)
+		self.connect("destroy", lambda _: self.apt_monitor.cancel())
+		self.connect("destroy", self.unsubscribe_lists)
+
 		self.sigid_destroy = self.connect("destroy", Gtk.main_quit)
 		self.show_all()
 
@@ -661,16 +5086,13 @@ class MainWindow(Gtk.Window):
 		global user_config_path
 		global user_config
 
-		# Toggle config path
-		paths = widget.data_path.split("/")
-		conf = user_config
-		for p in paths[:-1]:
-			conf = conf[p]
-		conf[paths[-1]] = widget.get_active()
+		# Toggle config path, saved shortly after
+		user_config.set(widget.data_path, widget.get_active())
 
-		# Save config
-		with open(user_config_path, 'w') as file:
-			yaml.dump(user_config, file)
+	def on_backend_changed(self, widget):
+		user_config.set("apt_query/backend", widget.get_active_id())
+		# Takes effect on the next query
+		reset_apt_backend()
 
 	def on_lang_changed(self, widget):
 		global user_config_path
@@ -682,9 +5104,7 @@ class MainWindow(Gtk.Window):
 			file = model[tree_iter][1]
 
 			# Save config
-			user_config["editor"]["l10n_file"] = file.strip()
-			with open(user_config_path, 'w') as file:
-				yaml.dump(user_config, file)
+			user_config.set("editor/l10n_file", file.strip())
 
 			# Display warning
 			dialog = Gtk.MessageDialog(
@@ -701,6 +5121,7 @@ class MainWindow(Gtk.Window):
 				return
 
 			# Restart program
+			user_config.flush()
 			os.execv(sys.executable, [sys.executable] + sys.argv)
 
 	def _get_original_iter(self, model, path):
@@ -819,35 +5240,7 @@ class MainWindow(Gtk.Window):
 		PackageInfoWindow(pkgname, pkgver)
 
 	def lookup_apt_packages(self, prefix: str, grep_terms: list = None):
-		prefix = prefix.lower()
-
-		aptcache_proc = subprocess.Popen(
-			[*APT_LANG, "apt-cache", "pkgnames", prefix],
-			stdout=subprocess.PIPE,
-			stderr=subprocess.DEVNULL,
-			text=True
-		)
-
-		if grep_terms:
-			stdout_ = aptcache_proc.stdout
-			for term in grep_terms:
-				grep_proc = subprocess.Popen(
-					["grep", "-i", term],
-					stdin=stdout_,
-					stdout=subprocess.PIPE,
-					stderr=subprocess.DEVNULL,
-					text=True
-				)
-				stdout_ = grep_proc.stdout
-			out, _ = grep_proc.communicate()
-		else:
-			out, _ = aptcache_proc.communicate()
-
-		lines = out.splitlines()
-		if not lines:
-			return []
-
-		return [line.strip() for line in lines]
+		return apt_lookup_packages(prefix, grep_terms)
 
 	def on_install_entry_activate(self, widget):
 		pkgname = widget.get_text().strip()
@@ -872,7 +5265,31 @@ class MainWindow(Gtk.Window):
 									 lambda: widget.get_style_context().remove_class("error"))
 
 	def on_search_entry_activate(self, widget):
+		if self.search_debounce_id is not None:
+			GLib.source_remove(self.search_debounce_id)
+			self.search_debounce_id = None
+		self.search_start(widget, True)
+
+	def on_search_entry_changed(self, widget):
+		if not user_config.get("editor/search_as_you_type"):
+			return
+		if self.search_debounce_id is not None:
+			GLib.source_remove(self.search_debounce_id)
+			self.search_debounce_id = None
+		if len(widget.get_text().strip()) < SEARCH_LIVE_MIN_CHARS:
+			return
+
+		def _debounced():
+			self.search_debounce_id = None
+			self.search_start(widget, False)
+			return False
+		self.search_debounce_id = GLib.timeout_add(SEARCH_DEBOUNCE_MS, _debounced)
+
+	def search_start(self, widget, alert: bool):
+		"""Search for the entry text, alert (red flash) on empty results"""
 		def _alert_error():
+			if not alert:
+				return
 			# Red flash
 			widget.get_style_context().add_class("error")
 			GLib.timeout_add_seconds(0.5,
@@ -882,141 +5299,276 @@ class MainWindow(Gtk.Window):
 		if not search_term:
 			_alert_error()
 			return
-
-		self.list_search.clear()
-		apt_proc = subprocess.Popen(
-			[*APT_LANG, "apt-cache", "search", search_term],
-			stdout=subprocess.PIPE,
-			stderr=subprocess.DEVNULL,
-			text=True
-		)
-
-		out, _ = apt_proc.communicate()
-
-		lines = out.splitlines()
-		if not lines:
+		try:
+			parse_apt_query(search_term.split())
+		except ValueError as e:
+			# e.g. size:abc, the last results stay
+			self.search_label.set_text(str(e))
 			_alert_error()
 			return
 
-		results = []
-		for line in lines:
-			# Skip empty lines
-			ln = line.strip()
-			if not ln or ln == "Sorting..." or ln == "Full Text Search...":
-				continue
-			results.append(ln)
+		self.list_search.clear()
+		self.search_more_button.hide()
+		self.search_rows = []
+		self.search_cap = SEARCH_SHOW_ROWS
+		self.search_done = False
+		# Rows still queued for an older query are dropped by their generation
+		self.search_gen += 1
+		gen = self.search_gen
+
+		# Same query on the same lists: nothing to run
+		stamp = apt_cache_stamp()
+		cached = self.search_cache.get(search_term)
+		if cached is not None and cached[0] == stamp:
+			job_scheduler.cancel_source("search")
+			self.search_rows = list(cached[1])
+			self.search_done = True
+			self.search_fill(gen)
+			if not self.search_rows:
+				_alert_error()
+			return
+		self.search_label.set_text(Localize("str_search_searching"))
 
-		if not results:
-			_alert_error()
+		def _search_done():
+			if gen != self.search_gen:
+				return
+			self.search_done = True
+			self.search_cache.put(search_term, (stamp, list(self.search_rows)))
+			self.search_fill(gen)
+			if not self.search_rows:
+				_alert_error()
+
+		def _search_worker():
+			for row in get_apt_backend().iter_search(search_term):
+				check_cancelled()
+				ui_dispatch.post_batch(("search", gen), self.on_search_rows, (gen, row))
+			check_cancelled()
+			ui_dispatch.post(_search_done)
+
+		# A new search replaces the one still running
+		job_scheduler.submit(_search_worker, source="search")
+
+	def on_search_rows(self, items: list):
+		gen = items[0][0]
+		if gen != self.search_gen:
 			return
+		self.search_rows.extend(row for _, row in items)
+		self.search_fill(gen)
 
-		for res in results:
-			pkg = res.split(" - ")
-			self.list_search.append([pkg[0].strip(), pkg[1].strip()])
+	def search_fill(self, gen: int):
+		"""Move up to SEARCH_FRAME_ROWS rows into the view, more next frame"""
+		if gen != self.search_gen:
+			return
+		shown = len(self.list_search)
+		end = min(len(self.search_rows), self.search_cap, shown + SEARCH_FRAME_ROWS)
+		for name, description in self.search_rows[shown:end]:
+			self.list_search.append([name, description])
+		if end < min(len(self.search_rows), self.search_cap):
+			ui_dispatch.post_latest(("search_fill", gen), self.search_fill, gen)
+
+		total = len(self.search_rows)
+		if end < total:
+			text = Localize("str_search_showing") % (end, total)
+		else:
+			text = Localize("str_search_results") % total
+		if not self.search_done:
+			text += "..."
+		self.search_label.set_text(text)
+		self.search_more_button.set_visible(total > self.search_cap)
 
+	def on_search_show_more(self, button):
+		self.search_cap += SEARCH_SHOW_ROWS
+		self.search_fill(self.search_gen)
 
 	def get_package_policy(self, pkgname) -> tuple:
 		"""Returns (installed, candidate, archs)"""
-		policy = subprocess.run(
-			[*APT_LANG, "apt-cache", "policy", pkgname.strip()],
-			stdout=subprocess.PIPE,
-			stderr=subprocess.DEVNULL,
-			text=True
-		).stdout.splitlines()
-
-		archs = []
-		installed = None
-		candidate = None
-		for pline in policy:
-			pline = pline.strip()
-			if pline.startswith("Candidate: "):
-				candidate = pline[len("Candidate: "):]
-			elif pline.startswith("Installed: "):
-				installed = pline[len("Installed: "):]
-			elif pline.endswith(" Packages"):
-				arch = pline.split()[3].strip()
-				if arch not in archs:
-					archs.append(arch)
-
-		return installed, candidate, archs
+		return get_apt_backend().policy(pkgname)
+
+	def update_list(self, list_store, removed, rows, new_row):
+		"""Apply a (removed keys, updated rows) diff in place
+
+		Rows are keyed by (name, arch), the second and last columns of the
+		store; removed None means rows is the whole list. Toggles of the
+		rows that stay are kept, new rows come from new_row(row)."""
+		updated = {(r[0], r[-1]): r for r in rows}
+		if removed is None:
+			removed = [(row[1], row[-1]) for row in list_store
+					   if (row[1], row[-1]) not in updated]
+		removed = set(removed)
+
+		it = list_store.get_iter_first()
+		while it is not None:
+			key = (list_store[it][1], list_store[it][-1])
+			if key in removed:
+				# remove() moves it to the next row, or returns False at the end
+				if not list_store.remove(it):
+					it = None
+				continue
+			if key in updated:
+				list_store.set_row(it, [list_store[it][0], *updated.pop(key)])
+			it = list_store.iter_next(it)
+		for row in updated.values():
+			list_store.append(new_row(row))
+
+	def on_list_changed(self, name: str, removed, rows):
+		"""Diff from the daemon or a live refresh, runs in a worker thread"""
+		if name == "upgradable":
+			selected = user_config.get("editor/upgrades_selected_by_default")
+			ui_dispatch.post(self.update_list, self.list_upgrade, removed, rows,
+							 lambda row: [selected, *row])
+		elif name == "installed":
+			ui_dispatch.post(self.update_list, self.list_remove, removed, rows,
+							 lambda row: [False, *row])
+
+	def subscribe_list(self, name: str) -> bool:
+		"""Follow a list through the daemon, False if it is not the backend"""
+		if not isinstance(get_apt_backend(), DaemonBackend):
+			return False
+		with self.daemon_lock:
+			if self.destroyed:
+				return True
+			try:
+				apt_daemon.subscribe((self, name), [name], self.on_list_changed)
+			except OSError:
+				return False
+			self.daemon_lists.add(name)
+		return True
+
+	def unsubscribe_lists(self, widget):
+		"""Close the daemon subscriptions, nothing shows their rows anymore"""
+		with self.daemon_lock:
+			self.destroyed = True
+			for name in self.daemon_lists:
+				apt_daemon.unsubscribe((self, name))
+			self.daemon_lists.clear()
+
+	def on_apt_state_changed(self):
+		# A newer change supersedes a refresh still running
+		job_scheduler.submit(self.refresh_lists, priority=PRIORITY_PREFETCH,
+							 source=(self, "live_refresh"))
+
+	def refresh_lists(self):
+		"""Apply only the rows apt changed to the Upgrade and Remove tabs, runs as a job"""
+		backend = get_apt_backend()
+		if "upgradable" not in self.daemon_lists:
+			rows = backend.upgradable()
+			check_cancelled()
+			removed, updated = apt_list_diff(self.upgradable_rows, rows)
+			self.upgradable_rows = rows
+			if removed or updated:
+				self.on_list_changed("upgradable", removed, updated)
+		if "installed" not in self.daemon_lists:
+			rows = backend.installed()
+			check_cancelled()
+			removed, updated = apt_list_diff(self.installed_rows, rows)
+			self.installed_rows = rows
+			if removed or updated:
+				self.on_list_changed("installed", removed, updated)
 
 	def get_apt_upgradables(self):
 		def worker_():
-			proc = subprocess.Popen(
-				[*APT_LANG, "apt", "list", "--upgradable"],
-				stdout=subprocess.PIPE,
-				stderr=subprocess.DEVNULL,
-				text=True
-			)
-			out, _ = proc.communicate()  # waits until process finishes, captures output
+			if self.subscribe_list("upgradable"):
+				return
+			rows = get_apt_backend().upgradable()
+			check_cancelled()
+			self.upgradable_rows = rows
+			ui_dispatch.post(fill_, rows)
 
+		def fill_(rows):
 			# Clear old rows on main thread
 			self.list_upgrade.clear()
 
-			lines = out.splitlines()
-			if not lines:
-				return
+			selected = user_config.get("editor/upgrades_selected_by_default")
+			for pkg, ver_cad, ver_ins, arch in rows:
+				self.list_upgrade.append([selected, pkg, ver_cad, ver_ins, arch])
 
-			# Skip "Listing..." header if present
-			if lines[0].lower().startswith("listing"):
-				lines = lines[1:]
-
-			for line in lines:
-				pkgcol = line.strip().split("/", 1)
-				pkg = pkgcol[0].strip()
-
-				cols = pkgcol[1].strip().split(" ")
-
-				ver_cad = cols[1].strip() if len(cols) >= 1 else None
-				arch = cols[2].strip() if len(cols) >= 2 else None
-				ver_ins = cols[5].strip() if len(cols) >= 5 else None
-
-				# Trim trailing bracket
-				if ver_ins and ver_ins[-1:] == "]":
-					ver_ins = ver_ins[:-1]
-
-				if ver_cad and ver_ins and arch:
-					self.list_upgrade.append([user_config["editor"]["upgrades_selected_by_default"],
-											  pkg, ver_cad, ver_ins, arch])
-
-		# Run worker
-		threading.Thread(target=worker_, daemon=True).start()
+		job_scheduler.submit(worker_, priority=PRIORITY_PREFETCH, source="upgradables")
 
 	def get_apt_installed(self):
 		def worker_():
-			proc = subprocess.Popen(
-				[*APT_LANG, "apt", "list", "--installed"],
-				stdout=subprocess.PIPE,
-				stderr=subprocess.DEVNULL,
-				text=True
-			)
-			out, _ = proc.communicate()  # waits until process finishes, captures output
+			if self.subscribe_list("installed"):
+				return
+			rows = get_apt_backend().installed()
+			check_cancelled()
+			self.installed_rows = rows
+			ui_dispatch.post(fill_, rows)
 
+		def fill_(rows):
 			# Clear old rows on main thread
 			self.list_remove.clear()
 
-			lines = out.splitlines()
-			if not lines:
-				return
-
-			# Skip "Listing..." header if present
-			if lines[0].lower().startswith("listing"):
-				lines = lines[1:]
-
-			for line in lines:
-				pkgcol = line.strip().split("/", 1)
-				pkg = pkgcol[0].strip()
+			for pkg, ver_ins, arch in rows:
+				self.list_remove.append([False, pkg, ver_ins, arch])
 
-				cols = pkgcol[1].strip().split(" ")
+		job_scheduler.submit(worker_, priority=PRIORITY_PREFETCH, source="installed")
 
-				ver_ins = cols[1].strip() if len(cols) >= 1 else None
-				arch = cols[2].strip() if len(cols) >= 2 else None
-
-				if ver_ins and arch:
-					self.list_remove.append([False, pkg, ver_ins, arch])
-
-		# Run worker
-		threading.Thread(target=worker_, daemon=True).start()
+	def get_apt_sources(self):
+		def worker_():
+			sources = [src for src in apt_sources() if src.enabled and "deb" in src.types]
+			rows = []
+			for i, src in enumerate(sources):
+				refreshed = src.last_refresh()
+				rows.append([i, src.uri, src.suite, " ".join(src.components),
+							 time.strftime("%Y-%m-%d %H:%M", time.localtime(refreshed))
+							 if refreshed else Localize("str_source_never"),
+							 os.path.basename(src.path)])
+			check_cancelled()
+			ui_dispatch.post(fill_, sources, rows)
+
+		def fill_(sources, rows):
+			self.apt_sources = sources
+			self.list_sources.clear()
+			for row in rows:
+				self.list_sources.append(row)
+
+		job_scheduler.submit(worker_, priority=PRIORITY_PREFETCH, source="sources")
+
+	def on_refresh_source(self, button):
+		model, it = self.sources_view.get_selection().get_selected()
+		if it is None:
+			return
+		source = self.apt_sources[model[it][0]]
+		button.set_sensitive(False)
+		self.sources_label.set_text(Localize("str_source_refreshing") % source.uri)
+		job_scheduler.submit(self.refresh_source, source, source=(self, "sources"), long=True)
+
+	def refresh_source(self, source: AptSource):
+		"""apt-get update of one source, then reindex the lists it fetched"""
+		try:
+			proc, sources_file = apt_update_source(source)
+			if proc is None:
+				print("Cannot refresh %s: %s" % (source.uri, sources_file), file=sys.stderr)
+				ui_dispatch.post_latest((self, "sources_label"), self.sources_label.set_text,
+										"%s: %s" % (Localize("str_error"), sources_file))
+				return
+			stats = AptUpdateStats()
+			output = []
+			try:
+				for line in proc.lines():
+					output.append(line)
+					stats.feed(line)
+					ui_dispatch.post_latest((self, "sources_label"), self.sources_label.set_text,
+											line.strip())
+				proc.wait()
+			except (OSError, AptDaemonError) as e:
+				proc.terminate()
+				ui_dispatch.post_latest((self, "sources_label"), self.sources_label.set_text,
+										"%s: %s" % (Localize("str_error"), e))
+				return
+			finally:
+				os.unlink(sources_file)
+			stats.save(proc.returncode)
+
+			fetched = apt_update_fetched(output)
+			apt_reindex(fetched)
+			if proc.returncode == 0:
+				text = Localize("str_source_refreshed") % (source.uri, len(fetched))
+			else:
+				text = Localize("str_error")
+			ui_dispatch.post_latest((self, "sources_label"), self.sources_label.set_text, text)
+		finally:
+			ui_dispatch.post(self.sources_refresh_button.set_sensitive, True)
+		self.get_apt_sources()
 
 	def do_everything(self, widget):
 		apt_installs = [apt_canonicalize_package(row[1], row[2], row[3])
@@ -1096,10 +5648,9 @@ class PackageInfoWindow(Gtk.Window):
 		self.scroll.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
 		self.add(self.scroll)
 
-		# Get package info
+		# Package info is filled in when get_package_info finishes
 		self.list_fields = Gtk.ListStore(str, str)
 		self.raw_text = ""
-		self.get_package_info()
 
 		# Create both views but only show one
 		self.create_views()
@@ -1110,76 +5661,33 @@ class PackageInfoWindow(Gtk.Window):
 		else:
 			self.show_table_view()
 
+		# Closing the window kills the query if it is still running
+		self.connect("destroy", lambda _: job_scheduler.cancel_source(self))
+		job_scheduler.submit(self.get_package_info, source=self)
+
 		self.show_all()
 
 	def get_package_info(self):
-		"""Get package info and populate both raw text and list fields"""
-		# GET INFO
-		self.proc = None
+		"""Get package info, runs as a job"""
 		if self.local_pkg is None:
-			self.proc = subprocess.Popen(
-				[*APT_LANG_USER, "apt-cache", "show", self.pkgname],
-				stdout=subprocess.PIPE,
-				stderr=subprocess.DEVNULL,
-				text=True
-			)
+			out = get_apt_backend().show(self.pkgname)
 		else:
-			self.proc = subprocess.Popen(
-				["dpkg-deb", "-I", self.local_pkg],
-				stdout=subprocess.PIPE,
-				stderr=subprocess.DEVNULL,
-				text=True
-			)
+			out = run_command(["dpkg-deb", "-I", self.local_pkg]).output
+		check_cancelled()
+		ui_dispatch.post(self.show_package_info, out)
 
-		out, _ = self.proc.communicate()
+	def show_package_info(self, out: str):
+		"""Populate both raw text and list fields"""
 		if not out:
 			self.show_error("Error getting package info")
-			return
+			return False
+
+		self.raw_text, fields = parse_package_info(out, self.pkgver)
+		for field in fields:
+			self.list_fields.append(field)
 
-		# Process raw text
-		blocks = out.strip().split("\n\n")
-		for block in blocks:
-			if not self.pkgver or "Version: %s" % self.pkgver in block:
-				if self.raw_text != "":
-					self.raw_text += "\n\n"
-				self.raw_text += block
-
-		# Process for table view
-		for block in blocks:
-			if not self.pkgver or "Version: %s" % self.pkgver in block:
-				for line in block.splitlines():
-					line = line.strip()
-					if not line:
-						continue
-
-					# Human readable size
-					if line.startswith("Installed-Size: "):
-						line = line.replace("Installed-Size: ", "").strip()
-						num = format_filesize(int(line) * 1024) # KiB to bytes
-						line = "Installed-Size: %s" % num
-
-
-					# Save URLs protocols
-					line = line.replace("http://", "http;;//")
-					line = line.replace("https://", "http;;//")
-
-					if ':' not in line:
-						# Restore URLs
-						line = line.replace("http;;//", "http://")
-						line = line.replace("https;;//", "http://")
-						# Append line to the previous field data
-						if self.list_fields and len(self.list_fields) > 0:
-							self.list_fields[-1][1] += "\n" + line
-						continue
-
-					i_sep = line.index(":")
-
-					# Restore URLs protocols
-					line = line.replace("http;;//", "http://")
-					line = line.replace("https;;//", "http://")
-
-					field, data = line[:i_sep].strip(), line[i_sep + 1:].strip()
-					self.list_fields.append([field, data])
+		self.textview.get_buffer().set_text(self.raw_text)
+		return False
 
 	def create_views(self):
 		"""Create both table and raw text views"""
@@ -1302,12 +5810,13 @@ class InstallerWindow(Gtk.Window):
 
 		# Start worker thread
 		self.textbuffer = self.textview.get_buffer()
-		threading.Thread(target=self.run_commands, daemon=True).start()
+		job_scheduler.submit(self.run_commands, long=True)
 
-	def update_log(self, text):
-		self.label.set_text(text.strip())
+	def update_log(self, lines: list):
+		"""Append the lines output since the last frame"""
+		self.label.set_text(lines[-1].strip())
 		end_iter = self.textbuffer.get_end_iter()
-		self.textbuffer.insert(end_iter, text)
+		self.textbuffer.insert(end_iter, "".join(lines))
 		# Scroll to bottom
 		mark = self.textbuffer.create_mark(
 			None, self.textbuffer.get_end_iter(), False)
@@ -1319,32 +5828,29 @@ class InstallerWindow(Gtk.Window):
 		# Step (1) Remove
 		if self.list_removes:
 			# Build command
-			cmd = [*APT_LANG_USER, *APT_NONINTERACTIVE, "apt-get", "remove", "-y"]
+			cmd = ["apt-get", "remove", "-y"]
 			cmd.extend(self.list_removes)
 
 			# Run install command
-			GLib.idle_add(self.update_log, " ".join(cmd) + "\n")
-			self.proc = subprocess.Popen(cmd,
-										 stdout=subprocess.PIPE,
-										 stderr=subprocess.STDOUT,
-										 text=True, bufsize=1)
-			for line in self.proc.stdout:
-				GLib.idle_add(self.progressbar.pulse)
+			ui_dispatch.post_batch((self, "log"), self.update_log, " ".join(cmd) + "\n")
+			self.proc = apt_transaction(cmd)
+			for line in self.proc.lines():
+				ui_dispatch.post_latest((self, "progress"), self.progressbar.pulse)
 				if line:
-					GLib.idle_add(self.update_log, line)
+					ui_dispatch.post_batch((self, "log"), self.update_log, line)
 
 			self.proc.wait()
 
 		# Step (2) Install & Upgrade
 		if self.list_installs or self.list_upgrades:
 			# Build command
-			cmd = [*APT_LANG_USER, *APT_NONINTERACTIVE, "apt-get", "install", "-y"]
+			cmd = ["apt-get", "install", "-y"]
 
-			if user_config['apt_install']['fix_missing']:
+			if user_config.get("apt_install/fix_missing"):
 				cmd.append("--fix-missing")
-			if user_config['apt_install']['fix_broken']:
+			if user_config.get("apt_install/fix_broken"):
 				cmd.append("--fix-broken")
-			if user_config['apt_install']['fix_policy']:
+			if user_config.get("apt_install/fix_policy"):
 				cmd.append("--fix-policy")
 
 			if self.list_installs:
@@ -1353,20 +5859,16 @@ class InstallerWindow(Gtk.Window):
 				cmd.extend(self.list_upgrades)
 
 			# Run install command
-			self.proc = subprocess.Popen(cmd,
-										 stdout=subprocess.PIPE,
-										 stderr=subprocess.STDOUT,
-										 text=True, bufsize=1)
-			for line in self.proc.stdout:
-				GLib.idle_add(self.progressbar.pulse)
+			self.proc = apt_transaction(cmd)
+			for line in self.proc.lines():
+				ui_dispatch.post_latest((self, "progress"), self.progressbar.pulse)
 				if line:
-					GLib.idle_add(self.update_log, line)
+					ui_dispatch.post_batch((self, "log"), self.update_log, line)
 
 			self.proc.wait()
 
-		GLib.idle_add(self.progressbar.set_fraction, 1.0)
-		GLib.idle_add(self.label.set_text, Localize("str_done"))
-		# GLib.idle_add(self.destroy)
+		ui_dispatch.post_latest((self, "progress"), self.progressbar.set_fraction, 1.0)
+		ui_dispatch.post_latest((self, "label"), self.label.set_text, Localize("str_done"))
 
 	def on_destroy(self, button):
 		if hasattr(self, 'proc') and self.proc and self.proc.poll() is None:
@@ -1429,14 +5931,15 @@ class LocalInstallerWindow(Gtk.Window):
 
 		# Start worker thread
 		self.textbuffer = self.textview.get_buffer()
-		threading.Thread(target=self.run_commands, daemon=True).start()
+		job_scheduler.submit(self.run_commands, long=True)
 		if quit_on_finnish:
 			self.connect("destroy", Gtk.main_quit)
 
-	def update_log(self, text):
-		self.label.set_text(text.strip())
+	def update_log(self, lines: list):
+		"""Append the lines output since the last frame"""
+		self.label.set_text(lines[-1].strip())
 		end_iter = self.textbuffer.get_end_iter()
-		self.textbuffer.insert(end_iter, text)
+		self.textbuffer.insert(end_iter, "".join(lines))
 		# Scroll to bottom
 		mark = self.textbuffer.create_mark(
 			None, self.textbuffer.get_end_iter(), False)
@@ -1448,588 +5951,537 @@ class LocalInstallerWindow(Gtk.Window):
 		# Step (1) Installs
 		if self.list_installs:
 			# Build command
-			cmd = [*APT_LANG_USER, *APT_NONINTERACTIVE,
-				"apt-get", "install", "-y", "--allow-downgrades"]
+			cmd = ["apt-get", "install", "-y", "--allow-downgrades"]
 
-			if user_config['apt_install']['fix_missing']:
+			if user_config.get("apt_install/fix_missing"):
 				cmd.append("--fix-missing")
-			if user_config['apt_install']['fix_broken']:
+			if user_config.get("apt_install/fix_broken"):
 				cmd.append("--fix-broken")
-			if user_config['apt_install']['fix_policy']:
+			if user_config.get("apt_install/fix_policy"):
 				cmd.append("--fix-policy")
 
 			if self.list_installs:
 				cmd.extend(self.list_installs)
 
 			# Run install command
-			GLib.idle_add(self.update_log, " ".join(cmd) + "\n")
-			self.proc = subprocess.Popen(cmd,
-										 stdout=subprocess.PIPE,
-										 stderr=subprocess.STDOUT,
-										 text=True, bufsize=1)
-			for line in self.proc.stdout:
-				GLib.idle_add(self.progressbar.pulse)
+			ui_dispatch.post_batch((self, "log"), self.update_log, " ".join(cmd) + "\n")
+			self.proc = apt_transaction(cmd)
+			for line in self.proc.lines():
+				ui_dispatch.post_latest((self, "progress"), self.progressbar.pulse)
 				if line:
-					GLib.idle_add(self.update_log, line)
+					ui_dispatch.post_batch((self, "log"), self.update_log, line)
 
 			self.proc.wait()
 
 		# Step (2) Reinstalls
 		if self.list_reinstalls:
 			# Build command
-			cmd = [*APT_LANG_USER, *APT_NONINTERACTIVE,
-          		"apt-get", "install", "-y", "--reinstall"]
+			cmd = ["apt-get", "install", "-y", "--reinstall"]
 
-			if user_config['apt_install']['fix_missing']:
+			if user_config.get("apt_install/fix_missing"):
 				cmd.append("--fix-missing")
-			if user_config['apt_install']['fix_broken']:
+			if user_config.get("apt_install/fix_broken"):
 				cmd.append("--fix-broken")
-			if user_config['apt_install']['fix_policy']:
+			if user_config.get("apt_install/fix_policy"):
 				cmd.append("--fix-policy")
 
 			if self.list_reinstalls:
 				cmd.extend(self.list_reinstalls)
 
 			# Run install command
-			GLib.idle_add(self.update_log, " ".join(cmd) + "\n")
-			self.proc = subprocess.Popen(cmd,
-										 stdout=subprocess.PIPE,
-										 stderr=subprocess.STDOUT,
-										 text=True, bufsize=1)
-			for line in self.proc.stdout:
-				GLib.idle_add(self.progressbar.pulse)
+			ui_dispatch.post_batch((self, "log"), self.update_log, " ".join(cmd) + "\n")
+			self.proc = apt_transaction(cmd)
+			for line in self.proc.lines():
+				ui_dispatch.post_latest((self, "progress"), self.progressbar.pulse)
 				if line:
-					GLib.idle_add(self.update_log, line)
+					ui_dispatch.post_batch((self, "log"), self.update_log, line)
 
 			self.proc.wait()
 
-		GLib.idle_add(self.progressbar.set_fraction, 1.0)
-		GLib.idle_add(self.label.set_text, Localize("str_done"))
+		ui_dispatch.post_latest((self, "progress"), self.progressbar.set_fraction, 1.0)
+		ui_dispatch.post_latest((self, "label"), self.label.set_text, Localize("str_done"))
 
 	def on_destroy(self, button):
 		if hasattr(self, 'proc') and self.proc and self.proc.poll() is None:
 			self.proc.terminate()
 
 class LocalPackageWindow(Gtk.Window):
-	def __init__(self, files):
+	# Where files forwarded by later invocations go, see open_local_packages
+	current = None
+
+	def __init__(self, files, quit_on_close: bool = True):
 		super().__init__(title=Localize("str_install_local_packages"))
 		self.set_default_size(640, 480)
 		self.set_position(Gtk.WindowPosition.CENTER)
 
 		self.list_installs = []
 		self.list_reinstalls = []
+		self.verify_buttons = []
+		self.deps_tabs = []
+		self.tabs = {}  # deb file -> tab
+		self.big_btn_install = None
 
 		# Main vertical box to hold toolbar (optional) + notebook
-		main_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=0)
-		self.add(main_box)
+		self.main_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=0)
+		self.add(self.main_box)
 
 		# Create a Notebook (tabs)
-		big_btn_install = None
-		notebook = Gtk.Notebook()
-		main_box.pack_start(notebook, True, True, 0)
+		self.notebook = Gtk.Notebook()
+		self.main_box.pack_start(self.notebook, True, True, 0)
 
-		# Get data from file
+		# Only the first window of the process ends it
+		self.sigid_destroy = self.connect("destroy", Gtk.main_quit) if quit_on_close else None
+		# Stop listing, verifying and checking packages nobody will see
+		self.connect("destroy", lambda _: job_scheduler.cancel_owner(self))
+		self.connect("destroy", self.on_destroy)
+		LocalPackageWindow.current = self
+
+		self.add_files(files)
+
+	def on_destroy(self, widget):
+		if LocalPackageWindow.current is self:
+			LocalPackageWindow.current = None
+
+	def add_files(self, files: list):
+		"""Add a tab per new package file, then check them all again"""
 		for deb_file in files:
-			if not deb_file or not os.path.isfile(deb_file):
+			deb_file = os.path.abspath(deb_file)
+			if deb_file in self.tabs:
+				# Already open, show it
+				self.notebook.set_current_page(self.notebook.page_num(self.tabs[deb_file]))
 				continue
+			self.add_package(deb_file)
 
-			# Check if it's deb package with 'file' command
-			proc = subprocess.Popen(
-				[*APT_LANG_USER, "file", "--mime-type", deb_file],
-				stdout=subprocess.PIPE,
-				stderr=subprocess.DEVNULL,
-				text=True
-			)
-			out, _ = proc.communicate()
-			if not out: continue
-			if "application/vnd.debian.binary-package" not in out:
-				continue
+		pkg_count = self.update_install_count()
+		if self.big_btn_install is None and pkg_count > 1:
+			self.add_big_buttons(pkg_count)
+		self.show_all()
 
-			# Get package metadata
-			proc = subprocess.Popen(
-				["dpkg-deb", "-I", deb_file],
-				stdout=subprocess.PIPE,
-				stderr=subprocess.DEVNULL,
-				text=True
-			)
-			PackageInfo, _ = proc.communicate()
-			if not PackageInfo: continue
-
-			metadata = {
-				"Package": None,
-				"Version": None,
-				"Architecture": None,
-				"Installed-Size": None,
-				"Vendor": None,
-				"Maintainer": None,
-				"Homepage": None,
-				"Depends": None
-			}
-			for line in PackageInfo.split("\n"):
-				line = line.strip()
-				for key in metadata.keys():
-					if line.startswith("%s: " % key):
-						value = line[len("%s: " % key):].strip()
-						if key == "Installed-Size":
-							value = format_filesize(int(value) * 1024) # size is in KiB, so scale to bytes
-						if key == "Depends":
-							value = ", ".join([d.strip() for d in value.split(",")])
-						metadata[key] = value
-
-
-			# == HEADER ==
-			header_box = Gtk.HBox(spacing=12)
-			pkg_icon = gtk_gif_icon("/usr/share/vapt/images/loading.gif", 64, 12.0)
-			header_box.pack_start(pkg_icon, False, False, 0)
-
-			# Info vertical box
-			info_box = Gtk.VBox(spacing=2)
-			header_box.pack_start(info_box, True, True, 0)
-
-			# Name (bold)
-			label_name = Gtk.Label()
-			label_name.set_markup("<b>%s</b>" % metadata['Package'])
-			label_name.set_xalign(0)
-			info_box.pack_start(label_name, False, False, 0)
-
-			# Version and Arch
-			label_ver_arch = Gtk.Label(
-				label="%s | %s | %s" % (metadata['Architecture'], metadata['Version'], metadata['Installed-Size'])
-			)
-			label_ver_arch.set_xalign(0)
-			info_box.pack_start(label_ver_arch, False, False, 0)
-
-			# Vendor
-			if metadata["Maintainer"]:
-				label_vendor = Gtk.Label(label=metadata['Maintainer'])
-				label_vendor.set_xalign(0)
-				info_box.pack_start(label_vendor, False, False, 0)
-
-			# Homepage (clickable)
-			if metadata["Homepage"]:
-				homepage_url = metadata["Homepage"]
-				label_home = Gtk.Label()
-				label_home.set_use_markup(True)
-				label_home.set_markup("<a href='%s'>%s</a>" % (homepage_url, homepage_url))
-				label_home.set_xalign(0)
-				label_home.set_selectable(False)
-				# Open browser when clicked
-				def on_activate_link(label, uri):
-					user = os.environ.get("SUDO_USER")
-					if user:
-						subprocess.Popen(["sudo", "-u", user, "open", homepage_url],
-							stdout=subprocess.DEVNULL,
-							stderr=subprocess.DEVNULL
-						)
-					else:
-						subprocess.Popen(["open", homepage_url],
-							stdout=subprocess.DEVNULL,
-							stderr=subprocess.DEVNULL
-						)
-					return True  # prevent default handler
-				label_home.connect("activate-link", on_activate_link)
-				info_box.pack_start(label_home, False, False, 0)
-
-			# Actions vertical box
-			actions_box = Gtk.VBox(spacing=2)
-			header_box.pack_start(actions_box, False, True, 0)
-
-			# Get installed version
-			def get_installed_version(pkgname: str) -> str | None:
-				"""Return installed version of package or None if not installed."""
-				proc = subprocess.run(
-					["dpkg-query", "-W", "-f=${Status} ${Version}", pkgname],
-					stdout=subprocess.PIPE,
-					stderr=subprocess.DEVNULL,
-					text=True
-				)
+		# Check dependencies of every tab against the others
+		job_scheduler.submit(self.check_dependencies, priority=PRIORITY_INDEXING,
+							 source=(self, "deps"))
 
-				if proc.returncode != 0:
-					return None
+	def update_install_count(self) -> int:
+		"""Packages left to install, shown on the install all button"""
+		pkg_count = len(self.list_installs) + len(self.list_reinstalls)
+		if self.big_btn_install is not None:
+			self.big_btn_install.set_label(Localize("str_install_x_packages") % pkg_count)
+			self.big_btn_install.set_sensitive(pkg_count > 0)
+		return pkg_count
+
+	def on_install(self, button, deb_file: str, is_reinstall: bool):
+		# Prevent double install
+		if not button.get_sensitive(): return
+		# Deactivate button
+		button.set_sensitive(False)
+
+		# Install package
+		LocalInstallerWindow(
+			[deb_file] if not is_reinstall else None,
+			[deb_file] if is_reinstall else None)
+
+		# Not part of install all anymore
+		if is_reinstall:
+			self.list_reinstalls.remove(deb_file)
+		else:
+			self.list_installs.remove(deb_file)
+		self.update_install_count()
 
-				output = proc.stdout.strip()
+	def add_package(self, deb_file: str) -> bool:
+		"""Tab of one package file, False if it is not a readable .deb"""
+		if not deb_file or not os.path.isfile(deb_file):
+			return False
 
-				# Installed packages contain:
-				# "install ok installed <version>"
-				if output.startswith("install ok installed"):
-					return output.split()[-1]
+		# Check if it's deb package with 'file' command
+		proc = Command(["file", "--mime-type", deb_file], env=APT_ENV_USER)
+		out, _ = proc.communicate()
+		if not out: return False
+		if "application/vnd.debian.binary-package" not in out:
+			return False
 
-				return None
+		# Get package metadata
+		metadata, control = deb_read_info(deb_file)
+		if metadata is None: return False
 
-			# Check "Install" or "Upgrade" or "Reinstall"
-			is_reinstall = False
-			installed_version = get_installed_version(metadata["Package"])
-			if installed_version is None:
-				action_label = Localize("str_install_package")
-				self.list_installs.append(deb_file)
-			elif installed_version == metadata["Version"]:
-				action_label = Localize("str_reinstall_package")
-				is_reinstall = True
-				self.list_reinstalls.append(deb_file)
-			else:
-				action_label = Localize("str_upgrade_package")
-				self.list_installs.append(deb_file)
-
-			button = Gtk.Button(label=action_label)
-			def on_install(button, deb_file):
-				# Prevent double install
-				if not button.get_sensitive(): return
-				# Deactivate button
-				button.set_sensitive(False)
-
-				# Install package
-				LocalInstallerWindow(
-					[deb_file] if not is_reinstall else None,
-					[deb_file] if is_reinstall else None)
-
-				# Deactivate button
-				if is_reinstall:
-					self.list_reinstalls.remove(deb_file)
+		# == HEADER ==
+		header_box = Gtk.HBox(spacing=12)
+		pkg_icon = gtk_gif_icon("/usr/share/vapt/images/loading.gif", 64, 12.0)
+		header_box.pack_start(pkg_icon, False, False, 0)
+
+		# Info vertical box
+		info_box = Gtk.VBox(spacing=2)
+		header_box.pack_start(info_box, True, True, 0)
+
+		# Name (bold)
+		label_name = Gtk.Label()
+		label_name.set_markup("<b>%s</b>" % metadata['Package'])
+		label_name.set_xalign(0)
+		info_box.pack_start(label_name, False, False, 0)
+
+		# Version and Arch
+		label_ver_arch = Gtk.Label(
+			label="%s | %s | %s" % (metadata['Architecture'], metadata['Version'], metadata['Installed-Size'])
+		)
+		label_ver_arch.set_xalign(0)
+		info_box.pack_start(label_ver_arch, False, False, 0)
+
+		# Vendor
+		if metadata["Maintainer"]:
+			label_vendor = Gtk.Label(label=metadata['Maintainer'])
+			label_vendor.set_xalign(0)
+			info_box.pack_start(label_vendor, False, False, 0)
+
+		# Homepage (clickable)
+		if metadata["Homepage"]:
+			homepage_url = metadata["Homepage"]
+			label_home = Gtk.Label()
+			label_home.set_use_markup(True)
+			label_home.set_markup("<a href='%s'>%s</a>" % (homepage_url, homepage_url))
+			label_home.set_xalign(0)
+			label_home.set_selectable(False)
+			# Open browser when clicked
+			def on_activate_link(label, uri):
+				user = os.environ.get("SUDO_USER")
+				if user:
+					Command(["sudo", "-u", user, "open", homepage_url],
+							stdout=subprocess.DEVNULL)
 				else:
-					self.list_installs.remove(deb_file)
+					Command(["open", homepage_url], stdout=subprocess.DEVNULL)
+				return True  # prevent default handler
+			label_home.connect("activate-link", on_activate_link)
+			info_box.pack_start(label_home, False, False, 0)
 
-				pkg_count = len(self.list_installs) + len(self.list_reinstalls)
-				if big_btn_install is not None:
-					big_btn_install.set_label(Localize("str_install_x_packages") % pkg_count)
-					if pkg_count == 0:
-						big_btn_install.set_sensitive(False)
+		# Actions vertical box
+		actions_box = Gtk.VBox(spacing=2)
+		header_box.pack_start(actions_box, False, True, 0)
+
+		# Get installed version
+		def get_installed_version(pkgname: str) -> str | None:
+			"""Return installed version of package or None if not installed."""
+			proc = run_command(["dpkg-query", "-W", "-f=${Status} ${Version}", pkgname])
+
+			if proc.returncode != 0:
+				return None
+
+			output = proc.output.strip()
+
+			# Installed packages contain:
+			# "install ok installed <version>"
+			if output.startswith("install ok installed"):
+				return output.split()[-1]
+
+			return None
+
+		# Check "Install" or "Upgrade" or "Reinstall"
+		is_reinstall = False
+		installed_version = get_installed_version(metadata["Package"])
+		if installed_version is None:
+			action_label = Localize("str_install_package")
+			self.list_installs.append(deb_file)
+		elif installed_version == metadata["Version"]:
+			action_label = Localize("str_reinstall_package")
+			is_reinstall = True
+			self.list_reinstalls.append(deb_file)
+		else:
+			action_label = Localize("str_upgrade_package")
+			self.list_installs.append(deb_file)
+
+		button = Gtk.Button(label=action_label)
+		button.connect("clicked", self.on_install, deb_file, is_reinstall)
+		actions_box.pack_start(button, False, False, 0)
+
+		button = Gtk.Button(label=Localize("str_details"))
+		button.connect("clicked", self.on_details, deb_file, metadata)
+		actions_box.pack_start(button, False, False, 0)
+
+		# Integrity status (filled by verify)
+		label_integrity = Gtk.Label()
+		label_integrity.set_xalign(0)
+		label_integrity.set_no_show_all(True)
+		info_box.pack_start(label_integrity, False, False, 0)
+
+		# Dependency verdict (filled once the package index is ready)
+		label_deps = Gtk.Label(label=Localize("str_deps_checking"))
+		label_deps.set_xalign(0)
+		info_box.pack_start(label_deps, False, False, 0)
+
+		# == TAB CONTENT ==
+		tab_box = Gtk.VBox(spacing=6)
+		tab_box.set_border_width(16)
+		tab_box.pack_start(header_box, False, False, 0)
+		notebook2 = Gtk.Notebook()
+		tab_box.pack_start(notebook2, True, True, 0)
+
+		# == Integrity page ==
+		integrity_list = Gtk.ListStore(str, str)
+		treeview_integrity = Gtk.TreeView(model=integrity_list)
+		column = Gtk.TreeViewColumn(Localize("str_form_path"),
+									Gtk.CellRendererText(), text=0)
+		column.set_sort_column_id(0)
+		treeview_integrity.append_column(column)
+		column = Gtk.TreeViewColumn(Localize("str_form_status"),
+									Gtk.CellRendererText(), text=1)
+		column.set_sort_column_id(1)
+		treeview_integrity.append_column(column)
+
+		scroll_integrity = Gtk.ScrolledWindow()
+		scroll_integrity.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+		scroll_integrity.add(treeview_integrity)
+
+		# == Dependencies page ==
+		deps_list = Gtk.ListStore(str, str, str, str)
+		treeview_deps = Gtk.TreeView(model=deps_list)
+		for i, title in enumerate(["str_form_field", "str_form_relation",
+								   "str_form_status", "str_details"]):
+			column = Gtk.TreeViewColumn(Localize(title),
+										Gtk.CellRendererText(), text=i)
+			column.set_sort_column_id(i)
+			treeview_deps.append_column(column)
+
+		scroll_deps = Gtk.ScrolledWindow()
+		scroll_deps.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+		scroll_deps.add(treeview_deps)
+
+		button = Gtk.Button(label=Localize("str_verify_integrity"))
+		button.connect("clicked", self.on_verify, deb_file,
+					   label_integrity, integrity_list)
+		actions_box.pack_start(button, False, False, 0)
+		self.verify_buttons.append(button)
+
+		# == Fetch control files ==
+		temp_folder = mkdtemp()
+		run_command(["dpkg-deb", "-e", deb_file, temp_folder])
+
+		# When program exits, remove temp folder
+		atexit.register(rmforce, temp_folder)
+
+		# Create a horizontal paned container to split left and right
+		control_paned = Gtk.Paned.new(Gtk.Orientation.HORIZONTAL)
+		control_paned.set_position(128) # Set initial divider position
+
+		# Create a TreeStore for hierarchical files
+		control_list_files = Gtk.ListStore(str, str)
+		control_list_files.set_sort_column_id(0, Gtk.SortType.ASCENDING)
+		# Append all control files inside the temp folder
+		for control_file in os.listdir(temp_folder):
+			with open(os.path.join(temp_folder, control_file), "r") as f:
+				control_list_files.append([control_file, f.read()])
+
+		# Create TreeView for hierarchical display
+		control_files = Gtk.TreeView(model=control_list_files)
+		control_files.set_hexpand(True)
+		control_files.set_vexpand(True)
+
+		renderer = Gtk.CellRendererText()
+		column = Gtk.TreeViewColumn(Localize("str_form_file"), renderer, text=0)
+		control_files.append_column(column)
+
+		scroll_files = Gtk.ScrolledWindow()
+		scroll_files.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+		scroll_files.set_hexpand(True)
+		scroll_files.set_vexpand(True)
+
+		scroll_files.add(control_files)
+		control_paned.add1(scroll_files)
+
+		# Right panel: Text view for file content
+		scroll_files = Gtk.ScrolledWindow()
+		scroll_files.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+
+		content_textview = Gtk.TextView()
+		content_textview.set_editable(False)
+		content_textview.set_wrap_mode(Gtk.WrapMode.WORD)
+		content_textview.set_monospace(True)
+
+		scroll_files.add(content_textview)
+
+		control_paned.add2(scroll_files)
+
+		# Connect selection changed signal
+		def on_control_file_selected(selection, list_store, textview):
+			"""Callback when a control file is selected in the treeview"""
+			model, treeiter = selection.get_selected()
+			if treeiter is not None:
+				# Get the content from the second column
+				content = model[treeiter][1]
+				textview.get_buffer().set_text(content)
+
+		control_files.get_selection().connect("changed", on_control_file_selected, control_list_files, content_textview)
+
+		notebook2.append_page(control_paned, Gtk.Label(label=Localize("str_control_files")))
+
+		# == Fetch contents of the package ==
+		# Create a TreeStore for hierarchical files
+		file_tree_store = Gtk.TreeStore(str, str)
+		file_tree_store.set_sort_column_id(0, Gtk.SortType.ASCENDING)
+
+		# Create TreeView for hierarchical display
+		treeview_files = Gtk.TreeView(model=file_tree_store)
+		treeview_files.set_hexpand(True)
+		treeview_files.set_vexpand(True)
+
+		renderer = Gtk.CellRendererText()
+		column = Gtk.TreeViewColumn(Localize("str_form_path"), renderer, text=0)
+		treeview_files.append_column(column)
+
+		renderer = Gtk.CellRendererText()
+		column = Gtk.TreeViewColumn(Localize("str_form_size"), renderer, text=1)
+		treeview_files.append_column(column)
+
+		# Scrollable container
+		scroll_files = Gtk.ScrolledWindow()
+		scroll_files.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+		scroll_files.set_hexpand(True)
+		scroll_files.set_vexpand(True)
+		scroll_files.add(treeview_files)
+		notebook2.append_page(scroll_files, Gtk.Label(label=Localize("str_form_contents")))
+		notebook2.append_page(scroll_integrity, Gtk.Label(label=Localize("str_integrity")))
+		notebook2.append_page(scroll_deps, Gtk.Label(label=Localize("str_dependencies")))
+
+		# == Get file list asynchronously ==
+		def fill_files(deb_file, tree_store, _pkg_icon):
+			def insert_paths(items):
+				for path, size in items:
+					file_tree_insert(tree_store, path, size)
+
+			try:
+				files = deb_list_files(deb_file)
+				check_cancelled()
+				for item in files:
+					# Spread big packages over several frames
+					ui_dispatch.post_batch((tree_store, "files"), insert_paths,
+										   item, limit=2000)
+			except JobCancelled:
+				return
+			except Exception as e:
+				print(e.with_traceback(None))
+				ui_dispatch.post(tree_store.append, None, ["Error reading package"])
+				return
+			if not files:
 				return
 
-			button.connect("clicked", on_install, deb_file)
-			actions_box.pack_start(button, False, False, 0)
-
-			button = Gtk.Button(label=Localize("str_details"))
-			button.connect("clicked", self.on_details, deb_file, metadata)
-			actions_box.pack_start(button, False, False, 0)
-
-			# == TAB CONTENT ==
-			tab_box = Gtk.VBox(spacing=6)
-			tab_box.set_border_width(16)
-			tab_box.pack_start(header_box, False, False, 0)
-			notebook2 = Gtk.Notebook()
-			tab_box.pack_start(notebook2, True, True, 0)
-
-			# == Fetch control files ==
-			temp_folder = mkdtemp()
-			proc = subprocess.Popen(
-				["dpkg-deb", "-e", deb_file, temp_folder],
-				stdout=subprocess.PIPE,
-				stderr=subprocess.DEVNULL
-			)
-			proc.communicate()
-
-			# When program exits, remove temp folder
-			atexit.register(rmforce, temp_folder)
-
-			# Create a horizontal paned container to split left and right
-			control_paned = Gtk.Paned.new(Gtk.Orientation.HORIZONTAL)
-			control_paned.set_position(128) # Set initial divider position
-
-			# Create a TreeStore for hierarchical files
-			control_list_files = Gtk.ListStore(str, str)
-			control_list_files.set_sort_column_id(0, Gtk.SortType.ASCENDING)
-			# Append all control files inside the temp folder
-			for control_file in os.listdir(temp_folder):
-				with open(os.path.join(temp_folder, control_file), "r") as f:
-					control_list_files.append([control_file, f.read()])
-
-			# Create TreeView for hierarchical display
-			control_files = Gtk.TreeView(model=control_list_files)
-			control_files.set_hexpand(True)
-			control_files.set_vexpand(True)
-
-			renderer = Gtk.CellRendererText()
-			column = Gtk.TreeViewColumn(Localize("str_form_file"), renderer, text=0)
-			control_files.append_column(column)
-
-			scroll_files = Gtk.ScrolledWindow()
-			scroll_files.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
-			scroll_files.set_hexpand(True)
-			scroll_files.set_vexpand(True)
-
-			scroll_files.add(control_files)
-			control_paned.add1(scroll_files)
-
-			# Right panel: Text view for file content
-			scroll_files = Gtk.ScrolledWindow()
-			scroll_files.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
-
-			content_textview = Gtk.TextView()
-			content_textview.set_editable(False)
-			content_textview.set_wrap_mode(Gtk.WrapMode.WORD)
-			content_textview.set_monospace(True)
-
-			scroll_files.add(content_textview)
-
-			control_paned.add2(scroll_files)
-
-			# Connect selection changed signal
-			def on_control_file_selected(selection, list_store, textview):
-				"""Callback when a control file is selected in the treeview"""
-				model, treeiter = selection.get_selected()
-				if treeiter is not None:
-					# Get the content from the second column
-					content = model[treeiter][1]
-					textview.get_buffer().set_text(content)
-
-			control_files.get_selection().connect("changed", on_control_file_selected, control_list_files, content_textview)
-
-			notebook2.append_page(control_paned, Gtk.Label(label=Localize("str_control_files")))
-
-			# == Fetch contents of the package ==
-			# Create a TreeStore for hierarchical files
-			file_tree_store = Gtk.TreeStore(str, str)
-			file_tree_store.set_sort_column_id(0, Gtk.SortType.ASCENDING)
-
-			# Create TreeView for hierarchical display
-			treeview_files = Gtk.TreeView(model=file_tree_store)
-			treeview_files.set_hexpand(True)
-			treeview_files.set_vexpand(True)
-
-			renderer = Gtk.CellRendererText()
-			column = Gtk.TreeViewColumn(Localize("str_form_path"), renderer, text=0)
-			treeview_files.append_column(column)
-
-			renderer = Gtk.CellRendererText()
-			column = Gtk.TreeViewColumn(Localize("str_form_size"), renderer, text=1)
-			treeview_files.append_column(column)
-
-			# Scrollable container
-			scroll_files = Gtk.ScrolledWindow()
-			scroll_files.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
-			scroll_files.set_hexpand(True)
-			scroll_files.set_vexpand(True)
-			scroll_files.add(treeview_files)
-			notebook2.append_page(scroll_files, Gtk.Label(label=Localize("str_form_contents")))
-
-			# == Get file list asynchronously ==
-			# Helper to insert paths into tree recursively
-			def insert_path(tree_store, path: str, size: int):
-				# If path contains " -> ", don't split after it
-				path_s = path
-				path_e = None
-				symidx = path.find(" -> ")
-				if symidx != -1:
-					symidx = path.rfind("/", 0, symidx) + 1
-					path_s = path[:symidx]
-					path_e = path[symidx:]
-				parts = path_s.strip("/").split("/")
-				if path_e is not None: parts.append(path_e)
-
-				parent = None
-				current_store = tree_store
-				for i, part in enumerate(parts):
-					# Check if this node already exists under parent
-					exists = False
-					iter_ = current_store.get_iter_first() if parent is None else current_store.iter_children(parent)
-					while iter_:
-						if current_store[iter_][0] == part:
-							exists = True
-							parent = iter_
-							# Remove size from folders
-							current_store[iter_][1] = ""
-							break
-						iter_ = current_store.iter_next(iter_)
-					if not exists:
-						# Create new node
-						new_iter = current_store.append(parent, [part, format_filesize(size)])
-						parent = new_iter
-
-			def fill_files(deb_file, tree_store, _pkg_icon):
-				# Run dpkg -c to get file paths
-				_deb_files = []
-				try:
-					proc = subprocess.Popen(
-						["dpkg-deb", "-c", deb_file],
-						stdout=subprocess.PIPE,
-						stderr=subprocess.DEVNULL,
-						text=True
-					)
-					out, _ = proc.communicate()
-
-					for line in out.splitlines():
-						# dpkg -c outputs lines like:
-						# -rw-r--r-- root/root       1234 2026-01-15 12:34 ./usr/bin/example -> /usr/share/example/example
-						parts = re.sub(r'\s+', ' ', line).split()
-						if len(parts) >= 6:
-							filesize = int(parts[2])
-							filepath = " ".join(parts[5:])
-							_deb_files.append(filepath)
-							GLib.idle_add(insert_path, tree_store, filepath, filesize)
-				except Exception as e:
-					print(e.with_traceback(None))
-					GLib.idle_add(tree_store.append, None, ["Error reading package"])
-				finally:
-					# Find the most probable icon
-					if _deb_files is None or len(_deb_files) == 0:
-						return None
-
-					icon = None
-					img_formats = [".png", ".jpg", ".jpeg", ".bmp", ".svg"]
-
-					tmpf = mkdtemp()
-					atexit.register(rmforce, tmpf)
-
-					deb_desktop_files = [d for d in _deb_files if d.endswith(".desktop")]
-					if len(deb_desktop_files) > 0:
-						for df in deb_desktop_files:
-							# Extract one file in memory
-							p1 = subprocess.Popen(
-								["dpkg-deb", "--fsys-tarfile", deb_file],
-								stdout=subprocess.PIPE,
-								stderr=subprocess.DEVNULL
-							)
-							p2 = subprocess.Popen(
-								["tar", "-xO", df],
-								stdin=p1.stdout,
-								stdout=subprocess.PIPE,
-								stderr=subprocess.DEVNULL
-							)
-							# Important: allow proper pipe shutdown
-							p1.stdout.close()
-							output, _ = p2.communicate()
-							p1.wait()
-							# Read the file and find "Icon"
-							desktop_content = output.decode("utf-8")
-							for line in desktop_content.splitlines():
-								if line.startswith("Icon="):
-									icon = line[5:].strip()
-									break
-
-					def icon_score(path: str) -> int:
-						score = 0
-						p = path.lower()
-
-						# Prefer hicolor theme
-						if "/hicolor/" in p:
-							score += 50
-
-						# Prefer scalable icons
-						if "/scalable/" in p:
-							score += 40
-
-						# Prefer larger size directories (e.g. 256x256 > 128x128 > 64x64)
-						m = re.search(r'/(\d+)x\1/', p)
-						if m:
-							score += int(m.group(1))
-
-						# Slight preference for PNG over others
-						if p.endswith(".png"):
-							score += 10
-
-						return score
-
-					def icon_update(path: str) -> None:
-						# Extract image file
-						iconfile_path = os.path.join(tmpf, "iconfile")
-						with open(iconfile_path, "wb") as f:
-							p1 = subprocess.Popen(
-								["dpkg-deb", "--fsys-tarfile", deb_file],
-								stdout=subprocess.PIPE,
-								stderr=subprocess.DEVNULL
-							)
-							p2 = subprocess.Popen(
-								["tar", "-xO", path],
-								stdin=p1.stdout,
-								stdout=subprocess.PIPE,
-								stderr=subprocess.DEVNULL
-							)
-							# Important: allow proper pipe shutdown
-							p1.stdout.close()
-							output, _ = p2.communicate()
-							p1.wait()
-							f.write(output)
-
-						# Update GTK image
-						gtk_image = GdkPixbuf.Pixbuf.new_from_file_at_scale(
-							filename=iconfile_path,
-							width=64, height=64,
-							preserve_aspect_ratio=True
-						)
-						GLib.idle_add(_pkg_icon.set_from_pixbuf, gtk_image)
-
-					if icon:
-						# Icons found, use the first one
-						if icon.startswith("/"):
-							# Easy, it's an absolute path inside the package
-							icon = "." + icon
-						else:
-							# Check if file has one of the supported formats
-							raw_look = False
-							for fmt in img_formats:
-								if icon.endswith(fmt):
-									raw_look = True
-									break
-
-							if raw_look:
-								possible_icons = [d for d in _deb_files if d.endswith(icon)]
-							else:
-								# Try searching the Icon in some common image folders
-								possible_icons = []
-								for fmt in img_formats:
-									possible_icons += [d for d in _deb_files if d.endswith(icon + fmt)]
-
-							# Select the most probable icon from possible_icons
-							possible_icons.sort(key=icon_score, reverse=True)
-							icon = possible_icons[0]
-
-						icon_update(icon)
-						return
-
-					# Desktop files do not provide any icon,
-					# use the default icon
-					gtk_image = GdkPixbuf.Pixbuf.new_from_file_at_scale(
-						filename="/usr/share/vapt/images/application-x-deb.png",
-						width=64, height=64,
-						preserve_aspect_ratio=True
-					)
-					GLib.idle_add(_pkg_icon.set_from_pixbuf, gtk_image)
-					return
+			# Find the most probable icon, or use the default one
+			icon = deb_find_icon(deb_file, [path for path, _ in files])
+			pixbuf = deb_load_icon(deb_file, icon, 64) if icon else None
+			if pixbuf is None:
+				pixbuf = load_pixbuf("/usr/share/vapt/images/application-x-deb.png", 64)
+			ui_dispatch.post_latest((_pkg_icon, "icon"), _pkg_icon.set_from_pixbuf, pixbuf)
 
-			# Start the thread
-			thread = threading.Thread(target=fill_files, args=[deb_file, file_tree_store, pkg_icon], daemon=True).start()
+		# List files and look for the icon in the background
+		job_scheduler.submit(fill_files, deb_file, file_tree_store, pkg_icon,
+							 priority=PRIORITY_PREFETCH, source=(self, "files", deb_file))
 
-			notebook.append_page(tab_box, Gtk.Label(label=metadata["Package"]))
+		self.notebook.append_page(tab_box, Gtk.Label(label=metadata["Package"]))
+		self.tabs[deb_file] = tab_box
+		self.deps_tabs.append((control, label_deps, deps_list))
+		return True
 
-		pkg_count = len(self.list_installs) + len(self.list_reinstalls)
-		if pkg_count > 1:
-			big_btn_install = Gtk.Button(label=Localize("str_install_x_packages") % pkg_count)
-			big_btn_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
-			big_btn_box.set_border_width(6)
-			big_btn_box.pack_start(big_btn_install, True, True, 8)
-
-			def on_big_install(button):
-				# Show confirmation dialog
-				dialog = Gtk.MessageDialog(
-					parent=self,
-					flags=0,
-					message_type=Gtk.MessageType.INFO,
-					buttons=Gtk.ButtonsType.OK_CANCEL,
-					text=Localize("str_summary_of_operations_local") % (
-						len(self.list_installs),
-						len(self.list_reinstalls)
-					)
+
+	def add_big_buttons(self, pkg_count: int):
+		"""Install all / verify all bar, once there are several packages"""
+		self.big_btn_install = Gtk.Button(label=Localize("str_install_x_packages") % pkg_count)
+		big_btn_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+		big_btn_box.set_border_width(6)
+		big_btn_box.pack_start(self.big_btn_install, True, True, 8)
+
+		def on_big_install(button):
+			# Show confirmation dialog
+			dialog = Gtk.MessageDialog(
+				parent=self,
+				flags=0,
+				message_type=Gtk.MessageType.INFO,
+				buttons=Gtk.ButtonsType.OK_CANCEL,
+				text=Localize("str_summary_of_operations_local") % (
+					len(self.list_installs),
+					len(self.list_reinstalls)
 				)
-				response = dialog.run()
-				dialog.destroy()
-				if response != Gtk.ResponseType.OK:
-					return
+			)
+			response = dialog.run()
+			dialog.destroy()
+			if response != Gtk.ResponseType.OK:
+				return
 
+			quit_on_finnish = self.sigid_destroy is not None
+			if quit_on_finnish:
 				GLib.idle_add(self.disconnect, self.sigid_destroy)
-				LocalInstallerWindow(self.list_installs,
-					self.list_reinstalls,
-					quit_on_finnish=True)
-				GLib.idle_add(self.destroy)
+			LocalInstallerWindow(self.list_installs,
+				self.list_reinstalls,
+				quit_on_finnish=quit_on_finnish)
+			GLib.idle_add(self.destroy)
+
+		self.big_btn_install.connect("clicked", on_big_install)
+
+		# Verify every open package at once, spread over the verify pool
+		big_btn_verify = Gtk.Button(label=Localize("str_verify_all"))
+		big_btn_verify.connect("clicked",
+			lambda _: [b.clicked() for b in self.verify_buttons])
+		big_btn_box.pack_start(big_btn_verify, False, True, 8)
+
+		self.main_box.pack_start(big_btn_box, False, True, 0)
+
+	def check_dependencies(self):
+		index = get_package_index()
+		local_controls = [tab[0] for tab in self.deps_tabs]
+		for control, label, deps_list in self.deps_tabs:
+			report = deb_check_relations(control, index, local_controls)
+			ui_dispatch.post(self.show_dependencies, report, label, deps_list)
+
+	def show_dependencies(self, report: DebRelationReport, label, deps_list):
+		deps_list.clear()
+		# Problems first
+		for state in ("missing", "conflict", "ok"):
+			for field, relation, st, detail in report.entries:
+				if st == state:
+					deps_list.append([field, relation,
+									  Localize("str_deps_state_" + state), detail])
+
+		missing = report.count("missing")
+		conflicts = report.count("conflict")
+		if not missing and not conflicts:
+			label.set_text(Localize("str_deps_ok"))
+			return
+		text = Localize("str_deps_problems") % (missing, conflicts)
+		if not report.installable:
+			text = "<span foreground='red'>%s</span>" % GLib.markup_escape_text(text)
+		else:
+			text = GLib.markup_escape_text(text)
+		label.set_markup(text)
 
-			big_btn_install.connect("clicked", on_big_install)
+	def on_details(self, button, file, metadata):
+		PackageInfoWindow(metadata["Package"], metadata["Version"], False, local_pkg=file)
 
-			main_box.pack_start(big_btn_box, False, True, 0)
+	def on_verify(self, button, deb_file, label, integrity_list):
+		# Prevent double verify
+		if not button.get_sensitive(): return
+		button.set_sensitive(False)
 
-		self.sigid_destroy = self.connect("destroy", Gtk.main_quit)
-		self.show_all()
+		label.set_text(Localize("str_integrity_verifying"))
+		label.show()
+		integrity_list.clear()
 
-	def on_details(self, button, file, metadata):
-		PackageInfoWindow(metadata["Package"], metadata["Version"], False, local_pkg=file)
+		def on_result(res: DebVerifyResult):
+			if res.error is not None:
+				label.set_text(Localize("str_integrity_error") % res.error)
+				button.set_sensitive(True)
+				return
+
+			for path in res.mismatched:
+				integrity_list.append([path, Localize("str_integrity_mismatch")])
+			for path in res.missing:
+				integrity_list.append([path, Localize("str_integrity_missing")])
+
+			speed = format_filesize(int(res.throughput)) + "/s"
+			if res.ok:
+				label.set_text(Localize("str_integrity_ok") % (
+					res.files_checked, format_filesize(res.bytes_hashed), speed))
+			else:
+				label.set_markup("<span foreground='red'>%s</span>" % GLib.markup_escape_text(
+					Localize("str_integrity_failed") % (
+						len(res.mismatched), len(res.missing), speed)))
+			button.set_sensitive(True)
+
+		deb_verify_async(deb_file, lambda res: ui_dispatch.post(on_result, res),
+						 source=(self, "verify", deb_file))
 
 	def exit_error(self, msg):
 		# Show MessageDialog
@@ -2047,7 +6499,7 @@ class LocalPackageWindow(Gtk.Window):
 
 
 class UpdaterWindow(Gtk.Window):
-	def __init__(self):
+	def __init__(self, start_update: bool = True):
 		super().__init__(title=Localize("str_updater_title"))
 		self.set_default_size(480, 0)
 		self.set_border_width(16)
@@ -2070,6 +6522,25 @@ class UpdaterWindow(Gtk.Window):
 		self.progressbar.pulse()
 		vbox.pack_start(self.progressbar, False, True, 0)
 
+		# Per-source table, filled as apt reports each item
+		self.stats = AptUpdateStats()
+		self.list_sources = Gtk.ListStore(str, int, int, int, int, str, str)
+		self.source_iters = {}
+		treeview = Gtk.TreeView(model=self.list_sources)
+		for i, title in enumerate((Localize("str_source_uri"), "Hit", "Get", "Ign", "Err",
+								   Localize("str_form_size"), Localize("str_updater_duration"))):
+			column = Gtk.TreeViewColumn(title, Gtk.CellRendererText(), text=i)
+			column.set_sort_column_id(i)
+			treeview.append_column(column)
+		treeview.set_tooltip_column(0)
+
+		sources_scroll = Gtk.ScrolledWindow()
+		sources_scroll.set_policy(Gtk.PolicyType.AUTOMATIC,
+								  Gtk.PolicyType.AUTOMATIC)
+		sources_scroll.set_min_content_height(120)
+		sources_scroll.add(treeview)
+		vbox.pack_start(sources_scroll, True, True, 0)
+
 		# Expandable log area
 		expander = Gtk.Expander(label=Localize("str_show_details"))
 		expander.set_hexpand(True)
@@ -2094,47 +6565,65 @@ class UpdaterWindow(Gtk.Window):
 		self.sigid_destroy = self.connect("destroy", self.on_destroy)
 		self.show_all()
 
-		# Start worker thread
 		self.textbuffer = self.textview.get_buffer()
-		threading.Thread(target=self.run_command, daemon=True).start()
+		if start_update:
+			self.start_update()
 
-	def update_log(self, text):
-		self.label.set_text(text.strip())
+	def start_update(self):
+		"""Run apt-get update in a worker thread"""
+		job_scheduler.submit(self.run_command, long=True)
+
+	def update_log(self, lines: list):
+		"""Append the lines output since the last frame"""
+		self.label.set_text(lines[-1].strip())
 		end_iter = self.textbuffer.get_end_iter()
-		self.textbuffer.insert(end_iter, text)
+		self.textbuffer.insert(end_iter, "".join(lines))
 		# Scroll to bottom
 		mark = self.textbuffer.create_mark(None, self.textbuffer.get_end_iter(),
 										   False)
 		self.textview.scroll_to_mark(mark, 0.0, True, 0.0, 1.0)
 
+	def update_sources(self, rows: list):
+		"""Show the latest per-source counters"""
+		for row in rows:
+			values = [row["source"], row["hit"], row["get"], row["ign"], row["err"],
+					  format_filesize(row["bytes"]), "%.1f s" % row["seconds"]]
+			it = self.source_iters.get(row["source"])
+			if it is None:
+				self.source_iters[row["source"]] = self.list_sources.append(values)
+			else:
+				self.list_sources.set(it, list(range(len(values))), values)
+
 	def run_command(self):
-		cmd = [*APT_LANG_USER, *APT_NONINTERACTIVE, "apt-get", "update", "-y"]
-		GLib.idle_add(self.update_log, " ".join(cmd) + "\n")
-		self.proc = subprocess.Popen(
-			cmd,
-			stdout=subprocess.PIPE,
-			stderr=subprocess.STDOUT,
-			text=True, bufsize=1
-		)
+		cmd = ["apt-get", "update", "-y"]
+		ui_dispatch.post_batch((self, "log"), self.update_log, " ".join(cmd) + "\n")
+		self.proc = apt_transaction(cmd)
 
-		for line in self.proc.stdout:
-			GLib.idle_add(self.progressbar.pulse)
+		output = []
+		for line in self.proc.lines():
+			ui_dispatch.post_latest((self, "progress"), self.progressbar.pulse)
 			if line:
-				GLib.idle_add(self.update_log, line)
+				output.append(line)
+				ui_dispatch.post_batch((self, "log"), self.update_log, line)
+				if self.stats.feed(line):
+					ui_dispatch.post_latest((self, "sources"), self.update_sources, self.stats.rows())
 
 		# Check return code
 		self.proc.wait()
+		self.stats.save(self.proc.returncode)
+		# Re-read just what was downloaded
+		apt_reindex(apt_update_fetched(output))
 		if self.proc.returncode != 0:
-			GLib.idle_add(self.progressbar.set_fraction, 1.0)
-			GLib.idle_add(self.label.set_text, Localize("str_error"))
+			ui_dispatch.post_latest((self, "progress"), self.progressbar.set_fraction, 1.0)
+			ui_dispatch.post_latest((self, "label"), self.label.set_text, Localize("str_error"))
 			return
 
-		GLib.idle_add(self.progressbar.set_fraction, 1.0)
-		GLib.idle_add(self.label.set_text, Localize("str_done"))
+		ui_dispatch.post_latest((self, "progress"), self.progressbar.set_fraction, 1.0)
+		ui_dispatch.post_latest((self, "label"), self.label.set_text, Localize("str_done"))
 
-		GLib.idle_add(self.disconnect, self.sigid_destroy)
-		GLib.idle_add(self.open_main_window)
-		GLib.idle_add(self.destroy)
+		ui_dispatch.post(self.disconnect, self.sigid_destroy)
+		ui_dispatch.post(self.open_main_window)
+		ui_dispatch.post(self.destroy)
 
 	def on_destroy(self, button):
 		if hasattr(self, 'proc') and self.proc and self.proc.poll() is None:
@@ -2161,84 +6650,177 @@ def show_about_dialog():
 # ==== MAIN ==== #
 
 
-def is_valid_l10n_file(yml: dict) -> bool:
-	locales = yml.get('locales', [])
-	strings = yml.get('strings', {})
-	displayName = yml.get('displayName', "")
-	return locales and strings and displayName
+def parse_args(argv: list):
+	import argparse
+	parser = argparse.ArgumentParser(prog="vapt", description="Visual APT Manager")
+	parser.add_argument("files", nargs="*",
+		help="local .deb packages to install")
+	parser.add_argument("--profile-startup", action="store_true",
+		help="print the time spent in every startup phase after the first paint "
+			 "(the first apt-get update only starts after it)")
+	parser.add_argument("--startup-budget", type=float, metavar="MS", default=None,
+		help="profile the startup (implies --profile-startup), quit after the "
+			 "first paint and exit with status 1 if it took longer than MS")
+	parser.add_argument("--new-instance", action="store_true",
+		help="open the files here instead of in the vapt already running")
+	parser.add_argument("--apt-helper", action="store_true", help=argparse.SUPPRESS)
+	parser.add_argument("--daemon", action="store_true",
+		help="run the resident backend on VAPT_DAEMON_SOCKET (default: %s) "
+			 "instead of opening a window" % daemon_socket_path)
+	parser.add_argument("--profile-commands", action="store_true",
+		help="print latency, output size and parse time of every external "
+			 "command on exit")
+	parser.add_argument("--profile-jobs", action="store_true",
+		help="print queue depth and wait/run latency of background jobs on exit")
+	parser.add_argument("--profile-dispatch", action="store_true",
+		help="print events per frame and the longest UI update handler on exit")
+	parser.add_argument("--record-session", metavar="FILE", default=None,
+		help="save every command vapt runs, with its output and timing, "
+			 "into a zip archive on exit, along with the dpkg status and apt "
+			 "lists as they are at startup")
+	parser.add_argument("--replay-session", metavar="FILE", default=None,
+		help="serve the commands of a recorded session instead of running them, "
+			 "and read its dpkg status and apt lists")
+	parser.add_argument("--replay-latency", choices=("original", "zero"), default="original",
+		help="with --replay-session, keep the recorded timing or answer at once "
+			 "(default: original)")
+	parser.add_argument("--trace-main-loop", metavar="FILE", default=None,
+		help="time every GTK handler, log main loop stalls and write a Chrome "
+			 "trace-event JSON file on exit")
+	parser.add_argument("--stall-threshold", type=float, metavar="MS",
+		default=STALL_THRESHOLD_MS,
+		help="with --trace-main-loop, log handlers blocking the main loop "
+			 "longer than MS (default: %d)" % STALL_THRESHOLD_MS)
+	args = parser.parse_args(argv)
+	if args.startup_budget is not None:
+		args.profile_startup = True
+	return args
+
+startup_exit_status = 0
+
+def profile_first_paint(window: Gtk.Window, args):
+	"""Report the startup profile once window has been drawn"""
+	def on_draw(widget, cr):
+		global startup_exit_status
+		widget.disconnect(handler_id)
+		startup_profile.mark("first_paint")
+
+		budget = args.startup_budget
+		startup_profile.report(budget if budget is not None else STARTUP_BUDGET_MS)
+		if budget is not None:
+			# Enforcement mode: stop right here
+			startup_exit_status = 0 if startup_profile.total_ms <= budget else 1
+			GLib.idle_add(widget.destroy)
+		elif isinstance(widget, UpdaterWindow):
+			# Held back so it did not compete with the startup measured
+			widget.start_update()
+		return False
+	handler_id = window.connect_after("draw", on_draw)
 
 
 if __name__ == "__main__":
+	args = parse_args(sys.argv[1:])
+	if args.apt_helper:
+		sys.exit(apt_helper_main())
+	if args.daemon:
+		sys.exit(daemon_main())
+	if args.record_session:
+		session_recorder = SessionRecorder(args.record_session)
+		atexit.register(session_recorder.write)
+	if args.replay_session:
+		session_replay = SessionReplay(args.replay_session,
+									   latency=args.replay_latency == "original")
+		session_replay.use_package_files()
+	if session_recorder is not None or session_replay is not None:
+		# The query helper talks over a pipe, go through apt-cache instead
+		apt_helper.disabled = True
+	if args.profile_commands:
+		atexit.register(print_command_stats)
+	if args.profile_jobs:
+		atexit.register(print_job_stats)
+	if args.profile_dispatch:
+		atexit.register(print_ui_dispatch_stats)
+	if args.trace_main_loop:
+		main_loop_tracer = MainLoopTracer(args.trace_main_loop, args.stall_threshold)
+		main_loop_tracer.install()
+
+	# Single instance: files go to the running vapt, before any startup work
+	if not args.new_instance:
+		if args.files and instance_forward(args.files):
+			sys.exit(0)
+		try:
+			instance_server = InstanceServer(open_local_packages)
+		except OSError:
+			# Another instance won the race
+			if args.files and instance_forward(args.files):
+				sys.exit(0)
+
+	startup_profile.mark("single_instance")
+	if args.profile_startup:
+		# Whichever reads YAML first imports it, reported apart
+		import yaml
+		startup_profile.mark("yaml_import", counted=False)
+
 	# Load config
-	if os.path.isfile(user_config_path):
-		with open(user_config_path, 'r', encoding="utf-8") as file:
-			user_config = yaml.safe_load(file)
+	user_config.load()
+	startup_profile.mark("config")
 
-	# Load fallback l10n
-	if not os.path.exists(master_lang_file_path):
+	# Load compiled l10n index, only changed files are parsed
+	l10n_index = l10n_catalog_index(l10n_dir)
+
+	# Check fallback l10n
+	if master_lang_file_path not in l10n_index:
 		print("Default language file doesn't exists: %s." %
 			  master_lang_file_path, file=sys.stderr)
 		sys.exit(1)
-	with open(master_lang_file_path, mode="r", encoding="utf-8") as f:
-		yml = yaml.safe_load(f)
-		if not is_valid_l10n_file(yml):
-			print("Malformed default language file: %s." %
-				  master_lang_file_path, file=sys.stderr)
-			sys.exit(1)
-		l10n_strings_master = yml.get('strings', {})
+	if not l10n_index[master_lang_file_path]["valid"]:
+		print("Malformed default language file: %s." %
+			  master_lang_file_path, file=sys.stderr)
+		sys.exit(1)
 
 
 	# Save user terminal language
-	APT_LANG_USER.extend(["env", "LANGUAGE=%s" % os.environ.get("LANGUAGE", "C")])
-	APT_LANG_USER.extend(["env", "LANG=%s" % os.environ.get("LANG", "C")])
-	APT_LANG_USER.extend(["env", "LC=%s" % os.environ.get("LC", "C")])
-	APT_LANG_USER.extend(["env", "LC_ALL=%s" % os.environ.get("LC_ALL", "C")])
-	APT_LANG_USER.extend(["env", "LC_MESSAGES=%s" % os.environ.get("LC_MESSAGES", "C")])
+	for var in ("LANGUAGE", "LANG", "LC", "LC_ALL", "LC_MESSAGES"):
+		APT_ENV_USER[var] = os.environ.get(var, "C")
 
 	# Load user localization
 	os_lang = os.environ.get("LANG", "en_US.UTF-8")
 	gtk_lang = os_lang
-	lang_files = glob.glob("/usr/share/vapt/l10n/*.yml", recursive=True)
-	user_lang_override = user_config["editor"]["l10n_file"]
+	user_lang_override = user_config.get("editor/l10n_file")
 
 	# Search for a file supporting this locale
 	found = False if user_lang_override == "" else True
-	for lang_file in lang_files:
-		with open(lang_file, mode="r", encoding="utf-8") as f:
-			yml = yaml.safe_load(f)
-			if not is_valid_l10n_file(yml):
-				continue
-
-			# Save for combobox
-			langs_available.append(
-				{"display": yml.get('displayName', ""), "file": lang_file})
-
-			# Check if it's the user override
-			if user_lang_override == lang_file:
+	for lang_file, entry in l10n_index.items():
+		if not entry["valid"]:
+			continue
+
+		# Save for combobox
+		langs_available.append(
+			{"display": entry["displayName"], "file": lang_file})
+
+		# Check if it's the user override
+		if user_lang_override == lang_file:
+			lang_file_path = lang_file
+			gtk_lang = (entry["locales"] or [os_lang])[0]
+
+		# If found, skip
+		if found:
+			continue
+
+		# Check that locale is supported by this file
+		for locale in entry["locales"]:
+			if locale in os_lang:
 				lang_file_path = lang_file
-				gtk_lang = yml.get('locales', [os_lang])[0]
-				l10n_strings = yml.get('strings', {})
-
-			# If found, skip
-			if found:
-				continue
-
-			# Check that locale is supported by this file
-			for locale in yml.get('locales', []):
-				if locale in os_lang:
-					lang_file_path = lang_file
-					l10n_strings = yml.get('strings', {})
-					found = True
-					break
+				found = True
+				break
 
 	if lang_file_path is None:
 		if user_lang_override != "":
 			print("Could not find language file: %s" %
 				  user_lang_override, file=sys.stderr)
-			l10n_strings = l10n_strings_master
 		print("Could not find language file supporting locale: %s" %
 			  os_lang, file=sys.stderr)
-		l10n_strings = l10n_strings_master
+		lang_file_path = master_lang_file_path
 
 	# Set system lang label
 	langs_available[0]["display"] = Localize("str_settings_language_default")
@@ -2249,12 +6831,19 @@ if __name__ == "__main__":
 	os.environ["LC"] = gtk_lang
 	os.environ["LC_ALL"] = gtk_lang
 	os.environ["LC_MESSAGES"] = gtk_lang
+	startup_profile.mark("l10n")
 	Gtk.init([])
+	startup_profile.mark("gtk_init")
 
 	# Check if opened a file as argument
-	if len(sys.argv) > 1:
-		LocalPackageWindow(sys.argv[1:])
+	if args.files:
+		first_window = LocalPackageWindow(args.files)
 	else:
 		# Launch first window
-		UpdaterWindow()
+		first_window = UpdaterWindow(start_update=not args.profile_startup)
+	startup_profile.mark("first_window")
+
+	if args.profile_startup:
+		profile_first_paint(first_window, args)
 	Gtk.main()
+	sys.exit(startup_exit_status)